@@ -0,0 +1,104 @@
+# -*- encoding: utf-8 -*-
+"""
+libpydhcpserver benchmark: dhcp_mmsg
+
+Purpose
+=======
+ Compares batched datagram reads with one system-call per datagram, over the
+ loopback interface, for DHCP-sized datagrams.
+ 
+ Run from libpydhcpserver/ with: python benchmarks/mmsg_loopback.py
+ 
+Legal
+=====
+ This file is part of libpydhcpserver.
+ libpydhcpserver is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from libpydhcpserver import dhcp_mmsg
+
+DATAGRAMS = 2000 #: The number of datagrams per round; small enough to fit in the receive-buffer.
+ROUNDS = 5 #: The number of rounds timed; the best is reported.
+PAYLOAD = 'x' * 300 #: A typical DHCP packet.
+
+def _socketPair():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    receiver.bind(('127.0.0.1', 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return (receiver, sender)
+    
+def _fill(receiver, sender):
+    address = receiver.getsockname()
+    for i in xrange(DATAGRAMS):
+        sender.sendto(PAYLOAD, address)
+        
+def _receiveIndividually(receiver):
+    count = 0
+    while True:
+        try:
+            receiver.recvfrom(4096, socket.MSG_DONTWAIT)
+        except socket.error:
+            return count
+        count += 1
+        
+def _receiveBatched(batch_receiver):
+    def _receive(receiver):
+        count = 0
+        while True:
+            received = len(batch_receiver.receive(receiver))
+            if not received:
+                return count
+            count += received
+    return _receive
+    
+def _timeReceive(receive):
+    (receiver, sender) = _socketPair()
+    best = None
+    for i in xrange(ROUNDS):
+        _fill(receiver, sender)
+        start = time.time()
+        count = receive(receiver)
+        elapsed = time.time() - start
+        if count != DATAGRAMS:
+            raise AssertionError("Received %(count)i of %(datagrams)i datagrams; enlarge net.core.rmem_max" % {
+             'count': count,
+             'datagrams': DATAGRAMS,
+            })
+        best = min(best or elapsed, elapsed)
+    receiver.close()
+    sender.close()
+    return best
+    
+def _report(operation, individual, batched):
+    print("%(operation)-8s recvfrom: %(individual)6.2fus/datagram  mmsg: %(batched)6.2fus/datagram  (%(ratio).1fx)" % {
+     'operation': operation,
+     'individual': individual / DATAGRAMS * 1000000,
+     'batched': batched / DATAGRAMS * 1000000,
+     'ratio': individual / batched,
+    })
+    
+if __name__ == '__main__':
+    if not dhcp_mmsg.AVAILABLE:
+        print("recvmmsg() is unavailable; only the fallback would be measured")
+        sys.exit(1)
+    _report('receive', _timeReceive(_receiveIndividually), _timeReceive(_receiveBatched(dhcp_mmsg.BatchReceiver(64))))
+    
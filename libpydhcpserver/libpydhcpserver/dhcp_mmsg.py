@@ -0,0 +1,262 @@
+# -*- encoding: utf-8 -*-
+"""
+libpydhcpserver module: dhcp_mmsg
+
+Purpose
+=======
+ Provides batched datagram reads, using Linux's recvmmsg() via ctypes where
+ available and an equivalent, pure-Python loop elsewhere.
+
+Legal
+=====
+ This file is part of libpydhcpserver.
+ libpydhcpserver is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+
+_libc = None #: The C library, if it exposes recvmmsg().
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.recvmmsg
+    except (OSError, AttributeError):
+        _libc = None
+AVAILABLE = _libc is not None #: True if native batched reads are supported on this platform.
+
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+     ('iov_base', ctypes.c_void_p),
+     ('iov_len', ctypes.c_size_t),
+    ]
+    
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+     ('sin_family', ctypes.c_ushort),
+     ('sin_port', ctypes.c_ubyte * 2), #Network byte-order.
+     ('sin_addr', ctypes.c_ubyte * 4), #Network byte-order.
+     ('sin_zero', ctypes.c_char * 8),
+    ]
+    
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+     ('msg_name', ctypes.c_void_p),
+     ('msg_namelen', ctypes.c_uint32),
+     ('msg_iov', ctypes.POINTER(_iovec)),
+     ('msg_iovlen', ctypes.c_size_t),
+     ('msg_control', ctypes.c_void_p),
+     ('msg_controllen', ctypes.c_size_t),
+     ('msg_flags', ctypes.c_int),
+    ]
+    
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [
+     ('msg_hdr', _msghdr),
+     ('msg_len', ctypes.c_uint),
+    ]
+    
+if AVAILABLE:
+    _libc.recvmmsg.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p)
+    _libc.recvmmsg.restype = ctypes.c_int
+    
+_MMSGHDR_SIZE = ctypes.sizeof(_mmsghdr) #: The size of an mmsghdr structure.
+_SOCKADDR_SIZE = ctypes.sizeof(_sockaddr_in) #: The size of a sockaddr_in structure.
+
+_layouts = {} #: Compiled Structs that cover whole arrays of headers or addresses, keyed by (kind, count).
+def _getLayout(kind, count):
+    """
+    Provides a compiled C{struct.Struct} that reads or writes one field of
+    every element in an array with a single call, which is far cheaper than
+    touching each element through ctypes.
+    
+    @type kind: basestring
+    @param kind: 'lengths' for the msg_len fields of mmsghdrs, 'addresses'
+        for sockaddr_ins, or 'iovecs' for iovecs.
+    @type count: int
+    @param count: The number of elements in the array.
+    
+    @rtype: C{struct.Struct}
+    @return: The compiled layout.
+    """
+    layout = _layouts.get((kind, count))
+    if layout is None:
+        if kind == 'lengths':
+            offset = _mmsghdr.msg_len.offset
+            element = '%(offset)ixI%(padding)ix' % {
+             'offset': offset,
+             'padding': _MMSGHDR_SIZE - offset - 4,
+            }
+        elif kind == 'addresses':
+            element = '>HH4s%(padding)ix' % {
+             'padding': _SOCKADDR_SIZE - 8,
+            }
+        else:
+            element = 'PL'
+        if kind == 'addresses':
+            layout = struct.Struct('>' + element[1:] * count)
+        else:
+            layout = struct.Struct(element * count)
+        _layouts[(kind, count)] = layout
+    return layout
+    
+_hosts = {} #: Dotted-quad renderings of recently seen packed IPv4 addresses.
+def _getHost(address):
+    """
+    Renders a packed IPv4 address in dotted-quad form, caching results
+    because the same relays recur constantly.
+    
+    @type address: str
+    @param address: A packed IPv4 address.
+    
+    @rtype: str
+    @return: The dotted-quad address.
+    """
+    host = _hosts.get(address)
+    if host is None:
+        if len(_hosts) >= 4096:
+            _hosts.clear()
+        host = socket.inet_ntoa(address)
+        _hosts[address] = host
+    return host
+    
+def _raiseErrno():
+    """
+    Raises the pending C-level error as a C{socket.error}.
+    
+    @raise socket.error: Always.
+    """
+    error = ctypes.get_errno()
+    raise socket.error(error, errno.errorcode.get(error, str(error)))
+    
+def _allocate(count):
+    """
+    Allocates arrays of message-headers, scatter/gather descriptors, and
+    addresses, with every header pointing at its own descriptor and address,
+    so that per-call work is limited to reading back lengths and sources.
+    
+    @type count: int
+    @param count: The number of messages to allocate.
+    
+    @rtype: tuple(3)
+    @return: (headers:_mmsghdr[count], iovecs:_iovec[count],
+        addresses:_sockaddr_in[count]).
+    """
+    headers = (_mmsghdr * count)()
+    iovecs = (_iovec * count)()
+    addresses = (_sockaddr_in * count)()
+    for i in xrange(count):
+        header = headers[i].msg_hdr
+        header.msg_name = ctypes.addressof(addresses[i])
+        header.msg_namelen = _SOCKADDR_SIZE
+        header.msg_iov = ctypes.pointer(iovecs[i])
+        header.msg_iovlen = 1
+        addresses[i].sin_family = socket.AF_INET
+    return (headers, iovecs, addresses)
+    
+class BatchReceiver(object):
+    """
+    Reads many datagrams from a socket with a single call to recvmmsg(),
+    using buffers allocated once and reused for every call.
+    
+    An instance must only be used by one thread at a time.
+    """
+    _batch_size = None #: The maximum number of datagrams to read per call.
+    _buffer_size = None #: The maximum size of a single datagram.
+    _buffer = None #: The memory into which datagrams are read.
+    _headers = None #: The recvmmsg() message-headers.
+    _iovecs = None #: The scatter/gather descriptors that point into L{_buffer}.
+    _addresses = None #: The source-addresses of received datagrams.
+    
+    def __init__(self, batch_size, buffer_size=4096):
+        """
+        Allocates the buffers needed to receive datagrams.
+        
+        @type batch_size: int
+        @param batch_size: The maximum number of datagrams to read per call.
+        @type buffer_size: int
+        @param buffer_size: The maximum size of a single datagram.
+        """
+        self._batch_size = batch_size = max(1, batch_size)
+        self._buffer_size = buffer_size
+        if not AVAILABLE:
+            return
+            
+        self._buffer = ctypes.create_string_buffer(batch_size * buffer_size)
+        (self._headers, self._iovecs, self._addresses) = _allocate(batch_size)
+        base = ctypes.addressof(self._buffer)
+        iovecs = []
+        for i in xrange(batch_size):
+            iovecs.extend((base + i * buffer_size, buffer_size))
+        _getLayout('iovecs', batch_size).pack_into(self._iovecs, 0, *iovecs)
+        
+    def receive(self, sock, limit=None):
+        """
+        Reads every datagram waiting on C{sock}, up to C{limit}, without
+        blocking.
+        
+        @type sock: socket.socket
+        @param sock: The socket from which to read.
+        @type limit: int|None
+        @param limit: The maximum number of datagrams to read; if None, the
+            batch-size is used.
+        
+        @rtype: list
+        @return: A collection of (data:str, (host:basestring, port:int))
+            values; empty if nothing was waiting.
+        
+        @raise socket.error: A problem occurred while reading.
+        """
+        limit = min(limit or self._batch_size, self._batch_size)
+        if not AVAILABLE:
+            datagrams = []
+            while len(datagrams) < limit:
+                try:
+                    datagrams.append(sock.recvfrom(self._buffer_size, _MSG_DONTWAIT))
+                except socket.error, e:
+                    if not e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                        raise
+                    break
+                if not _MSG_DONTWAIT: #Only one read is known not to block.
+                    break
+            return datagrams
+            
+        #msg_namelen needs no reset: the kernel always writes back the size of
+        #a sockaddr_in, which is what it was initialised to.
+        count = _libc.recvmmsg(sock.fileno(), ctypes.addressof(self._headers), limit, _MSG_DONTWAIT, None)
+        if count < 0:
+            if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            _raiseErrno()
+            
+        lengths = _getLayout('lengths', count).unpack_from(self._headers)
+        addresses = _getLayout('addresses', count).unpack_from(self._addresses)
+        buffer = self._buffer
+        buffer_size = self._buffer_size
+        datagrams = []
+        for i in xrange(count):
+            start = i * buffer_size
+            datagrams.append((
+             buffer[start:start + lengths[i]],
+             (_getHost(addresses[i * 3 + 2]), addresses[i * 3 + 1]),
+            ))
+        return datagrams
+        
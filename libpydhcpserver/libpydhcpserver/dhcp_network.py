@@ -26,12 +26,155 @@ Legal
  (C) Matthew Boedicker, 2011 <matthewm@boedicker.org>
  (C) Mathieu Ignacio, 2008 <mignacio@april.org>
 """
+import collections
+import errno
 import select
 import socket
 import threading
+import traceback
 
+import dhcp_mmsg
 import dhcp_packet
 
+IO_STANDARD = 'standard' #: Datagrams are read and written one system-call at a time.
+IO_MMSG = 'mmsg' #: Datagrams are read in batches, with recvmmsg() where available, and written individually.
+
+#Not exposed by the socket module before Python 3.4; this is Linux's value.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15) #: The socket option that allows several sockets to share a port.
+
+OVERFLOW_DROP_OLDEST = 'drop-oldest' #: When the work-queue is full, discard the packet that has waited longest.
+OVERFLOW_DROP_NEWEST = 'drop-newest' #: When the work-queue is full, discard the packet that just arrived.
+OVERFLOW_SHED_BY_TYPE = 'shed-by-type' #: When the work-queue is full, discard the least important packet.
+
+#The relative importance of each DHCP message-type, used when shedding load.
+#REQUESTs complete handshakes already in progress, so they are kept longest;
+#DISCOVERs are cheap for clients to retransmit, so they go first.
+_MESSAGE_PRIORITIES = {
+ 1: 0, #DISCOVER
+ 10: 1, #LEASEQUERY
+ 8: 2, #INFORM
+ 4: 3, #DECLINE
+ 7: 3, #RELEASE
+ 3: 4, #REQUEST
+}
+
+class _WorkerPool(object):
+    """
+    A fixed collection of threads that process packets from a bounded queue,
+    avoiding the cost of spawning a thread for every packet received.
+    """
+    _queue = None #: The (priority, handler, args) work-items waiting to be processed.
+    _queue_size = None #: The number of work-items that may be queued at once.
+    _overflow_policy = None #: The policy applied when the queue is full.
+    _condition = None #: Used to synchronize access to the queue and wake idle workers.
+    _peak_depth = 0 #: The deepest the queue has been since the last time stats were read.
+    _overflowed = 0 #: The number of work-items discarded since the last time stats were read.
+    
+    def __init__(self, threads, queue_size, overflow_policy):
+        """
+        Spawns the worker threads.
+        
+        @type threads: int
+        @param threads: The number of worker threads to run.
+        @type queue_size: int
+        @param queue_size: The number of packets that may wait for a worker.
+        @type overflow_policy: basestring
+        @param overflow_policy: One of L{OVERFLOW_DROP_OLDEST},
+            L{OVERFLOW_DROP_NEWEST}, or L{OVERFLOW_SHED_BY_TYPE}.
+        
+        @raise ValueError: The overflow policy is unknown.
+        """
+        if not overflow_policy in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_SHED_BY_TYPE):
+            raise ValueError("Unknown overflow policy: %(policy)s" % {
+             'policy': overflow_policy,
+            })
+        self._queue = collections.deque()
+        self._queue_size = max(1, queue_size)
+        self._overflow_policy = overflow_policy
+        self._condition = threading.Condition()
+        
+        for i in xrange(max(1, threads)):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            
+    def _shed(self, priority):
+        """
+        Removes the oldest queued work-item of the lowest priority, if it is
+        less important than a new item of the given priority.
+        
+        Must be called while holding L{_condition}.
+        
+        @type priority: int
+        @param priority: The priority of the work-item to be queued.
+        
+        @rtype: bool
+        @return: True if room was made in the queue.
+        """
+        victim = None
+        for (i, item) in enumerate(self._queue):
+            if item[0] < priority and (victim is None or item[0] < self._queue[victim][0]):
+                victim = i
+        if victim is None:
+            return False
+        del self._queue[victim]
+        return True
+        
+    def _work(self):
+        """
+        Processes queued work-items indefinitely.
+        """
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                (priority, handler, args) = self._queue.popleft()
+            try:
+                handler(*args)
+            except Exception:
+                traceback.print_exc() #Mirror the behaviour of an unhandled exception in a thread.
+                
+    def getStats(self):
+        """
+        Returns the state of the queue and resets the counters.
+        
+        @rtype: tuple(2)
+        @return: (peak_depth:int, overflowed:int) since the last call.
+        """
+        with self._condition:
+            stats = (self._peak_depth, self._overflowed)
+            self._peak_depth = len(self._queue)
+            self._overflowed = 0
+            return stats
+            
+    def submit(self, priority, handler, args):
+        """
+        Queues a work-item for processing, applying the overflow policy if
+        the queue is full.
+        
+        @type priority: int
+        @param priority: The importance of the work-item, used when shedding
+            load.
+        @type handler: callable
+        @param handler: The function that will process the work-item.
+        @type args: tuple
+        @param args: The arguments to pass to C{handler}.
+        
+        @rtype: bool
+        @return: True if the work-item was queued.
+        """
+        with self._condition:
+            if len(self._queue) >= self._queue_size:
+                self._overflowed += 1
+                if self._overflow_policy == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                elif self._overflow_policy == OVERFLOW_DROP_NEWEST or not self._shed(priority):
+                    return False
+            self._queue.append((priority, handler, args))
+            self._peak_depth = max(self._peak_depth, len(self._queue))
+            self._condition.notify()
+            return True
+            
 class DHCPNetwork(object):
     """
     Handles the actual network I/O and internal packet-path-routing logic.
@@ -43,8 +186,16 @@ class DHCPNetwork(object):
     _dhcp_socket = None #: The socket used to receive DHCP requests.
     _response_socket = None #: The socket used to send DHCP responses. Necessary because of how Linux handles broadcast.
     _pxe_socket = None #: The socket used to receive PXE requests.
+    _worker_pool = None #: The threads that process received packets, or None to spawn a thread per packet.
+    _poller = None #: An epoll object watching the receiving sockets, or None if select() must be used.
+    _listening_sockets = None #: A dictionary of all receiving sockets, keyed by file-descriptor.
+    _receive_budget = None #: The maximum number of datagrams to read each time the sockets become readable.
+    _batch_receiver = None #: The batched-I/O reader, or None if datagrams are read individually.
     
-    def __init__(self, server_address, server_port, client_port, pxe_port):
+    def __init__(self, server_address, server_port, client_port, pxe_port,
+     worker_threads=0, worker_queue_size=256, worker_queue_overflow=OVERFLOW_DROP_OLDEST,
+     receive_budget=64, io_backend=IO_STANDARD, reuse_port=False
+    ):
         """
         Sets up the DHCP network infrastructure.
         
@@ -56,16 +207,53 @@ class DHCPNetwork(object):
         @param client_port: The port on which DHCP clients listen in this network.
         @type pxe_port: int|NoneType
         @param pxe_port: The port on which DHCP servers listen for PXE traffic in this network.
+        @type worker_threads: int
+        @param worker_threads: The number of threads that process received
+            packets; if 0, a new thread is spawned for every packet.
+        @type worker_queue_size: int
+        @param worker_queue_size: The number of packets that may wait for a
+            worker thread.
+        @type worker_queue_overflow: basestring
+        @param worker_queue_overflow: The policy to apply when the queue is
+            full: L{OVERFLOW_DROP_OLDEST}, L{OVERFLOW_DROP_NEWEST}, or
+            L{OVERFLOW_SHED_BY_TYPE}.
+        @type receive_budget: int
+        @param receive_budget: The maximum number of datagrams to drain from
+            the sockets each time they become readable.
+        @type io_backend: basestring
+        @param io_backend: L{IO_STANDARD} or L{IO_MMSG}; if native batched I/O
+            is unavailable, L{IO_MMSG} falls back to equivalent Python loops.
+        @type reuse_port: bool
+        @param reuse_port: If True, the receiving sockets are bound with
+            SO_REUSEPORT, so that several processes may share the load.
         
         @raise Exception: A problem occurred during setup.
+        
+        @raise ValueError: The I/O backend is unknown.
         """
         self._server_address = server_address
         self._server_port = server_port
         self._client_port = client_port
         self._pxe_port = pxe_port
         
-        self._createSocket()
+        self._receive_budget = max(1, receive_budget)
+        
+        self._createSocket(reuse_port)
         self._bindToAddress()
+        self._createPoller()
+        
+        if io_backend == IO_MMSG:
+            #Responses are sent as they are built, one sendto() apiece: each
+            #handler has only its own to send and, under CPython, gathering
+            #them for sendmmsg() costs more than it saves.
+            self._batch_receiver = dhcp_mmsg.BatchReceiver(self._receive_budget)
+        elif not io_backend == IO_STANDARD:
+            raise ValueError("Unknown I/O backend: %(backend)s" % {
+             'backend': io_backend,
+            })
+            
+        if worker_threads:
+            self._worker_pool = _WorkerPool(worker_threads, worker_queue_size, worker_queue_overflow)
         
     def _bindToAddress(self):
         """
@@ -84,10 +272,29 @@ class DHCPNetwork(object):
              'error': str(e),
             })
             
-    def _createSocket(self):
+    def _createPoller(self):
+        """
+        Indexes the receiving sockets and, if the platform supports it,
+        registers them with epoll, which avoids rebuilding select()'s
+        descriptor-sets on every wakeup.
+        """
+        self._listening_sockets = {self._dhcp_socket.fileno(): self._dhcp_socket}
+        if self._pxe_socket:
+            self._listening_sockets[self._pxe_socket.fileno()] = self._pxe_socket
+            
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            for fileno in self._listening_sockets:
+                self._poller.register(fileno, select.EPOLLIN)
+                
+    def _createSocket(self, reuse_port=False):
         """
         Creates and configures the server and response sockets.
         
+        @type reuse_port: bool
+        @param reuse_port: If True, the receiving sockets are configured with
+            SO_REUSEPORT.
+        
         @raise Exception: A socket was in use or the OS doesn't support proper
             broadcast or reuse flags.
         """
@@ -114,43 +321,179 @@ class DHCPNetwork(object):
         except socket.error, msg :
             raise Exception('Unable to set SO_REUSEADDR: %(err)s' % {'err': str(msg),})
             
+        if reuse_port:
+            try:
+                self._dhcp_socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+                if self._pxe_socket:
+                    self._pxe_socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+            except socket.error, msg :
+                raise Exception('Unable to set SO_REUSEPORT: %(err)s' % {'err': str(msg),})
+                
+    def _dispatchDHCPPacket(self, packet, source_address, pxe):
+        """
+        Hands a received packet off to the appropriate handler, either via the
+        worker pool or a dedicated thread.
+        
+        @type packet: L{dhcp_packet.DHCPPacket}
+        @param packet: The packet to be processed.
+        @type source_address: tuple
+        @param source_address: The address (host, port) from which the request
+            was received.
+        @type pxe: bool
+        @param pxe: True if the packet was received on the PXE port.
+        
+        @rtype: bool
+        @return: True if the packet was accepted for processing; False if the
+            worker pool's queue was full and refused it, in which case it is
+            counted among the pool's overflows instead.
+        """
+        handler = message_type = None
+        if packet.isDHCPRequestPacket():
+            (handler, message_type) = (self._handleDHCPRequest, 3)
+        elif packet.isDHCPDiscoverPacket():
+            (handler, message_type) = (self._handleDHCPDiscover, 1)
+        elif packet.isDHCPInformPacket():
+            (handler, message_type) = (self._handleDHCPInform, 8)
+        elif packet.isDHCPReleasePacket():
+            (handler, message_type) = (self._handleDHCPRelease, 7)
+        elif packet.isDHCPDeclinePacket():
+            (handler, message_type) = (self._handleDHCPDecline, 4)
+        elif packet.isDHCPLeaseQueryPacket():
+            (handler, message_type) = (self._handleDHCPLeaseQuery, 10)
+        else:
+            return True
+            
+        if self._worker_pool:
+            return self._worker_pool.submit(_MESSAGE_PRIORITIES[message_type], handler, (packet, source_address, pxe))
+        else:
+            threading.Thread(target=handler, args=(packet, source_address, pxe)).start()
+        return True
+        
+    def _filterDHCPPacket(self, data, source_address, pxe):
+        """
+        Decides whether a received datagram is worth processing, before any
+        packet is constructed from it; L{dhcp_packet.peekPacket} exposes the
+        fields needed to do so cheaply.
+        
+        @type data: str
+        @param data: The received datagram.
+        @type source_address: tuple
+        @param source_address: The address (host, port) from which the request
+            was received.
+        @type pxe: bool
+        @param pxe: True if the packet was received on the PXE port.
+        
+        @rtype: bool
+        @return: True if the datagram should be processed.
+        """
+        return True
+        
+    def _handleDatagramError(self, data, source_address, pxe, exception):
+        """
+        Reports a received datagram that could not be parsed or dispatched;
+        the datagram is discarded and processing continues with the next one.
+        
+        @type data: str
+        @param data: The received datagram.
+        @type source_address: tuple
+        @param source_address: The address (host, port) from which the request
+            was received.
+        @type pxe: bool
+        @param pxe: True if the packet was received on the PXE port.
+        @type exception: Exception
+        @param exception: The error that occurred.
+        """
+        traceback.print_exc() #Mirror the behaviour of an unhandled exception in a thread.
+        
     def _getNextDHCPPacket(self, timeout=60):
         """
-        Blocks for up to C{timeout} seconds while waiting for a packet to
-        arrive; if one does, a thread is spawned to process it.
+        Blocks for up to C{timeout} seconds while waiting for packets to
+        arrive; when they do, every readable socket is drained, in turn, until
+        it is empty or L{_receive_budget} datagrams have been read, and each
+        packet is dispatched for processing. A datagram that cannot be parsed
+        or dispatched is passed to L{_handleDatagramError} and skipped.
         
         @type timeout: int
         @param timeout: The number of seconds to wait before returning.
         
-        @rtype: bool
-        @return: True if something was received; False otherwise.
+        @rtype: int
+        @return: The number of DHCP packets received and accepted for
+            processing.
         """
         active_sockets = None
-        if self._pxe_socket:
-            active_sockets = select.select([self._dhcp_socket, self._pxe_socket], [], [], timeout)[0]
+        if self._poller:
+            try:
+                active_sockets = [self._listening_sockets[fileno] for (fileno, event) in self._poller.poll(timeout)]
+            except (IOError, OSError), e:
+                if e.errno == errno.EINTR:
+                    return 0
+                raise
         else:
-            active_sockets = select.select([self._dhcp_socket], [], [], timeout)[0]
-        if active_sockets:
-            active_socket = active_sockets[0]
-            (data, source_address) = active_socket.recvfrom(4096)
-            if data:
-                packet = dhcp_packet.DHCPPacket(data)
-                if packet.isDHCPPacket():
-                    pxe = active_socket == self._pxe_socket
-                    if packet.isDHCPRequestPacket():
-                        threading.Thread(target=self._handleDHCPRequest, args=(packet, source_address, pxe)).start()
-                    elif packet.isDHCPDiscoverPacket():
-                        threading.Thread(target=self._handleDHCPDiscover, args=(packet, source_address, pxe)).start()
-                    elif packet.isDHCPInformPacket():
-                        threading.Thread(target=self._handleDHCPInform, args=(packet, source_address, pxe)).start()
-                    elif packet.isDHCPReleasePacket():
-                        threading.Thread(target=self._handleDHCPRelease, args=(packet, source_address, pxe)).start()
-                    elif packet.isDHCPDeclinePacket():
-                        threading.Thread(target=self._handleDHCPDecline, args=(packet, source_address, pxe)).start()
-                    elif packet.isDHCPLeaseQueryPacket():
-                        threading.Thread(target=self._handleDHCPLeaseQuery, args=(packet, source_address, pxe)).start()
-                    return True
-        return False
+            active_sockets = select.select(self._listening_sockets.values(), [], [], timeout)[0]
+            
+        received = 0
+        budget = self._receive_budget
+        while active_sockets and budget > 0:
+            for active_socket in tuple(active_sockets):
+                datagrams = self._readDatagrams(active_socket, budget)
+                if not datagrams:
+                    active_sockets.remove(active_socket) #Drained.
+                    continue
+                    
+                if not hasattr(socket, 'MSG_DONTWAIT'): #Only one read per socket is known not to block.
+                    active_sockets.remove(active_socket)
+                budget -= len(datagrams)
+                pxe = active_socket == self._pxe_socket
+                for (data, source_address) in datagrams:
+                    try:
+                        if data and self._filterDHCPPacket(data, source_address, pxe):
+                            packet = dhcp_packet.DHCPPacket(data)
+                            if packet.isDHCPPacket():
+                                if self._dispatchDHCPPacket(packet, source_address, pxe):
+                                    received += 1
+                    except Exception, e: #The rest of the batch has already been read, so only this datagram may be lost.
+                        self._handleDatagramError(data, source_address, pxe, e)
+                if budget <= 0:
+                    break
+        return received
+        
+    def _readDatagrams(self, active_socket, limit):
+        """
+        Reads waiting datagrams from a readable socket without blocking.
+        
+        @type active_socket: socket.socket
+        @param active_socket: The socket from which to read.
+        @type limit: int
+        @param limit: The maximum number of datagrams to read.
+        
+        @rtype: list
+        @return: A collection of (data:str, (host:basestring, port:int))
+            values; empty if the socket has been drained.
+        
+        @raise socket.error: A problem occurred while reading.
+        """
+        if self._batch_receiver:
+            return self._batch_receiver.receive(active_socket, limit)
+            
+        try:
+            return [active_socket.recvfrom(4096, getattr(socket, 'MSG_DONTWAIT', 0))]
+        except socket.error, e:
+            if not e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                raise
+            return []
+        
+    def _getWorkerStats(self):
+        """
+        Returns the state of the worker pool's queue since the last time this
+        function was called.
+        
+        @rtype: tuple(2)
+        @return: (peak_depth:int, overflowed:int); both are 0 if no pool is in
+            use.
+        """
+        if self._worker_pool:
+            return self._worker_pool.getStats()
+        return (0, 0)
         
     def _handleDHCPDecline(self, packet, source_address, pxe):
         """
@@ -246,6 +589,11 @@ class DHCPNetwork(object):
         @param port: The port to which the packet is to be addressed.
         @type pxe: bool
         @param pxe: True if the packet was received via the PXE port
+        
+        @rtype: int
+        @return: The number of bytes sent.
+        
+        @raise socket.error: The packet could not be sent.
         """
         packet_encoded = packet.encodePacket()
 
@@ -261,9 +609,11 @@ class DHCPNetwork(object):
         # damaging effects.
         if not ip == '255.255.255.255':
             if pxe:
-                return self._pxe_socket.sendto(packet_encoded, (ip, port))
+                target_socket = self._pxe_socket
             else:
-                return self._dhcp_socket.sendto(packet_encoded, (ip, port))
+                target_socket = self._dhcp_socket
         else:
-            return self._response_socket.sendto(packet_encoded, (ip, port))
+            target_socket = self._response_socket
             
+        return target_socket.sendto(packet_encoded, (ip, port))
+        
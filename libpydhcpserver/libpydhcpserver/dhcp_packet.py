@@ -25,9 +25,10 @@ Legal
  (C) Neil Tallim, 2010 <red.hamsterx@gmail.com>
  (C) Mathieu Ignacio, 2008 <mignacio@april.org>
 """
+from binascii import hexlify
 import operator
-from struct import unpack
-from struct import pack
+import struct
+import threading
 import warnings
 
 from dhcp_constants import *
@@ -36,12 +37,61 @@ from type_ipv4 import ipv4
 from type_strlist import strlist
 from type_rfc import *
 
+_MAGIC_COOKIE = str(bytearray(MAGIC_COOKIE)) #: The DHCP magic cookie, as it appears on the wire.
+_encoding_buffers = threading.local() #: The reusable buffer into which each thread encodes packets.
+_PEEK_HEADER = struct.Struct('!BxB9x4s8x4s6s') #: op, hlen, ciaddr, giaddr, and chaddr, from the start of a packet.
+
+def peekPacket(data):
+    """
+    Reads the fields needed to decide whether a packet is worth processing
+    directly from a received datagram, without constructing a L{DHCPPacket}.
+    
+    @type data: str
+    @param data: The received datagram.
+    
+    @rtype: tuple|None
+    @return: (op:int, mac:str|None, ciaddr:str, giaddr:str,
+        dhcp_message_type:int|None), with addresses as raw bytes and the MAC
+        in the same form as L{DHCPPacket.getHardwareAddress}, or None if the
+        datagram lacks a magic cookie. mac is None unless hlen is 6, so that
+        packets without an Ethernet address, like IP-based LEASEQUERYs, with
+        an hlen of 0, are never attributed to 00:00:00:00:00:00.
+    """
+    position = data.find(_MAGIC_COOKIE, 236)
+    if position == -1:
+        return None
+        
+    (op, hlen, ciaddr, giaddr, chaddr) = _PEEK_HEADER.unpack_from(data)
+    mac = None
+    if hlen == 6:
+        mac = ':'.join(map(hexlify, chaddr))
+        
+    #Find option 53, stepping over the others without reading them. If it
+    #appears more than once, the last instance wins, as in a full parse.
+    dhcp_message_type = None
+    position += 4
+    end_position = len(data) - 2
+    while position < end_position:
+        opt_id = data[position]
+        if opt_id == '\x00': #Pad option; skip byte.
+            position += 1
+            continue
+        elif opt_id == '\xff': #End option; stop processing.
+            break
+        opt_len = data[position + 1]
+        if opt_id == '\x35':
+            dhcp_message_type = opt_len != '\x00' and ord(data[position + 2]) or None
+        position += ord(opt_len) + 2
+    return (op, mac, ciaddr, giaddr, dhcp_message_type)
+    
 class DHCPPacket(object):
     """
     Handles the construction, management, and export of DHCP packets.
     """
-    _packet_data = None #: The core 240 bytes that make up a DHCP packet.
+    _packet_data = None #: The core 240 bytes that make up a DHCP packet, as a bytearray.
     _options_data = None #: Any additional options attached to this packet.
+    _options_buffer = None #: The received packet, from which options not yet decoded are read.
+    _option_spans = None #: The (offset, length) of every option not yet decoded, keyed by name.
     _requested_options = None #: Any options explicitly requested by the client.
     
     def __init__(self, data=None):
@@ -53,56 +103,111 @@ class DHCPPacket(object):
             blank packet should be created.
         """
         self._options_data = {}
+        self._option_spans = {}
         if not data: #Just create a blank packet and bail.
-            self._packet_data = [0]*240
-            self._packet_data[236:240] = MAGIC_COOKIE
+            self._packet_data = bytearray(240)
+            self._packet_data[236:240] = _MAGIC_COOKIE
             return
             
-        #Transform all data to a list of bytes by unpacking it as C-chars.
-        unpack_fmt = str(len(data)) + "c"
-        self._packet_data = [ord(i) for i in unpack(unpack_fmt, data)]
+        #The received data is copied into a single mutable buffer; header
+        #fields and options are read from it by offset, rather than being
+        #unpacked byte-by-byte.
+        buffer = bytearray(data)
         
         #Some servers or clients don't place the magic cookie immediately
         #after the end of the headers block, adding unnecessary padding.
         #It's necessary to find the magic cookie before proceding.
-        position = 236
-        end_position = len(self._packet_data)
-        while not self._packet_data[position:position + 4] == MAGIC_COOKIE and position < end_position:
-            position += 1
-        position += 4 #Jump to the point immediately after the cookie.
+        position = buffer.find(_MAGIC_COOKIE, 236)
+        if position == -1:
+            position = len(buffer)
+        else:
+            position += 4 #Jump to the point immediately after the cookie.
+            
+        #Option values are only decoded when first read, so that packets
+        #discarded early cost little more than this scan.
+        self._option_spans = self._indexOptions(buffer, position)
+        if self._option_spans:
+            self._options_buffer = buffer
+            
+        #Cut the packet data down to 240 bytes.
+        self._packet_data = buffer[:236]
+        self._packet_data.extend(_MAGIC_COOKIE)
+        
+    def _indexOptions(self, buffer, position):
+        """
+        Locates every recognised option in a received packet, without copying
+        any of their values.
+        
+        @type buffer: bytearray
+        @param buffer: The received packet.
+        @type position: int
+        @param position: The offset immediately after the magic cookie.
         
-        #Extract extended options from the payload.
+        @rtype: dict
+        @return: A dictionary of option names mapped to the (offset:int,
+            length:int) spans of their values within the buffer.
+        """
+        spans = {}
+        end_position = len(buffer)
         while position < end_position:
-            if self._packet_data[position] == 0: #Pad option; skip byte.
-                opt_first = position + 1
+            opt_id = buffer[position]
+            if opt_id == 0: #Pad option; skip byte.
                 position += 1
-            elif self._packet_data[position] == 255: #End option; stop processing.
+                continue
+            elif opt_id == 255: #End option; stop processing.
                 break
-            elif DHCP_OPTIONS_TYPES.has_key(self._packet_data[position]) and not self._packet_data[position] == 255:
-                opt_len = self._packet_data[position + 1]
-                opt_first = position + 1
-                opt_id = self._packet_data[position]
-                opt_val = self._packet_data[opt_first + 1:opt_len + opt_first + 1]
+                
+            opt_len = buffer[position + 1]
+            if DHCP_OPTIONS_TYPES.has_key(opt_id):
+                opt_first = position + 2
+                opt_len_available = min(opt_len, end_position - opt_first)
                 try:
-                    self._options_data[DHCP_OPTIONS_REVERSE[opt_id]] = opt_val
+                    spans[DHCP_OPTIONS_REVERSE[opt_id]] = (opt_first, opt_len_available)
                 except Exception, e:
                     warnings.warn("Unable to assign '%(value)s' to '%(id)s': %(error)s" % {
-                     'value': opt_val,
+                     'value': list(buffer[opt_first:opt_first + opt_len]),
                      'id': opt_id,
                      'error': str(e),
                     })
                     
                 if opt_id == 55: #Handle requested options.
                     self._requested_options = tuple(set(
-                     [int(i) for i in opt_val] + [1, 3, 6, 15, 51, 53, 54, 58, 59]
+                     list(buffer[opt_first:opt_first + opt_len]) + [1, 3, 6, 15, 51, 53, 54, 58, 59]
                     ))
-                position += self._packet_data[opt_first] + 2
-            else:
-                opt_first = position + 1
-                position += self._packet_data[opt_first] + 2
-                
-        #Cut the packet data down to 240 bytes.
-        self._packet_data = self._packet_data[:236] + MAGIC_COOKIE
+            position += opt_len + 2
+        return spans
+        
+    def _decodeOption(self, name):
+        """
+        Materialises the value of an option that has not yet been decoded,
+        caching it for subsequent reads.
+        
+        @type name: basestring
+        @param name: The option's name.
+        
+        @rtype: list|None
+        @return: The option's value, or None if it wasn't present.
+        """
+        span = self._option_spans.pop(name, None)
+        if span is None:
+            return None
+        (offset, length) = span
+        value = self._options_data[name] = list(self._options_buffer[offset:offset + length])
+        if not self._option_spans:
+            self._options_buffer = None
+        return value
+        
+    def _decodeOptions(self):
+        """
+        Materialises every option that has not yet been decoded; options that
+        were replaced in the meantime keep their new values.
+        """
+        buffer = self._options_buffer
+        for (name, (offset, length)) in self._option_spans.iteritems():
+            if not self._options_data.has_key(name):
+                self._options_data[name] = list(buffer[offset:offset + length])
+        self._option_spans = {}
+        self._options_buffer = None
         
     def encodePacket(self):
         """
@@ -114,36 +219,35 @@ class DHCPPacket(object):
         @return: The encoded packet.
         """
         #Pull options out of the payload, excluding options not specifically
-        #requested, assuming any specific requests were made.
-        options = {}
-        for key in self._options_data.keys():
-            option_id = DHCP_OPTIONS[key]
-            if self._requested_options is None or option_id in self._requested_options:
-                option_value = self._options_data[key]
-                
-                options[option_id] = option = []
-                
-                while True:
-                    if len(option_value) > 255:
-                        option += [option_id, 255] + option_value[:255]
-                        option_value = option_value[255:]
-                    else:
-                        option += [option_id, len(option_value)] + option_value
-                        break
-        #Order options by number and add them to the output data.
-        ordered_options = []
-        for (option_id, value) in sorted(options.iteritems()):
-            ordered_options += value
-            
-        #Assemble data.
-        packet = self._packet_data[:240] + ordered_options
-        packet.append(255) #Add End option.
-        
-        #Encode packet.
-        pack_fmt = str(len(packet)) + "c"
-        packet = map(chr, packet)
-        
-        return pack(pack_fmt, *packet)
+        #requested, assuming any specific requests were made, and order them
+        #by number.
+        self._decodeOptions()
+        requested_options = self._requested_options
+        options = sorted(
+         (DHCP_OPTIONS[key], value) for (key, value) in self._options_data.iteritems()
+         if requested_options is None or DHCP_OPTIONS[key] in requested_options
+        )
+        
+        #Assemble data in this thread's buffer, which keeps its allocation
+        #between packets.
+        buffer = getattr(_encoding_buffers, 'buffer', None)
+        if buffer is None:
+            buffer = _encoding_buffers.buffer = bytearray()
+        buffer[:] = self._packet_data
+        append = buffer.append
+        extend = buffer.extend
+        for (option_id, value) in options:
+            while len(value) > 255: #Split long values across multiple instances.
+                append(option_id)
+                append(255)
+                extend(value[:255])
+                value = value[255:]
+            append(option_id)
+            append(len(value))
+            extend(value)
+        append(255) #Add End option.
+        
+        return str(buffer)
         
     def _setRfcOption(self, name, value, expected_type):
         """
@@ -192,11 +296,26 @@ class DHCPPacket(object):
         else:
             if type(name) == int: #Translate int to string.
                 name = DHCP_OPTIONS_REVERSE.get(name)
+            if self._option_spans.pop(name, None) is not None:
+                self._options_data.pop(name, None)
+                return True
             if self._options_data.has_key(name):
                 del self._options_data[name]
                 return True
         return False
         
+    def loadOptions(self, options):
+        """
+        Assigns option values that have already been validated, such as those
+        read from another packet, without checking them again.
+        
+        @type options: sequence
+        @param options: A collection of (name:basestring, value:list|tuple)
+            pairs; each value is copied.
+        """
+        for (name, value) in options:
+            self._options_data[name] = list(value)
+            
     def forceOption(self, option, value):
         """
         Bypasses validation checks and adds the option number to the
@@ -240,12 +359,13 @@ class DHCPPacket(object):
         """
         if DHCP_FIELDS.has_key(name):
             option_info = DHCP_FIELDS[name]
-            return self._packet_data[option_info[0]:option_info[0] + option_info[1]]
+            return list(self._packet_data[option_info[0]:option_info[0] + option_info[1]])
         else:
             if type(name) == int: #Translate int to string.
                 name = DHCP_OPTIONS_REVERSE.get(name)
             if self._options_data.has_key(name):
                 return self._options_data[name]
+            return self._decodeOption(name)
         return None
         
     def isOption(self, name):
@@ -260,7 +380,7 @@ class DHCPPacket(object):
         """
         if type(name) == int: #Translate int to string.
             self._options_data.has_key(DHCP_OPTIONS_REVERSE.get(name))
-        return self._options_data.has_key(name) or DHCP_FIELDS.has_key(name)
+        return self._options_data.has_key(name) or self._option_spans.has_key(name) or DHCP_FIELDS.has_key(name)
         
     def setOption(self, name, value):
         """
@@ -341,7 +461,7 @@ class DHCPPacket(object):
         @rtype: bool
         @return: True if this packet is a DHCP packet.
         """
-        return self._packet_data[236:240] == MAGIC_COOKIE
+        return self._packet_data[236:240] == _MAGIC_COOKIE
         
     def _getDHCPMessageType(self):
         """
@@ -647,7 +767,7 @@ class DHCPPacket(object):
         ):
             begin = DHCP_FIELDS[opt][0]
             end = DHCP_FIELDS[opt][0] + DHCP_FIELDS[opt][1]
-            data = self._packet_data[begin:end]
+            data = list(self._packet_data[begin:end])
             result = None
             if DHCP_FIELDS_TYPES[opt] == "byte":
                 result = str(data[0])
@@ -678,6 +798,7 @@ class DHCPPacket(object):
             
         output.append('')
         output.append("#Options fields")
+        self._decodeOptions()
         for opt in self._options_data.keys():
             data = self._options_data[opt]
             result = None
@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+"""
+libpydhcpserver tests: dhcp_mmsg
+
+Purpose
+=======
+ Exercises batched datagram reads over the loopback interface, natively and
+ through the pure-Python fallback.
+ 
+ Run from libpydhcpserver/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of libpydhcpserver.
+ libpydhcpserver is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import socket
+import unittest
+
+from libpydhcpserver import dhcp_mmsg
+
+class _BatchIOTests(object):
+    """
+    Tests shared by the native and fallback implementations.
+    """
+    native = None #: The value of dhcp_mmsg.AVAILABLE under test.
+    
+    def setUp(self):
+        if self.native and not dhcp_mmsg.AVAILABLE:
+            self.skipTest("recvmmsg() is unavailable")
+        self._available = dhcp_mmsg.AVAILABLE
+        dhcp_mmsg.AVAILABLE = self.native
+        
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.settimeout(1)
+        self.address = self.receiver.getsockname()
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender.bind(('127.0.0.1', 0))
+        
+    def tearDown(self):
+        dhcp_mmsg.AVAILABLE = self._available
+        self.receiver.close()
+        self.sender.close()
+        
+    def test_receive(self):
+        for i in xrange(5):
+            self.sender.sendto('datagram %i' % i, self.address)
+        receiver = dhcp_mmsg.BatchReceiver(4)
+        self.receiver.settimeout(None)
+        
+        datagrams = []
+        while len(datagrams) < 5:
+            batch = receiver.receive(self.receiver)
+            self.assertTrue(len(batch) <= 4)
+            datagrams.extend(batch)
+        self.assertEqual([data for (data, address) in datagrams], ['datagram %i' % i for i in xrange(5)])
+        self.assertEqual(set(address for (data, address) in datagrams), set((self.sender.getsockname(),)))
+        self.assertEqual(receiver.receive(self.receiver), [])
+        
+class NativeBatchIOTests(_BatchIOTests, unittest.TestCase):
+    native = True
+    
+class FallbackBatchIOTests(_BatchIOTests, unittest.TestCase):
+    native = False
+    
+if __name__ == '__main__':
+    unittest.main()
+    
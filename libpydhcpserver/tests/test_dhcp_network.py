@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+"""
+libpydhcpserver tests: dhcp_network
+
+Purpose
+=======
+ Exercises the draining of received datagrams.
+ 
+ Run from libpydhcpserver/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of libpydhcpserver.
+ libpydhcpserver is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import socket
+import unittest
+
+from libpydhcpserver import dhcp_network
+
+from test_dhcp_packet import _datagram
+
+class _Network(dhcp_network.DHCPNetwork):
+    """
+    A network that reads a fixed batch of datagrams and records what becomes
+    of them, without binding the DHCP ports.
+    """
+    def __init__(self, datagrams):
+        self._datagrams = datagrams
+        self.dispatched = []
+        self.errors = []
+        
+        self._dhcp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._dhcp_socket.bind(('127.0.0.1', 0))
+        self._dhcp_socket.sendto('wake', self._dhcp_socket.getsockname()) #Makes the socket readable.
+        self._receive_budget = 64
+        self._createPoller()
+        
+    def _readDatagrams(self, active_socket, limit):
+        (datagrams, self._datagrams) = (self._datagrams, [])
+        return datagrams
+        
+    def _dispatchDHCPPacket(self, packet, source_address, pxe):
+        if packet.getOption('xid') == [0, 0, 0, 3]:
+            raise ValueError("handler failed")
+        self.dispatched.append(source_address)
+        return True
+        
+    def _handleDatagramError(self, data, source_address, pxe, exception):
+        self.errors.append((source_address, type(exception)))
+        
+class DrainTests(unittest.TestCase):
+    def test_badDatagramInBatch(self):
+        #A datagram that can't be parsed or dispatched costs only itself.
+        network = _Network([
+         (_datagram(), ('10.0.0.1', 68)),
+         (_datagram(options='\x35\x01\x01\x33'), ('10.0.0.2', 68)), #A truncated option.
+         (_datagram(), ('10.0.0.3', 68)),
+         (_datagram()[:4] + '\x00\x00\x00\x03' + _datagram()[8:], ('10.0.0.4', 68)),
+         (_datagram(), ('10.0.0.5', 68)),
+        ])
+        try:
+            self.assertEqual(network._getNextDHCPPacket(1), 3)
+        finally:
+            network._dhcp_socket.close()
+        self.assertEqual(network.dispatched, [('10.0.0.1', 68), ('10.0.0.3', 68), ('10.0.0.5', 68)])
+        self.assertEqual(network.errors, [(('10.0.0.2', 68), IndexError), (('10.0.0.4', 68), ValueError)])
+        
+if __name__ == '__main__':
+    unittest.main()
+    
@@ -0,0 +1,325 @@
+# -*- encoding: utf-8 -*-
+"""
+libpydhcpserver tests: dhcp_packet
+
+Purpose
+=======
+ Checks that peekPacket() reads the same fields as a full DHCPPacket parse,
+ and that DHCPPacket decodes and encodes golden packets byte-for-byte as the
+ original list-based implementation did.
+ 
+ Run from libpydhcpserver/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of libpydhcpserver.
+ libpydhcpserver is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import binascii
+import struct
+import unittest
+
+from libpydhcpserver.dhcp_packet import DHCPPacket, peekPacket
+
+_COOKIE = '\x63\x82\x53\x63'
+_CHADDR = '\x00\x16\x3e\x0a\x0b\x0c'
+
+def _datagram(op=1, hlen=6, chaddr=_CHADDR, ciaddr='\x00\x00\x00\x00', giaddr='\x00\x00\x00\x00', options='\x35\x01\x01\xff', padding=''):
+    """
+    Assembles a raw BOOTP datagram.
+    """
+    header = struct.pack('!BBBBIHH4s4s4s4s16s64s128s',
+     op, 1, hlen, 0, 0x12345678, 0, 0,
+     ciaddr, '\x00' * 4, '\x00' * 4, giaddr,
+     chaddr, '', '',
+    )
+    return header + padding + _COOKIE + options
+    
+class PeekPacketTests(unittest.TestCase):
+    def _compare(self, data):
+        """
+        Asserts that peekPacket() agrees with DHCPPacket on every field it
+        reads, returning the peeked tuple.
+        """
+        peek = peekPacket(data)
+        packet = DHCPPacket(data)
+        (op, mac, ciaddr, giaddr, dhcp_message_type) = peek
+        
+        self.assertEqual(op, packet.getOption('op')[0])
+        self.assertEqual(ciaddr, str(bytearray(packet.getOption('ciaddr'))))
+        self.assertEqual(giaddr, str(bytearray(packet.getOption('giaddr'))))
+        expected_type = packet.getOption('dhcp_message_type')
+        self.assertEqual(dhcp_message_type, expected_type and expected_type[0] or None)
+        if mac is not None:
+            self.assertEqual(mac, packet.getHardwareAddress())
+        return peek
+        
+    def test_discover(self):
+        peek = self._compare(_datagram())
+        self.assertEqual(peek[1], '00:16:3e:0a:0b:0c')
+        self.assertEqual(peek[4], 1)
+        
+    def test_relayedRequest(self):
+        peek = self._compare(_datagram(
+         ciaddr='\xc0\xa8\x01\x05', giaddr='\x0a\x00\x00\x01',
+         options='\x00\x00\x32\x04\xc0\xa8\x01\x05\x35\x01\x03\xff',
+        ))
+        self.assertEqual(peek[2], '\xc0\xa8\x01\x05')
+        self.assertEqual(peek[3], '\x0a\x00\x00\x01')
+        self.assertEqual(peek[4], 3)
+        
+    def test_ipLeaseQuery(self):
+        peek = self._compare(_datagram(hlen=0, chaddr='', ciaddr='\xc0\xa8\x01\x05', options='\x35\x01\x0a\xff'))
+        self.assertEqual(peek[1], None)
+        self.assertEqual(peek[4], 10)
+        
+    def test_invalidHardwareLengths(self):
+        for hlen in (1, 5, 7, 16, 255):
+            self.assertEqual(self._compare(_datagram(hlen=hlen))[1], None)
+            
+    def test_paddedCookie(self):
+        peek = self._compare(_datagram(padding='\x00' * 12))
+        self.assertEqual(peek[1], '00:16:3e:0a:0b:0c')
+        self.assertEqual(peek[4], 1)
+        
+    def test_repeatedMessageType(self):
+        self.assertEqual(self._compare(_datagram(options='\x35\x01\x01\x35\x01\x03\xff'))[4], 3)
+        
+    def test_noMessageType(self):
+        self.assertEqual(self._compare(_datagram(options='\x0c\x03abc\xff'))[4], None)
+        
+    def test_noCookie(self):
+        self.assertEqual(peekPacket(_datagram()[:236]), None)
+        
+_ZEROES = '00' * 192 #: Empty sname and file fields, in hex.
+
+def _unhex(*fragments):
+    """
+    Joins fragments of hex, ignoring whitespace, into a datagram.
+    """
+    return binascii.unhexlify(''.join(''.join(fragments).split()))
+    
+def _offer(packet):
+    packet.transformToDHCPOfferPacket()
+    packet.setOption('yiaddr', [192, 168, 1, 50])
+    packet.setOption('server_identifier', [192, 168, 1, 1])
+    packet.setOption('ip_address_lease_time', [0, 0, 14, 16])
+    packet.setOption('subnet_mask', [255, 255, 255, 0])
+    packet.setOption('router', [192, 168, 1, 1])
+    packet.setOption('domain_name_servers', [192, 168, 1, 2, 192, 168, 1, 3])
+    packet.setOption('domain_name', [ord(c) for c in 'example.org'])
+    packet.setOption('domain_search', ([7] + [ord(c) for c in 'example'] + [3] + [ord(c) for c in 'org'] + [0]) * 24) #Split across two instances.
+    packet.setOption('ntp_servers', [192, 168, 1, 4])
+    packet.setOption('hostname', [ord(c) for c in 'host-a'])
+    return packet
+    
+def _ack(packet):
+    packet.transformToDHCPAckPacket()
+    packet.setOption('yiaddr', [192, 168, 1, 50])
+    packet.setOption('server_identifier', [192, 168, 1, 1])
+    packet.setOption('ip_address_lease_time', [0, 0, 14, 16])
+    packet.setOption('renewal_time_value', [0, 0, 7, 8])
+    packet.setOption('rebinding_time_value', [0, 0, 12, 78])
+    packet.setOption('subnet_mask', [255, 255, 255, 0])
+    packet.setOption('router', [192, 168, 1, 1])
+    packet.setOption('nbns', [192, 168, 1, 5]) #Not requested; must be dropped.
+    return packet
+    
+def _informAck(packet):
+    packet.transformToDHCPAckPacket()
+    packet.setOption('server_identifier', [192, 168, 1, 1])
+    packet.setOption('subnet_mask', [255, 255, 255, 0])
+    packet.setOption('router', [192, 168, 1, 1])
+    packet.setOption('nbns', [192, 168, 1, 5])
+    packet.forceOption(66, [ord(c) for c in 'tftp'])
+    return packet
+    
+def _leaseActive(packet):
+    packet.transformToDHCPLeaseActivePacket()
+    packet.setOption('yiaddr', [192, 168, 1, 50])
+    packet.setOption('ip_address_lease_time', [0, 0, 14, 16])
+    return packet
+    
+#: Golden packets, by name: the received datagram, as the original encoder
+#: re-encoded it, and the function that turns it into a reply, with the reply
+#: the original encoder produced, if there is one.
+_GOLDEN = {
+ 'discover': (
+  _unhex(
+   '01010600 3903f326 00038000 00000000 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 350101 3d070100163e0a0b0c 390205dc 0c06686f73742d61',
+   '3c0c6468637063642d352e352e36 37090103060c0f1c2a3377 ff',
+   '000000000000000000000000',
+  ),
+  _unhex(
+   '01010600 3903f326 00038000 00000000 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 0c06686f73742d61 350101 ff',
+  ),
+  _offer,
+  _unhex(
+   '02010600 3903f326 00008000 00000000 c0a80132 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 0104ffffff00 0304c0a80101 0608c0a80102c0a80103',
+   '0c06686f73742d61 0f0b6578616d706c652e6f7267 2a04c0a80104',
+   '330400000e10 350102 3604c0a80101',
+   '77ff076578616d706c65036f726700076578616d706c65036f72670007657861',
+   '6d706c65036f726700076578616d706c65036f726700076578616d706c65036f',
+   '726700076578616d706c65036f726700076578616d706c65036f726700076578',
+   '616d706c65036f726700076578616d706c65036f726700076578616d706c6503',
+   '6f726700076578616d706c65036f726700076578616d706c65036f7267000765',
+   '78616d706c65036f726700076578616d706c65036f726700076578616d706c65',
+   '036f726700076578616d706c65036f726700076578616d706c65036f72670007',
+   '6578616d706c65036f726700076578616d706c65036f726700076578616d706c',
+   '65',
+   '7739036f726700076578616d706c65036f726700076578616d706c65036f7267',
+   '00076578616d706c65036f726700076578616d706c65036f726700 ff',
+  ),
+ ),
+ 'request': (
+  _unhex(
+   '01010600 3903f327 00040000 00000000 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 350103 3d070100163e0a0b0c 3204c0a80132 3604c0a80101',
+   '0c06686f73742d61 37080103060f33363a3b ff',
+  ),
+  _unhex(
+   '01010600 3903f327 00040000 00000000 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 350103 3604c0a80101 ff',
+  ),
+  _ack,
+  _unhex(
+   '02010600 3903f327 00000000 00000000 c0a80132 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 0104ffffff00 0304c0a80101 330400000e10 350105',
+   '3604c0a80101 3a0400000708 3b0400000c4e ff',
+  ),
+ ),
+ 'inform': (
+  _unhex(
+   '01010600 5a5a0001 00000000 c0a8014d 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '00000000 63825363 350108 0000 37050103060f2c 00',
+   '3c084d53465420352e30 ff',
+  ),
+  _unhex(
+   '01010600 5a5a0001 00000000 c0a8014d 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 350108 ff',
+  ),
+  _informAck,
+  _unhex(
+   '02010600 5a5a0001 00000000 c0a8014d 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 0104ffffff00 0304c0a80101 2c04c0a80105 350105',
+   '3604c0a80101 420474667470 ff',
+  ),
+ ),
+ 'release': (
+  _unhex(
+   '01010600 5a5a0002 00000000 c0a80132 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 350107 3604c0a80101 3d070100163e0a0b0c ff',
+  ),
+  _unhex(
+   '01010600 5a5a0002 00000000 c0a80132 00000000 00000000 00000000',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 350107 3604c0a80101 3d070100163e0a0b0c ff',
+  ),
+  None,
+  None,
+ ),
+ 'leasequery': (
+  _unhex(
+   '01010600 5a5a0003 00000000 00000000 00000000 00000000 0a000001',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 35010a 520e010465746830020600163e0a0b0c ff',
+  ),
+  _unhex(
+   '01010600 5a5a0003 00000000 00000000 00000000 00000000 0a000001',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 35010a 520e010465746830020600163e0a0b0c ff',
+  ),
+  _leaseActive,
+  _unhex(
+   '02010600 5a5a0003 00000000 00000000 c0a80132 00000000 0a000001',
+   '00163e0a0b0c00000000000000000000',
+   _ZEROES,
+   '63825363 330400000e10 35010d 520e010465746830020600163e0a0b0c ff',
+  ),
+ ),
+}
+
+class GoldenPacketTests(unittest.TestCase):
+    def test_reencode(self):
+        for (name, (received, encoded, respond, reply)) in _GOLDEN.iteritems():
+            self.assertEqual(DHCPPacket(received).encodePacket(), encoded, name)
+            self.assertEqual(DHCPPacket(encoded).encodePacket(), encoded, name)
+            
+    def test_reply(self):
+        for (name, (received, encoded, respond, reply)) in _GOLDEN.iteritems():
+            if respond:
+                self.assertEqual(respond(DHCPPacket(received)).encodePacket(), reply, name)
+                
+    def test_partialDecode(self):
+        #Reading some options before encoding must not change the output.
+        for (name, (received, encoded, respond, reply)) in _GOLDEN.iteritems():
+            packet = DHCPPacket(received)
+            packet.getOption('dhcp_message_type')
+            packet.getOption('client_identifier')
+            packet.deleteOption('hostname')
+            reference = DHCPPacket(received)
+            reference.deleteOption('hostname')
+            self.assertEqual(packet.encodePacket(), reference.encodePacket(), name)
+            
+    def test_decode(self):
+        packet = DHCPPacket(_GOLDEN['discover'][0])
+        self.assertEqual(packet.getOption('dhcp_message_type'), [1])
+        self.assertEqual(packet.getOption('client_identifier'), [1, 0, 0x16, 0x3e, 0x0a, 0x0b, 0x0c])
+        self.assertEqual(packet.getOption('maximum_dhcp_message_size'), [5, 220])
+        self.assertEqual(packet.getOption('hostname'), [ord(c) for c in 'host-a'])
+        self.assertEqual(packet.getOption('requested_ip_address'), None)
+        self.assertEqual(packet.getHardwareAddress(), '00:16:3e:0a:0b:0c')
+        self.assertEqual(packet.getOption('secs'), [0, 3])
+        self.assertEqual(packet.getOption('flags'), [128, 0])
+        self.assertTrue(packet.isDHCPDiscoverPacket())
+        self.assertTrue(DHCPPacket(_GOLDEN['leasequery'][0]).isDHCPLeaseQueryPacket())
+        
+    def test_bufferReuse(self):
+        #A short packet encoded after a long one must not carry its tail.
+        (received, encoded, respond, reply) = _GOLDEN['discover']
+        respond(DHCPPacket(received)).encodePacket()
+        (received, encoded, respond, reply) = _GOLDEN['release']
+        self.assertEqual(DHCPPacket(received).encodePacket(), encoded)
+        
+if __name__ == '__main__':
+    unittest.main()
+    
@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd benchmark: databases._ini
+
+Purpose
+=======
+ Compares the INI broker's compact binding table with a dictionary of
+ prebuilt tuples, as it used to keep, for memory and uncached lookup time.
+ 
+ Run from staticDHCPd/ with: python benchmarks/ini_bindings.py [bindings...]
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import ConfigParser
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+import _environment
+
+from staticdhcpd import config
+from staticdhcpd.databases._ini import INI
+
+SIZES = (100000, 1000000) #: The numbers of bindings measured, unless others are given.
+SUBNETS = 50 #: The number of subnets across which bindings are spread.
+LOOKUPS = 20000 #: The number of lookups per round.
+ROUNDS = 40 #: The number of rounds timed, alternating between layouts; the best is reported.
+
+class _DictLayout(object):
+    """
+    Bindings as INI kept them before the compact table: a dictionary of
+    (ip, hostname, (subnet, serial)) tuples keyed by MAC, and a dictionary of
+    subnets' details, read through RawConfigParser and looked up exactly as
+    INI used to.
+    """
+    def __init__(self, path):
+        self._maps = {}
+        self._subnets = {}
+        reader = ConfigParser.RawConfigParser()
+        reader.read(path)
+        for section in reader.sections():
+            if '|' in section:
+                (subnet, serial) = section.split('|')
+                self._subnets[(subnet, int(serial))] = (
+                 reader.getint(section, 'lease-time'),
+                 reader.get(section, 'gateway'), None, None,
+                 None, None, reader.get(section, 'domain-name'),
+                )
+            else:
+                mac = section.replace(':', '').lower()
+                mac = ':'.join([mac[0:2], mac[2:4], mac[4:6], mac[6:8], mac[8:10], mac[10:12]])
+                hostname = reader.has_option(section, 'hostname') and reader.get(section, 'hostname') or None
+                self._maps[mac] = (
+                 reader.get(section, 'ip'), hostname,
+                 (reader.get(section, 'subnet'), reader.getint(section, 'serial')),
+                )
+                
+                
+    def _lookupMAC(self, mac):
+        map = self._maps.get(mac)
+        if not map:
+            return None
+            
+        (ip, hostname, subnet) = map
+        (lease_time,
+         gateway, subnet_mask, broadcast_address,
+         ntp_servers, domain_name_servers, domain_name
+        ) = self._subnets.get(subnet)
+        
+        return (
+         ip, hostname,
+         gateway, subnet_mask, broadcast_address,
+         domain_name, domain_name_servers, ntp_servers,
+         lease_time, subnet[0], subnet[1],
+        )
+        
+def _formatMAC(i):
+    return '02:00:%02x:%02x:%02x:%02x' % (i >> 24, (i >> 16) & 255, (i >> 8) & 255, i & 255)
+    
+def _writeFile(path, count):
+    """
+    Writes an INI file of count bindings, half with hostnames.
+    """
+    with open(path, 'w') as output:
+        for i in xrange(SUBNETS):
+            output.write("[net%(i)i|0]\nlease-time: 3600\ngateway: 10.0.0.1\ndomain-name: example.org\n\n" % {'i': i,})
+        for i in xrange(count):
+            output.write("[%(mac)s]\nip: 10.%(b)i.%(c)i.%(d)i\n%(hostname)ssubnet: net%(subnet)i\nserial: 0\n\n" % {
+             'mac': _formatMAC(i),
+             'b': (i >> 16) & 255,
+             'c': (i >> 8) & 255,
+             'd': i & 255,
+             'hostname': i % 2 and 'hostname: host%(i)i\n' % {'i': i,} or '',
+             'subnet': i % SUBNETS,
+            })
+            
+def _sizeOf(o, seen):
+    """
+    Sums the sizes of an object and everything it holds, counting each once.
+    """
+    if id(o) in seen or o is None:
+        return 0
+    seen.add(id(o))
+    size = sys.getsizeof(o)
+    if isinstance(o, dict):
+        for (key, value) in o.iteritems():
+            size += _sizeOf(key, seen) + _sizeOf(value, seen)
+    elif isinstance(o, (tuple, list)):
+        for item in o:
+            size += _sizeOf(item, seen)
+    elif hasattr(o, '__slots__'):
+        for name in o.__slots__:
+            size += _sizeOf(getattr(o, name, None), seen)
+    elif hasattr(o, '__dict__'):
+        size += _sizeOf(o.__dict__, seen)
+    return size
+    
+def _timeLookups(brokers, count):
+    """
+    Times brokers' uncached lookups of random MACs, each a fresh string, as it
+    would be when taken from a packet, with a few unknown MACs mixed in.
+    """
+    best = [None] * len(brokers)
+    for i in xrange(ROUNDS):
+        macs = [str(bytearray(_formatMAC(random.randrange(count + count // 10)))) for j in xrange(LOOKUPS)]
+        for (j, broker) in enumerate(brokers):
+            lookup = broker._lookupMAC
+            start = time.time()
+            for mac in macs:
+                lookup(mac)
+            elapsed = time.time() - start
+            best[j] = min(best[j] or elapsed, elapsed)
+    return [elapsed / LOOKUPS * 1000000 for elapsed in best]
+    
+def _measure(directory, count):
+    config.INI_FILE = os.path.join(directory, 'bindings.ini')
+    _writeFile(config.INI_FILE, count)
+    start = time.time()
+    broker = INI.__new__(INI) #Without the broker's reload thread.
+    broker._maps = table = broker._parse_ini()
+    load_time = time.time() - start
+    reference = _DictLayout(config.INI_FILE)
+    for mac in (_formatMAC(0), _formatMAC(count - 1), _formatMAC(count)):
+        if broker._lookupMAC(mac) != reference._lookupMAC(mac):
+            raise AssertionError("Layouts disagree on %(mac)s" % {'mac': mac,})
+            
+    (table_time, reference_time) = _timeLookups((broker, reference), count)
+    print("%(count)8i bindings  table: %(table_size)4.0f B/binding %(table_time)5.2fus/lookup  dict: %(reference_size)4.0f B/binding %(reference_time)5.2fus/lookup  (loaded in %(load_time).1fs)" % {
+     'count': count,
+     'table_size': _sizeOf(table, set()) / float(count),
+     'table_time': table_time,
+     'reference_size': _sizeOf(reference, set()) / float(count),
+     'reference_time': reference_time,
+     'load_time': load_time,
+    })
+    
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        for count in [int(count) for count in sys.argv[1:]] or SIZES:
+            _measure(directory, count)
+    finally:
+        shutil.rmtree(directory)
+        
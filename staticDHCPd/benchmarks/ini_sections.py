@@ -0,0 +1,113 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd benchmark: databases._ini
+
+Purpose
+=======
+ Compares the INI broker's section reader with ConfigParser.RawConfigParser,
+ through which files used to be read, for time and peak memory.
+ 
+ Run from staticDHCPd/ with: python benchmarks/ini_sections.py [bindings...]
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import ConfigParser
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ini_bindings import _writeFile
+
+from staticdhcpd.databases._ini import _read_sections
+
+SIZES = (100000, 1000000) #: The numbers of bindings measured, unless others are given.
+ROUNDS = 5 #: The number of rounds timed, alternating between readers; the best is reported.
+
+def _readSections(path):
+    """
+    Reads every section, as INI does, keeping none.
+    """
+    with open(path) as input:
+        for (section, options) in _read_sections(input):
+            pass
+            
+def _readRaw(path):
+    """
+    Reads every section, as INI used to, with the whole file held in the
+    parser.
+    """
+    reader = ConfigParser.RawConfigParser()
+    reader.read(path)
+    return [(section, dict(reader.items(section))) for section in reader.sections()]
+    
+def _idle(path):
+    """
+    Reads nothing, to measure the cost of the child process itself.
+    """
+    
+def _run(reader, path):
+    """
+    Runs reader in a child process, so that its peak memory is its own.
+    
+    @return: (seconds:float, peak-RSS-in-KiB:int)
+    """
+    start = time.time()
+    pid = os.fork()
+    if not pid:
+        reader(path)
+        os._exit(0)
+    (pid, status, usage) = os.wait4(pid, 0)
+    elapsed = time.time() - start
+    if status:
+        raise AssertionError("%(reader)s failed" % {'reader': reader.__name__,})
+    return (elapsed, usage.ru_maxrss)
+    
+def _measure(directory, count):
+    path = os.path.join(directory, 'bindings.ini')
+    _writeFile(path, count)
+    with open(path) as input:
+        if list(_read_sections(input)) != _readRaw(path):
+            raise AssertionError("Readers disagree")
+            
+    readers = (_idle, _readSections, _readRaw)
+    best = [(None, None)] * len(readers)
+    for i in xrange(ROUNDS):
+        for (j, reader) in enumerate(readers):
+            (elapsed, peak) = _run(reader, path)
+            best[j] = (min(best[j][0] or elapsed, elapsed), min(best[j][1] or peak, peak))
+    ((idle_time, idle_peak), (sections_time, sections_peak), (raw_time, raw_peak)) = best
+    print("%(count)8i bindings  _read_sections: %(sections_time)5.2fs +%(sections_peak)7i KiB  RawConfigParser: %(raw_time)5.2fs +%(raw_peak)7i KiB" % {
+     'count': count,
+     'sections_time': sections_time - idle_time,
+     'sections_peak': sections_peak - idle_peak,
+     'raw_time': raw_time - idle_time,
+     'raw_peak': raw_peak - idle_peak,
+    })
+    
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        for count in [int(count) for count in sys.argv[1:]] or SIZES:
+            _measure(directory, count)
+    finally:
+        shutil.rmtree(directory)
+        
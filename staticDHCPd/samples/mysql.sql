@@ -24,6 +24,37 @@ CREATE TABLE maps (
     FOREIGN KEY (subnet, serial) REFERENCES subnets (subnet, serial)
 );
 
+-- Only needed if SNAPSHOT_INCREMENTAL is enabled: every change to a binding is recorded here, so that
+-- the server can fetch just what changed. Rows may be pruned once older than SNAPSHOT_CHANGELOG_WINDOW plus SNAPSHOT_REFRESH_INTERVAL.
+CREATE TABLE maps_changelog (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY, -- The position of the change; never reused.
+    mac CHAR(17) NOT NULL -- The MAC whose binding was added, changed, or removed.
+);
+
+delimiter |
+CREATE TRIGGER maps_changelog_insert AFTER INSERT ON maps FOR EACH ROW
+    BEGIN
+        INSERT INTO maps_changelog (mac) VALUES (NEW.mac);
+    END;
+|
+CREATE TRIGGER maps_changelog_update AFTER UPDATE ON maps FOR EACH ROW
+    BEGIN
+        INSERT INTO maps_changelog (mac) VALUES (OLD.mac);
+        INSERT INTO maps_changelog (mac) VALUES (NEW.mac);
+    END;
+|
+CREATE TRIGGER maps_changelog_delete AFTER DELETE ON maps FOR EACH ROW
+    BEGIN
+        INSERT INTO maps_changelog (mac) VALUES (OLD.mac);
+    END;
+|
+CREATE TRIGGER subnets_changelog_update AFTER UPDATE ON subnets FOR EACH ROW
+    BEGIN
+        INSERT INTO maps_changelog (mac) SELECT mac FROM maps WHERE subnet = NEW.subnet AND serial = NEW.serial;
+    END;
+|
+delimiter ;
+
 delimiter |
 CREATE PROCEDURE cleanup()
     BEGIN
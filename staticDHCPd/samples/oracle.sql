@@ -24,6 +24,30 @@ CREATE TABLE maps (
     FOREIGN KEY (subnet, serial) REFERENCES subnets (subnet, serial)
 );
 
+-- Only needed if SNAPSHOT_INCREMENTAL is enabled: every change to a binding is recorded here, so that
+-- the server can fetch just what changed. Rows may be pruned once older than SNAPSHOT_CHANGELOG_WINDOW plus SNAPSHOT_REFRESH_INTERVAL.
+CREATE TABLE maps_changelog (
+    id NUMBER(19) PRIMARY KEY, -- The position of the change; never reused.
+    mac CHAR(17) NOT NULL -- The MAC whose binding was added, changed, or removed.
+);
+CREATE SEQUENCE maps_changelog_sequence;
+
+CREATE TRIGGER maps_changelog_trigger AFTER INSERT OR UPDATE OR DELETE ON maps FOR EACH ROW
+    BEGIN
+        IF UPDATING OR DELETING THEN
+            INSERT INTO maps_changelog (id, mac) VALUES (maps_changelog_sequence.NEXTVAL, :OLD.mac);
+        END IF;
+        IF INSERTING OR UPDATING THEN
+            INSERT INTO maps_changelog (id, mac) VALUES (maps_changelog_sequence.NEXTVAL, :NEW.mac);
+        END IF;
+    END;
+/
+CREATE TRIGGER subnets_changelog_trigger AFTER UPDATE ON subnets FOR EACH ROW
+    BEGIN
+        INSERT INTO maps_changelog (id, mac) SELECT maps_changelog_sequence.NEXTVAL, mac FROM maps WHERE subnet = :NEW.subnet AND serial = :NEW.serial;
+    END;
+/
+
 /* staticDHCPd requires an account with SELECT access; if anyone can provide a sane description of
    how to set this up under Oracle, it would be very much appreciated.
 */
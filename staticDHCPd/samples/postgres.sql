@@ -24,12 +24,43 @@ CREATE TABLE maps (
     FOREIGN KEY (subnet, serial) REFERENCES subnets (subnet, serial)
 );
 
+-- Only needed if SNAPSHOT_INCREMENTAL is enabled: every change to a binding is recorded here, so that
+-- the server can fetch just what changed. Rows may be pruned once older than SNAPSHOT_CHANGELOG_WINDOW plus SNAPSHOT_REFRESH_INTERVAL.
+CREATE TABLE maps_changelog (
+    id BIGSERIAL PRIMARY KEY, -- The position of the change; never reused.
+    mac CHAR(17) NOT NULL -- The MAC whose binding was added, changed, or removed.
+);
+
+CREATE FUNCTION maps_changelog_record() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO maps_changelog (mac) VALUES (OLD.mac);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO maps_changelog (mac) VALUES (NEW.mac);
+        END IF;
+        RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER maps_changelog_trigger AFTER INSERT OR UPDATE OR DELETE ON maps
+    FOR EACH ROW EXECUTE PROCEDURE maps_changelog_record();
+
+CREATE FUNCTION subnets_changelog_record() RETURNS TRIGGER AS $$
+    BEGIN
+        INSERT INTO maps_changelog (mac) SELECT mac FROM maps WHERE subnet = NEW.subnet AND serial = NEW.serial;
+        RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER subnets_changelog_trigger AFTER UPDATE ON subnets
+    FOR EACH ROW EXECUTE PROCEDURE subnets_changelog_record();
+
 /* staticDHCPd requires an account with SELECT access; the first two of these lines grants that against its
    default config settings; the second pair provides a management account so you don't have to use root.
    How you get entries into the database is up to you, however.
 CREATE USER 'dhcp_user' WITH password 'dhcp_pass';
-GRANT SELECT ON TABLE subnets, maps TO 'dhcp_user';
+GRANT SELECT ON TABLE subnets, maps, maps_changelog TO 'dhcp_user';
 
 CREATE USER 'dhcp_maintainer' WITH password 'dhcp_pass';
-GRANT SELECT, INSERT, DELETE, UPDATE, EXECUTE ON TABLE subnets, maps TO 'dhcp_maintainer';
+GRANT SELECT, INSERT, DELETE, UPDATE, EXECUTE ON TABLE subnets, maps, maps_changelog TO 'dhcp_maintainer';
+GRANT USAGE ON SEQUENCE maps_changelog_id_seq TO 'dhcp_maintainer';
 */
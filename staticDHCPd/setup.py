@@ -27,6 +27,7 @@ setup(
  ],
  scripts = [
   'staticDHCPd',
+  'staticDHCPd-compile',
  ],
 )
 
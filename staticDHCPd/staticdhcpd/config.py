@@ -84,6 +84,13 @@ _defaults.update({
 #######################################
 _defaults.update({
  'PXE_PORT': None,
+
+ 'WORKER_THREADS': 0,
+ 'WORKER_QUEUE_SIZE': 512,
+ 'WORKER_QUEUE_OVERFLOW': 'drop-oldest',
+ 'RECEIVE_BUDGET': 64,
+ 'NETWORK_IO_BACKEND': 'standard',
+ 'WORKER_PROCESSES': 1,
 })
 
 #Server behaviour settings
@@ -101,6 +108,9 @@ _defaults.update({
  'MISBEHAVING_CLIENT_TIMEOUT': 150,
  'ENABLE_SUSPEND': True,
  'SUSPEND_THRESHOLD': 10,
+ 'SUSPEND_RATES': {},
+ 'RELAY_RATE_LIMIT': None,
+ 'RATE_LIMIT_CAPACITY': 65536,
 
  'WEB_RELOAD_KEY': '5f4dcc3b5aa765d61d8327deb882cf99',
 })
@@ -109,8 +119,30 @@ _defaults.update({
 #######################################
 _defaults.update({
  'USE_CACHE': False,
-
+ 'CACHE_POLICY': 'LRU',
+ 'CACHE_CAPACITY': 65536,
+ 'CACHE_TTL': None,
+ 'CACHE_STALE_TTL': 0,
+ 'NEGATIVE_CACHE_TTL': 0,
+ 'NEGATIVE_CACHE_CAPACITY': 16384,
+
+ 'USE_SNAPSHOT': False,
+ 'SNAPSHOT_REFRESH_INTERVAL': 300,
+ 'SNAPSHOT_INCREMENTAL': False,
+ 'SNAPSHOT_CHANGELOG_WINDOW': 60,
+ 'SNAPSHOT_RELOAD_INTERVAL': 3600,
+ 
+ 'LOOKUP_BATCH_WINDOW': 0,
+ 
+ 'QUERY_TIMEOUT': 0,
+ 'BREAKER_THRESHOLD': 0,
+ 'BREAKER_RETRY_INTERVAL': 10,
+ 
  'USE_POOL': True,
+ 'POOL_MINIMUM_CONNECTIONS': 1,
+ 'POOL_MAX_IDLE': 30,
+ 'POOL_MAX_AGE': 600,
+ 'POOL_CHECK_AFTER': 5,
 
  'SQLITE_FILE': '/etc/staticDHCPd/dhcp.sqlite3',
 
@@ -135,6 +167,10 @@ _defaults.update({
  'MYSQL_MAXIMUM_CONNECTIONS': 4,
  
  'INI_FILE': '/etc/staticDHCPd/dhcp.ini',
+ 'INI_WATCH': True,
+ 'INI_POLL_INTERVAL': 5,
+ 
+ 'COMPILED_FILE': '/etc/staticDHCPd/dhcp.bin',
 })
 
 #E-mail settings
@@ -49,6 +49,9 @@ def get_database():
     elif config.DATABASE_ENGINE == 'INI':
         from _ini import INI
         return INI()
+    elif config.DATABASE_ENGINE == 'Compiled':
+        from _compiled import Compiled
+        return Compiled()
         
     raise ValueError("Unknown database engine: %(engine)s" % {
      'engine': config.DATABASE_ENGINE
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd module: databases._breaker
+
+Purpose
+=======
+ Provides a circuit-breaker, to stop brokers from waiting on a failing
+ database.
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import threading
+import time
+
+class DatabaseUnavailableError(Exception):
+    """
+    Indicates that the database was not queried, or not waited on, because it
+    is failing or too slow.
+    """
+    
+class DatabaseBusyError(DatabaseUnavailableError):
+    """
+    Indicates that the database was not queried because every permitted query
+    was already in flight; this says nothing about the database's health.
+    """
+    
+class CircuitBreaker(object):
+    """
+    Counts consecutive failures and, once there have been too many, refuses
+    further attempts until a retry interval has passed, at which point a
+    single attempt is allowed through as a probe: if it succeeds, attempts
+    resume; if not, the interval starts over.
+    """
+    _lock = None #: A lock used to ensure synchronous access to the breaker's state.
+    _threshold = None #: The number of consecutive failures that trip the breaker, or 0 if it never trips.
+    _retry_interval = None #: The number of seconds after tripping before a probe is allowed.
+    _failures = 0 #: The number of consecutive failures.
+    _tripped = None #: The time at which the breaker last tripped, or None if it is closed.
+    _probing = False #: True while a probe is in progress.
+    
+    def __init__(self, threshold, retry_interval):
+        """
+        Sets up the breaker, closed.
+        
+        @type threshold: int
+        @param threshold: The number of consecutive failures that trip the
+            breaker; 0 if it should never trip.
+        @type retry_interval: float
+        @param retry_interval: The number of seconds after tripping before a
+            probe is allowed.
+        """
+        self._lock = threading.Lock()
+        self._threshold = threshold
+        self._retry_interval = retry_interval
+        
+    def allow(self):
+        """
+        Indicates whether an attempt may be made.
+        
+        @rtype: bool
+        @return: True if the breaker is closed or this attempt is the probe.
+        """
+        if self._tripped is None:
+            return True
+        with self._lock:
+            if self._tripped is None:
+                return True
+            if not self._probing and time.time() - self._tripped >= self._retry_interval:
+                self._probing = True
+                return True
+            return False
+            
+    def succeed(self):
+        """
+        Records a successful attempt, closing the breaker.
+        
+        @rtype: bool
+        @return: True if the breaker had been tripped.
+        """
+        if not self._failures and self._tripped is None:
+            return False
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            tripped = self._tripped
+            self._tripped = None
+            return not tripped is None
+            
+    def fail(self):
+        """
+        Records a failed attempt, tripping the breaker if there have been too
+        many.
+        
+        @rtype: bool
+        @return: True if this failure tripped the breaker.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._probing:
+                self._probing = False
+                self._tripped = time.time()
+            elif self._tripped is None and self._threshold and self._failures >= self._threshold:
+                self._tripped = time.time()
+                return True
+            return False
+            
+    def abandon(self):
+        """
+        Records an attempt that was allowed but never made, so that, if it was
+        the probe, another may be allowed in its place.
+        """
+        if not self._probing:
+            return
+        with self._lock:
+            self._probing = False
+            
@@ -0,0 +1,320 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd module: databases._cache
+
+Purpose
+=======
+ Provides bounded, expiring caches for use by database brokers.
+
+ Lookups in these caches take no lock, so that any number of threads may
+ read them at once; only changes are serialised.
+
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import collections
+import threading
+import time
+
+_HIT_BUFFER_SIZE = 1024 #: The number of hits an LRUCache remembers until its next change, when they are applied to its order.
+
+def get_cache(policy, capacity, ttl):
+    """
+    Assembles and returns a cache.
+    
+    @type policy: basestring
+    @param policy: The eviction policy to use: 'LRU' or 'CLOCK'.
+    @type capacity: int|None
+    @param capacity: The number of entries to hold; None for no limit.
+    @type ttl: float|None
+    @param ttl: The number of seconds for which an entry remains valid; None
+        for no limit.
+    
+    @rtype: _Cache
+    @return: A cache.
+    
+    @raise ValueError: If the policy is unknown.
+    """
+    if policy == 'LRU':
+        return LRUCache(capacity, ttl)
+    elif policy == 'CLOCK':
+        return ClockCache(capacity, ttl)
+        
+    raise ValueError("Unknown cache policy: %(policy)s" % {
+     'policy': policy,
+    })
+    
+class _Cache(object):
+    """
+    A stub documenting the features a cache must provide, and the counters
+    common to all of them.
+    
+    Every counter but L{_hits} is only changed with the lock held, so those
+    are exact. Hits are the one path that takes no lock, so their count is
+    advanced without one and is a sample: concurrent hits may occasionally be
+    counted once.
+    """
+    _lock = None #: A lock used to ensure synchronous changes to the cache's contents and counters; hits don't take it.
+    _capacity = None #: The number of entries the cache may hold, or None if unbounded.
+    _ttl = None #: The number of seconds for which an entry remains valid, or None if unbounded.
+    _hits = 0 #: The number of lookups that found a valid entry, approximately.
+    _misses = 0 #: The number of lookups that found no valid entry.
+    _evictions = 0 #: The number of entries discarded to make room for others.
+    _expirations = 0 #: The number of entries discarded for having outlived the TTL.
+    
+    def __init__(self, capacity, ttl):
+        """
+        Sets up the cache.
+        
+        @type capacity: int|None
+        @param capacity: The number of entries to hold; None for no limit.
+        @type ttl: float|None
+        @param ttl: The number of seconds for which an entry remains valid;
+            None for no limit.
+        """
+        self._lock = threading.Lock()
+        self._capacity = capacity and max(1, int(capacity)) or None
+        self._ttl = ttl and float(ttl) or None
+        
+    def get(self, key):
+        """
+        Retrieves an entry from the cache.
+        
+        @type key: hashable
+        @param key: The identity of the entry.
+        
+        @rtype: object|None
+        @return: The cached value, or None if there is no valid entry.
+        """
+        raise NotImplementedError("get must be overridden")
+        
+    def put(self, key, value):
+        """
+        Adds or replaces an entry in the cache, evicting another if the cache is
+        full.
+        
+        @type key: hashable
+        @param key: The identity of the entry.
+        @type value: object
+        @param value: The value to cache; must not be None.
+        """
+        raise NotImplementedError("put must be overridden")
+        
+    def discard(self, key):
+        """
+        Removes an entry from the cache, if present.
+        
+        @type key: hashable
+        @param key: The identity of the entry.
+        """
+        raise NotImplementedError("discard must be overridden")
+        
+    def clear(self):
+        """
+        Discards every entry.
+        """
+        raise NotImplementedError("clear must be overridden")
+        
+    def getStats(self):
+        """
+        Reports on the cache's effectiveness since it was created.
+        
+        @rtype: tuple(5)
+        @return: (entries:int, hits:int, misses:int, evictions:int,
+            expirations:int).
+        """
+        with self._lock:
+            return (len(self), self._hits, self._misses, self._evictions, self._expirations)
+            
+    def _getExpiry(self):
+        """
+        @rtype: float|None
+        @return: The time at which an entry added now will expire, or None if
+            entries do not expire.
+        """
+        if self._ttl:
+            return time.time() + self._ttl
+        return None
+        
+class LRUCache(_Cache):
+    """
+    A cache that evicts the least recently used entry when full.
+    
+    A hit doesn't reorder the entries itself, since that would need the lock;
+    it is noted in a bounded buffer instead and applied to the order by the
+    next change. Under a long run of hits, only the most recent
+    L{_HIT_BUFFER_SIZE} count towards the order.
+    """
+    _entries = None #: An OrderedDict of (value, expiry) pairs, least recently used first, hits excepted.
+    _hits_pending = None #: The keys of hits not yet applied to the order, oldest first.
+    
+    def __init__(self, capacity, ttl):
+        _Cache.__init__(self, capacity, ttl)
+        self._entries = collections.OrderedDict()
+        self._hits_pending = collections.deque(maxlen=_HIT_BUFFER_SIZE)
+        
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and not (entry[1] and entry[1] < time.time()):
+            self._hits_pending.append(key)
+            self._hits += 1
+            return entry[0]
+            
+        with self._lock:
+            self._misses += 1
+            if entry is not None and self._entries.get(key) is entry: #Expired and not yet replaced.
+                del self._entries[key]
+                self._expirations += 1
+        return None
+        
+    def put(self, key, value):
+        entry = (value, self._getExpiry())
+        with self._lock:
+            self._applyHits()
+            if self._entries.pop(key, None) is None and self._capacity and len(self._entries) >= self._capacity:
+                victim = self._entries.popitem(last=False)[1]
+                if victim[1] and victim[1] < time.time():
+                    self._expirations += 1
+                else:
+                    self._evictions += 1
+            self._entries[key] = entry
+            
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits_pending.clear()
+            
+    def _applyHits(self):
+        """
+        Moves the entries of pending hits to the most recently used end.
+        
+        Must be called with the lock held.
+        """
+        entries = self._entries
+        hits_pending = self._hits_pending
+        for i in xrange(len(hits_pending)):
+            key = hits_pending.popleft()
+            entry = entries.pop(key, None)
+            if entry is not None:
+                entries[key] = entry
+                
+    def __len__(self):
+        return len(self._entries)
+        
+class ClockCache(_Cache):
+    """
+    A cache that approximates LRU with the CLOCK algorithm: a hit only sets a
+    flag on its entry, rather than reordering anything, and, when full, a hand
+    sweeps around the entries, clearing flags until it finds one that hasn't
+    been used since its last pass, which is evicted.
+    
+    Hits never change the collection; an expired entry is removed by the
+    lookup that finds it, under the lock. The slots of removed entries are
+    reused before the hand evicts anything, so they never count against the
+    capacity.
+    """
+    _entries = None #: A dictionary of [value, expiry, referenced, key, slot] entries.
+    _ring = None #: The entries in the order the hand visits them.
+    _free = None #: The positions in the ring of entries that have been removed.
+    _hand = 0 #: The position in the ring that the hand will visit next.
+    
+    def __init__(self, capacity, ttl):
+        _Cache.__init__(self, capacity, ttl)
+        self._entries = {}
+        self._ring = []
+        self._free = []
+        
+    def _release(self, entry):
+        """
+        Makes the slot of an entry that has been removed available for reuse.
+        
+        Must be called with the lock held.
+        """
+        if entry[4] is not None:
+            self._free.append(entry[4])
+        
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and not (entry[1] and entry[1] < time.time()):
+            entry[2] = True
+            self._hits += 1
+            return entry[0]
+            
+        with self._lock:
+            self._misses += 1
+            if entry is not None and self._entries.get(key) is entry: #Expired and not yet replaced.
+                del self._entries[key]
+                self._release(entry)
+                self._expirations += 1
+        return None
+        
+    def put(self, key, value):
+        expiry = self._getExpiry()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[0] = value
+                entry[1] = expiry
+                return
+                
+            entry = [value, expiry, False, key, None]
+            if not self._capacity: #Nothing will ever be evicted, so there's no need for the ring.
+                pass
+            elif self._free:
+                entry[4] = self._free.pop()
+                self._ring[entry[4]] = entry
+            elif len(self._ring) < self._capacity:
+                entry[4] = len(self._ring)
+                self._ring.append(entry)
+            else: #Every slot holds a live entry.
+                ring = self._ring
+                hand = self._hand
+                while ring[hand][2]:
+                    ring[hand][2] = False
+                    hand = (hand + 1) % len(ring)
+                victim = ring[hand]
+                del self._entries[victim[3]]
+                if victim[1] and victim[1] < time.time():
+                    self._expirations += 1
+                else:
+                    self._evictions += 1
+                entry[4] = hand
+                ring[hand] = entry
+                self._hand = (hand + 1) % len(ring)
+            self._entries[key] = entry
+            
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._release(entry)
+                
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ring = []
+            self._free = []
+            self._hand = 0
+            
+    def __len__(self):
+        return len(self._entries)
+        
@@ -0,0 +1,444 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd module: databases._compiled
+
+Purpose
+=======
+ Provides a uniform datasource API, implementing a backend that reads a
+ memory-mapped, precompiled binding table, and the means to compile one.
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import binascii
+import csv
+import mmap
+import os
+import socket
+import struct
+
+from .. import config
+from .. import logging
+
+from _generic import Database
+
+#The file begins with a header, followed by every binding, sorted by MAC, then
+#every subnet, then the strings referenced by both, each prefixed by its length.
+#All strings are referenced by their offset from the start of the string table.
+_MAGIC = 'SDHCPDB\x01' #: Identifies the format and its version.
+_HEADER = struct.Struct('<8sIII') #: magic, binding count, subnet count, string table offset.
+_BINDING = struct.Struct('<6s4sII') #: mac, ip, hostname string, subnet index.
+_SUBNET = struct.Struct('<IiIIIIIII') #: subnet string, serial, lease_time, gateway, subnet_mask, broadcast_address, domain_name, domain_name_servers, ntp_servers.
+_STRING_LENGTH = struct.Struct('<H') #: The length of a string.
+_NO_STRING = 0xFFFFFFFF #: The offset used to represent None.
+_CHECK_CHUNK = 4096 #: The number of bindings whose references are checked together when a file is loaded.
+_CHECK_BINDINGS = struct.Struct('<' + '10xII' * _CHECK_CHUNK) #: The hostname string and subnet index of _CHECK_CHUNK bindings.
+
+#The columns of a CSV file, as produced by joining the maps and subnets tables.
+_CSV_COLUMNS = (
+ 'mac', 'ip', 'hostname', 'subnet', 'serial',
+ 'lease_time', 'gateway', 'subnet_mask', 'broadcast_address',
+ 'ntp_servers', 'domain_name_servers', 'domain_name',
+)
+
+def _pack_mac(mac):
+    """
+    Converts a MAC address into its binary form.
+    
+    @type mac: basestring
+    @param mac: The MAC address, like 'aa:bb:cc:dd:ee:ff'.
+    
+    @rtype: str
+    @return: The six bytes of the MAC.
+    
+    @raise ValueError: If the MAC is invalid.
+    """
+    try:
+        packed = binascii.unhexlify(str(mac).replace(':', '').replace('-', ''))
+    except TypeError:
+        packed = None
+    if not packed or len(packed) != 6:
+        raise ValueError("Invalid MAC: %(mac)s" % {
+         'mac': mac,
+        })
+    return packed
+    
+class _StringTable(object):
+    """
+    Accumulates distinct strings for a compiled file.
+    """
+    _offsets = None #: The offset of every string added, keyed by the string.
+    _chunks = None #: The encoded strings, in order.
+    _size = 0 #: The number of bytes in the table.
+    
+    def __init__(self):
+        self._offsets = {}
+        self._chunks = []
+        
+    def add(self, value):
+        """
+        Adds a string to the table, unless already present.
+        
+        @type value: basestring|None
+        @param value: The string to add.
+        
+        @rtype: int
+        @return: The string's offset in the table.
+        
+        @raise ValueError: If the string is too long.
+        """
+        if value is None:
+            return _NO_STRING
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+            
+        offset = self._offsets.get(value)
+        if offset is None:
+            if len(value) > 0xFFFF:
+                raise ValueError("String too long to compile: %(value)r" % {
+                 'value': value[:32],
+                })
+            offset = self._offsets[value] = self._size
+            self._chunks.append(_STRING_LENGTH.pack(len(value)) + value)
+            self._size += _STRING_LENGTH.size + len(value)
+        return offset
+        
+    def getData(self):
+        """
+        @rtype: str
+        @return: The table, as written to the file.
+        """
+        return ''.join(self._chunks)
+        
+def write_compiled(path, bindings):
+    """
+    Compiles bindings into a file that can be read by the L{Compiled} broker,
+    replacing any existing file atomically, so that running servers never see
+    a partial one.
+    
+    @type path: basestring
+    @param path: The file to write.
+    @type bindings: iterable
+    @param bindings: (mac:basestring, details:tuple(11)) pairs, where details
+        are as returned by L{Database.lookupMAC}.
+    
+    @rtype: int
+    @return: The number of bindings written.
+    
+    @raise ValueError: If a binding is invalid or a MAC is repeated.
+    @raise IOError: If the file could not be written.
+    """
+    strings = _StringTable()
+    subnets = {}
+    subnet_records = []
+    records = []
+    for (mac, details) in bindings:
+        (ip, hostname,
+            gateway, subnet_mask, broadcast_address,
+            domain_name, domain_name_servers, ntp_servers,
+            lease_time, subnet, serial) = details
+            
+        subnet_index = subnets.get((subnet, serial))
+        if subnet_index is None:
+            subnet_index = subnets[(subnet, serial)] = len(subnet_records)
+            subnet_records.append(_SUBNET.pack(
+             strings.add(subnet), int(serial), int(lease_time),
+             strings.add(gateway), strings.add(subnet_mask), strings.add(broadcast_address),
+             strings.add(domain_name), strings.add(domain_name_servers), strings.add(ntp_servers),
+            ))
+            
+        try:
+            packed_ip = socket.inet_aton(str(ip))
+        except socket.error:
+            raise ValueError("Invalid IP for %(mac)s: %(ip)s" % {
+             'mac': mac,
+             'ip': ip,
+            })
+        records.append((_pack_mac(mac), packed_ip, strings.add(hostname), subnet_index))
+    records.sort()
+    
+    for i in xrange(1, len(records)):
+        if records[i][0] == records[i - 1][0]:
+            raise ValueError("MAC repeated: %(mac)s" % {
+             'mac': ':'.join('%02x' % (ord(c),) for c in records[i][0]),
+            })
+            
+    strings_offset = _HEADER.size + len(records) * _BINDING.size + len(subnet_records) * _SUBNET.size
+    temporary_path = path + '.tmp'
+    output = open(temporary_path, 'wb')
+    try:
+        output.write(_HEADER.pack(_MAGIC, len(records), len(subnet_records), strings_offset))
+        for record in records:
+            output.write(_BINDING.pack(*record))
+        output.write(''.join(subnet_records))
+        output.write(strings.getData())
+        output.flush()
+        os.fsync(output.fileno())
+    finally:
+        output.close()
+    os.rename(temporary_path, path)
+    return len(records)
+    
+def read_csv(path):
+    """
+    Reads bindings from a CSV file, with a header row naming its columns:
+    mac, ip, hostname, subnet, serial, lease_time, gateway, subnet_mask,
+    broadcast_address, ntp_servers, domain_name_servers, domain_name; as in
+    the SQL schema, empty values are treated as null and only mac, ip, subnet,
+    serial, and lease_time are required.
+    
+    @type path: basestring
+    @param path: The file to read.
+    
+    @rtype: generator
+    @return: (mac:basestring, details:tuple(11)) pairs, where details are as
+        returned by L{Database.lookupMAC}.
+    
+    @raise ValueError: If a required column is missing.
+    @raise IOError: If the file could not be read.
+    """
+    input = open(path, 'rb')
+    try:
+        reader = csv.DictReader(input)
+        missing = set(('mac', 'ip', 'subnet', 'serial', 'lease_time')).difference(reader.fieldnames or ())
+        if missing:
+            raise ValueError("Required columns missing from '%(file)s': %(columns)s" % {
+             'file': path,
+             'columns': ', '.join(sorted(missing)),
+            })
+            
+        for row in reader:
+            row = dict((column, row.get(column) or None) for column in _CSV_COLUMNS)
+            yield (row['mac'], (
+             row['ip'], row['hostname'],
+             row['gateway'], row['subnet_mask'], row['broadcast_address'],
+             row['domain_name'], row['domain_name_servers'], row['ntp_servers'],
+             int(row['lease_time']), row['subnet'], int(row['serial']),
+            ))
+    finally:
+        input.close()
+        
+class Compiled(Database):
+    """
+    Implements a broker for compiled binding tables.
+    
+    The file is memory-mapped and binary-searched in place, and its pages are
+    shared by every process that maps it. Only the subnets, of which there are
+    few, are read into memory; the bindings are read once, when the file is
+    loaded, to check that everything they refer to is within it.
+    """
+    _config_prefix = 'COMPILED'
+    _coalesce = False
+    _bounded_queries = True
+    _table = None #: The mapped file, as (data:mmap, bindings:int, strings_offset:int, subnets:list) values, replaced as a whole on reload.
+    
+    def __init__(self):
+        """
+        Constructs the broker.
+        
+        @raise ValueError: If the file is not a compiled binding table, or if
+            it is truncated or corrupt.
+        @raise IOError: If the file could not be read.
+        """
+        self._loadTable()
+        
+        self._setupBroker(65536) #Effectively no limit on the number of simultaneous readers
+        
+    def _loadTable(self):
+        """
+        Maps the compiled file into memory, replacing any previously mapped
+        one.
+        
+        @raise ValueError: If the file is not a compiled binding table, or if
+            it is truncated or corrupt.
+        @raise IOError: If the file could not be read.
+        """
+        input = open(config.COMPILED_FILE, 'rb')
+        try:
+            data = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            input.close()
+            
+        if len(data) < _HEADER.size:
+            raise ValueError("'%(file)s' is not a compiled binding table" % {
+             'file': config.COMPILED_FILE,
+            })
+        (magic, bindings, subnet_count, strings_offset) = _HEADER.unpack_from(data, 0)
+        subnets_offset = _HEADER.size + bindings * _BINDING.size
+        if magic != _MAGIC or subnets_offset + subnet_count * _SUBNET.size != strings_offset or strings_offset > len(data):
+            raise ValueError("'%(file)s' is not a compiled binding table" % {
+             'file': config.COMPILED_FILE,
+            })
+            
+        #Every reference is checked, so that damage is found now rather than
+        #by lookups. Strings are written in order, so the furthest referenced
+        #is the first lost if the file is truncated, and, if it lies wholly
+        #within the file, so do the starts of all the others.
+        furthest = -1 #The offset of the furthest string referenced.
+        for start in xrange(0, bindings, _CHECK_CHUNK):
+            count = min(_CHECK_CHUNK, bindings - start)
+            layout = _CHECK_BINDINGS
+            if count < _CHECK_CHUNK:
+                layout = struct.Struct('<' + '10xII' * count)
+            fields = layout.unpack_from(data, _HEADER.size + start * _BINDING.size)
+            if max(fields[1::2]) >= subnet_count:
+                raise ValueError("'%(file)s' is corrupt: a binding refers to a subnet beyond the %(count)i defined" % {
+                 'file': config.COMPILED_FILE,
+                 'count': subnet_count,
+                })
+            hostnames = set(fields[0::2])
+            hostnames.discard(_NO_STRING)
+            if hostnames:
+                furthest = max(furthest, max(hostnames))
+                
+        subnet_records = []
+        for i in xrange(subnet_count):
+            fields = _SUBNET.unpack_from(data, subnets_offset + i * _SUBNET.size)
+            for offset in fields[:1] + fields[3:]:
+                if offset != _NO_STRING:
+                    furthest = max(furthest, offset)
+            subnet_records.append(fields)
+            
+        if furthest >= 0:
+            end = strings_offset + furthest + _STRING_LENGTH.size
+            if end > len(data) or end + _STRING_LENGTH.unpack_from(data, end - _STRING_LENGTH.size)[0] > len(data):
+                raise ValueError("'%(file)s' is corrupt: string %(offset)i lies beyond the end of the file" % {
+                 'file': config.COMPILED_FILE,
+                 'offset': furthest,
+                })
+                
+        read = lambda offset: self._readString(data, strings_offset, offset)
+        subnets = []
+        for (subnet, serial, lease_time,
+            gateway, subnet_mask, broadcast_address,
+            domain_name, domain_name_servers, ntp_servers,
+        ) in subnet_records:
+            subnets.append((
+             read(gateway), read(subnet_mask), read(broadcast_address),
+             read(domain_name), read(domain_name_servers), read(ntp_servers),
+             lease_time, read(subnet), serial,
+            ))
+        self._table = (data, bindings, strings_offset, subnets)
+        
+    def _readString(self, data, strings_offset, offset):
+        """
+        Reads a string from the compiled file.
+        
+        @type data: mmap
+        @param data: The mapped file.
+        @type strings_offset: int
+        @param strings_offset: The position of the string table.
+        @type offset: int
+        @param offset: The position of the string in the table.
+        
+        @rtype: str|None
+        @return: The string, or None if the offset represents None.
+        """
+        if offset == _NO_STRING:
+            return None
+        start = strings_offset + offset + _STRING_LENGTH.size
+        return data[start:start + _STRING_LENGTH.unpack_from(data, start - _STRING_LENGTH.size)[0]]
+        
+    def _readBinding(self, table, index):
+        """
+        Reads a binding from the compiled file.
+        
+        @type table: tuple(4)
+        @param table: The mapped file, as stored in L{_table}.
+        @type index: int
+        @param index: The position of the binding.
+        
+        @rtype: tuple(2)
+        @return: (mac:str, details:tuple(11)), where mac is binary and details
+            are as returned by L{lookupMAC}.
+        """
+        (data, bindings, strings_offset, subnets) = table
+        (mac, ip, hostname, subnet) = _BINDING.unpack_from(data, _HEADER.size + index * _BINDING.size)
+        return (mac, (socket.inet_ntoa(ip), self._readString(data, strings_offset, hostname),) + subnets[subnet])
+        
+    def flushCache(self):
+        """
+        Maps the compiled file anew, so that a freshly compiled replacement
+        takes effect, then resets the cache.
+        
+        If the file cannot be mapped, the previous one remains in service.
+        """
+        try:
+            self._loadTable()
+        except Exception, e:
+            logging.writeLog("Unable to reload '%(file)s': %(error)s" % {
+             'file': config.COMPILED_FILE,
+             'error': str(e),
+            })
+        Database.flushCache(self)
+        
+    def _lookupMAC(self, mac):
+        """
+        Queries the database for the given MAC address and returns the IP and
+        associated details if the MAC is known.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: tuple(11)|None
+        @return: (ip:basestring, hostname:basestring|None,
+            gateway:basestring|None, subnet_mask:basestring|None,
+            broadcast_address:basestring|None,
+            domain_name:basestring|None, domain_name_servers:basestring|None,
+            ntp_servers:basestring|None, lease_time:int,
+            subnet:basestring, serial:int) or None if no match was
+            found.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        try:
+            key = _pack_mac(mac)
+        except ValueError: #Not an Ethernet address, so it can't have been compiled.
+            return None
+            
+        table = self._table
+        data = table[0]
+        low = 0
+        high = table[1]
+        while low < high:
+            middle = (low + high) // 2
+            offset = _HEADER.size + middle * _BINDING.size
+            candidate = data[offset:offset + 6]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return self._readBinding(table, middle)[1]
+        return None
+        
+    def _lookupAllMACs(self):
+        """
+        Reads every binding in the compiled file.
+        
+        @rtype: generator
+        @return: (mac:basestring, details:tuple(11)) pairs, where details are
+            as returned by L{lookupMAC}.
+        """
+        table = self._table
+        for i in xrange(table[1]):
+            (mac, details) = self._readBinding(table, i)
+            yield (':'.join('%02x' % (ord(c),) for c in mac), details)
+            
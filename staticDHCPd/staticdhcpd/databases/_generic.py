@@ -25,18 +25,44 @@ Legal
  
  (C) Neil Tallim, 2013 <flan@uguu.ca>
 """
+import collections
+import Queue
+import sys
 import threading
+import time
 
 from .. import config
+from .. import logging
+
+from _breaker import (CircuitBreaker, DatabaseBusyError, DatabaseUnavailableError)
+from _cache import get_cache
+from _timeout import QueryRunner
 
 class Database(object):
     """
     A stub documenting the features a Database object must provide.
     """
+    _config_prefix = None #: The prefix of the engine-specific configuration options that override generic ones, like 'SQLITE'.
     _resource_lock = None #: A lock used to prevent the database from being overwhelmed.
-    _cache_lock = None #: A lock used to prevent multiple simultaneous cache updates.
-    _mac_cache = None #: A cache used to prevent unnecessary database hits.
-    _subnet_cache = None #: A cache used to prevent unnecessary database hits.
+    _inflight_lock = None #: A lock used to ensure synchronous access to in-flight lookups.
+    _inflight = None #: The lookups currently being performed, as [completion_event, result, exc_info] lists keyed by MAC; the event is None until another thread waits.
+    _coalesce = True #: Whether concurrent lookups of the same MAC share a single query; False for brokers whose lookups cost less than the sharing.
+    _batch_window = None #: The number of seconds for which lookups are gathered into a batch, or 0 if they aren't.
+    _batch_lock = None #: A lock used to ensure synchronous access to the current batch.
+    _batch = None #: The lookups gathered into the current batch, as [mac, completion_event, result, exc_info] lists.
+    _mac_cache = None #: A cache of details, as returned by L{lookupMAC}, keyed by MAC, used to prevent unnecessary database hits.
+    _unknown_cache = None #: A cache of MACs recently found to be unknown, used to prevent repeated database hits, or None if disabled.
+    _snapshot = None #: Every binding in the database, as a dictionary keyed by MAC, or None if snapshots are disabled.
+    _snapshot_subnets = None #: The subnet details shared by bindings in the snapshot, keyed by themselves.
+    _snapshot_marks = None #: (time, position) pairs, oldest first, recording the latest changelog position seen by loads and patches, if refreshed incrementally.
+    _snapshot_refresh = None #: An event set to make the snapshot be reloaded immediately.
+    _stale_cache = None #: A cache of the last known details of MACs, served while they are refreshed in the background, or None if disabled.
+    _revalidations = None #: A queue of MACs whose stale details are to be refreshed in the background.
+    _revalidating = None #: The MACs currently queued for refreshing.
+    _breaker = None #: The circuit-breaker that stops queries to a failing database.
+    _query_timeout = None #: The number of seconds to wait for a query before giving up on it, or 0 if unbounded.
+    _bounded_queries = False #: Whether queries finish within QUERY_TIMEOUT on their own, because the engine enforces it or they never block, so they needn't be run in helper threads.
+    _query_runner = None #: The helper threads that run queries, so they can be given up on, or None if they aren't needed.
     
     def _setupBroker(self, concurrency_limit):
         """
@@ -49,33 +75,299 @@ class Database(object):
             permit.
         """
         self._resource_lock = threading.BoundedSemaphore(concurrency_limit)
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+        self._batch_window = self._getSetting('LOOKUP_BATCH_WINDOW')
+        self._batch_lock = threading.Lock()
+        self._batch = []
+        self._breaker = CircuitBreaker(
+         self._getSetting('BREAKER_THRESHOLD'), self._getSetting('BREAKER_RETRY_INTERVAL')
+        )
+        self._query_timeout = self._getSetting('QUERY_TIMEOUT')
+        if self._query_timeout and not self._bounded_queries:
+            self._query_runner = QueryRunner(self._resource_lock, concurrency_limit, self._query_timeout)
         self._setupCache()
+        self._setupSnapshot()
+        
+    def _getSetting(self, name):
+        """
+        Provides the value of a configuration option, preferring the
+        engine-specific variant, if one is defined.
+        
+        @type name: basestring
+        @param name: The generic name of the option, like 'CACHE_TTL'.
+        
+        @return: The option's value.
+        """
+        if self._config_prefix:
+            specific_name = '%(prefix)s_%(name)s' % {
+             'prefix': self._config_prefix,
+             'name': name,
+            }
+            if hasattr(config, specific_name):
+                return getattr(config, specific_name)
+        return getattr(config, name)
         
     def _setupCache(self):
         """
-        Sets up the SQL broker cache.
+        Sets up the broker cache.
         """
         if config.USE_CACHE:
-            self._cache_lock = threading.Lock()
-            self._mac_cache = {}
-            self._subnet_cache = {}
+            policy = self._getSetting('CACHE_POLICY')
+            capacity = self._getSetting('CACHE_CAPACITY')
+            ttl = self._getSetting('CACHE_TTL')
+            self._mac_cache = get_cache(policy, capacity, ttl)
+            
+        ttl = self._getSetting('NEGATIVE_CACHE_TTL')
+        if ttl:
+            self._unknown_cache = get_cache(
+             self._getSetting('CACHE_POLICY'), self._getSetting('NEGATIVE_CACHE_CAPACITY'), ttl
+            )
+            
+        stale_ttl = self._getSetting('CACHE_STALE_TTL')
+        if config.USE_CACHE and stale_ttl:
+            self._stale_cache = get_cache(
+             'LRU', self._getSetting('CACHE_CAPACITY'), (self._getSetting('CACHE_TTL') or 0) + stale_ttl
+            )
+            self._revalidations = Queue.Queue(1024)
+            self._revalidating = set()
+            
+            revalidation_thread = threading.Thread(target=self._revalidate)
+            revalidation_thread.daemon = True
+            revalidation_thread.start()
+            
+    def _setupSnapshot(self):
+        """
+        Loads the snapshot and starts the thread that keeps it current, if
+        snapshots are enabled.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        if self._getSetting('USE_SNAPSHOT'):
+            self._loadSnapshot()
+            self._snapshot_refresh = threading.Event()
+            
+            snapshot_thread = threading.Thread(target=self._refreshSnapshot)
+            snapshot_thread.daemon = True
+            snapshot_thread.start()
+            
+    def _loadSnapshot(self):
+        """
+        Reads every binding from the database and replaces the snapshot with
+        them, once complete.
+        
+        Subnet details are shared between all bindings that reference the same
+        subnet, to keep the snapshot compact.
+        
+        @rtype: int
+        @return: The number of bindings loaded.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        snapshot = {}
+        subnets = {}
+        with self._resource_lock:
+            position = None
+            if self._getSetting('SNAPSHOT_INCREMENTAL'): #Changes made during the load will be replayed, harmlessly.
+                position = self._getChangelogPosition()
+                position_time = time.time()
+            for (mac, data) in self._lookupAllMACs():
+                subnet_data = data[2:]
+                snapshot[mac.lower()] = data[:2] + subnets.setdefault(subnet_data, subnet_data)
+                
+        self._snapshot_subnets = subnets
+        if not position is None:
+            if self._snapshot_marks is None: #Nothing earlier is known, so the first load's position stands as though already a window old.
+                self._snapshot_marks = collections.deque(((0, position),))
+            else:
+                self._snapshot_marks.append((position_time, position))
+        self._snapshot = snapshot
+        return len(snapshot)
+        
+    def _patchSnapshot(self):
+        """
+        Applies every change recorded in the database's changelog since the
+        snapshot was last loaded or patched.
+        
+        Positions are assigned when changes are made, not when they are
+        committed, so a change may become visible after others with later
+        positions have been applied. Rather than resuming from the latest
+        position seen, every patch re-reads the changelog from the latest
+        position that had been seen SNAPSHOT_CHANGELOG_WINDOW seconds earlier;
+        any change committed within that long of being made is applied, and
+        re-applying the others is harmless, since each reads the MAC's current
+        binding. Slower transactions are caught by the periodic full reload.
+        
+        Each binding is replaced or removed individually, so lookups see every
+        MAC either as it was or as it now is.
+        
+        @rtype: int
+        @return: The number of changes applied that hadn't been seen before.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        marks = self._snapshot_marks
+        horizon = time.time() - self._getSetting('SNAPSHOT_CHANGELOG_WINDOW')
+        while len(marks) > 1 and marks[1][0] <= horizon:
+            marks.popleft()
+        latest_position = marks[-1][1]
+        
+        with self._resource_lock:
+            changes = self._lookupChangedMACs(marks[0][1])
+            position_time = time.time()
+            
+        snapshot = self._snapshot
+        subnets = self._snapshot_subnets
+        new_changes = 0
+        position = latest_position
+        for (position, mac, data) in changes:
+            if data:
+                subnet_data = data[2:]
+                snapshot[mac.lower()] = data[:2] + subnets.setdefault(subnet_data, subnet_data)
+            else:
+                snapshot.pop(mac.lower(), None)
+            if position > latest_position:
+                new_changes += 1
+        if position > latest_position:
+            marks.append((position_time, position))
+        return new_changes
+        
+    def _refreshSnapshot(self):
+        """
+        Refreshes the snapshot every SNAPSHOT_REFRESH_INTERVAL seconds, either
+        by reloading it or, if SNAPSHOT_INCREMENTAL is set, by applying the
+        changes made since the last refresh. It is always reloaded when the
+        cache is flushed and, if refreshed incrementally, at least every
+        SNAPSHOT_RELOAD_INTERVAL seconds.
+        
+        A reloaded snapshot replaces the old one only once complete, so lookups
+        never see a partial snapshot and a failed refresh leaves the last good
+        one in service.
+        """
+        interval = self._getSetting('SNAPSHOT_REFRESH_INTERVAL')
+        incremental = self._getSetting('SNAPSHOT_INCREMENTAL')
+        reload_interval = self._getSetting('SNAPSHOT_RELOAD_INTERVAL')
+        load_time = time.time()
+        while True:
+            flushed = self._snapshot_refresh.wait(interval)
+            self._snapshot_refresh.clear()
             
+            start_time = time.time()
+            try:
+                if incremental and not flushed and not (reload_interval and start_time - load_time >= reload_interval):
+                    changes = self._patchSnapshot()
+                    if changes:
+                        logging.writeLog("Applied %(count)i changes to database snapshot in %(time).3fs" % {
+                         'count': changes,
+                         'time': time.time() - start_time,
+                        })
+                else:
+                    count = self._loadSnapshot()
+                    load_time = start_time
+                    logging.writeLog("Refreshed database snapshot: %(count)i MACs in %(time).3fs" % {
+                     'count': count,
+                     'time': time.time() - start_time,
+                    })
+            except Exception, e:
+                logging.writeLog("Unable to refresh database snapshot; continuing with the previous one: %(error)s" % {
+                 'error': str(e),
+                })
+                
+    def _lookupAllMACs(self):
+        """
+        Queries the database for every known MAC address.
+        
+        @rtype: iterable
+        @return: (mac:basestring, details:tuple(11)) pairs, where details are
+            as returned by L{lookupMAC}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        raise NotImplementedError("_lookupAllMACs must be overridden to support snapshots")
+        
+    def _getChangelogPosition(self):
+        """
+        Identifies the most recent change recorded in the database's changelog.
+        
+        @rtype: int
+        @return: The position of the latest change, or 0 if there are none.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        raise NotImplementedError("_getChangelogPosition must be overridden to support incremental snapshots")
+        
+    def _lookupChangedMACs(self, position):
+        """
+        Queries the database for the current state of every MAC address changed
+        after the given position in its changelog.
+        
+        @type position: int
+        @param position: The position after which changes are wanted.
+        
+        @rtype: list
+        @return: (position:int, mac:basestring, details:tuple(11)|None)
+            triples, in order of position, details being as returned by
+            L{lookupMAC} or None if the MAC was removed.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        raise NotImplementedError("_lookupChangedMACs must be overridden to support incremental snapshots")
+        
     def flushCache(self):
         """
         Resets the cache to an empty state, forcing all lookups to pull fresh
         data.
+        
+        If snapshots are enabled, the snapshot is reloaded in the background.
         """
+        if not self._snapshot_refresh is None:
+            self._snapshot_refresh.set()
         if config.USE_CACHE:
-            with self._cache_lock:
-                self._mac_cache.clear()
-                self._subnet_cache.clear()
-                
+            self._mac_cache.clear()
+        if not self._unknown_cache is None:
+            self._unknown_cache.clear()
+        if not self._stale_cache is None:
+            self._stale_cache.clear()
+            
+    def getCacheStats(self):
+        """
+        Reports on the effectiveness of the cache.
+        
+        @rtype: tuple(5)|None
+        @return: (entries:int, hits:int, misses:int, evictions:int,
+            expirations:int), counting MAC lookups, or None if caching is
+            disabled.
+        """
+        if config.USE_CACHE:
+            return self._mac_cache.getStats()
+        return None
+        
+    def getPoolStats(self):
+        """
+        Reports on the state of the connection pool.
+        
+        @rtype: tuple(6)|None
+        @return: (open:int, idle:int, created:int, reused:int, discarded:int,
+            waits:int), or None if the broker does not pool connections.
+        """
+        return None
+        
     def lookupMAC(self, mac):
         """
         Queries the database for the given MAC address and returns the IP and
         associated details if the MAC is known.
         
-        If enabled, the cache is checked and updated by this function.
+        If enabled, the cache is checked and updated by this function, as is
+        the cache of unknown MACs. If snapshots are enabled, only the snapshot
+        is consulted. Unless the broker's lookups are cheaper than sharing
+        them, concurrent lookups of the same MAC share a single query and, if
+        LOOKUP_BATCH_WINDOW is set, concurrent lookups of different MACs are
+        combined into one.
+        
+        If CACHE_STALE_TTL is set, details that have expired from the cache are
+        still returned, for that much longer, while they are refreshed in the
+        background, so that a slow or failing database does not hold up the
+        response.
         
         @type mac: basestring
         @param mac: The MAC address to lookup.
@@ -91,27 +383,316 @@ class Database(object):
         
         @raise Exception: If a problem occurs while accessing the database.
         """
+        (found, data) = self._lookupCachedMAC(mac)
+        if found:
+            return data
+        data = self._lookupStaleMAC(mac)
+        if data:
+            return data
+        return self._coalesceLookup(mac)
+        
+    def lookupMACs(self, macs):
+        """
+        Queries the database for all of the given MAC addresses at once,
+        consulting and updating the caches and snapshot as L{lookupMAC} does.
+        
+        @type macs: iterable
+        @param macs: The MAC addresses to lookup.
+        
+        @rtype: dict
+        @return: The details of every given MAC, in the form returned by
+            L{lookupMAC}, or None if it is unknown, keyed by MAC.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        results = {}
+        misses = []
+        for mac in set(macs):
+            (found, data) = self._lookupCachedMAC(mac)
+            if not found:
+                data = self._lookupStaleMAC(mac)
+                found = bool(data)
+            if found:
+                results[mac] = data
+            else:
+                misses.append(mac)
+        if misses:
+            results.update(self._queryMACs(misses))
+        return results
+        
+    def _lookupCachedMAC(self, mac):
+        """
+        Looks for the given MAC address in the snapshot or caches.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: tuple(2)
+        @return: (found:bool, details:tuple(11)|None), where details are as
+            returned by L{lookupMAC} and only meaningful if found is True.
+        """
+        snapshot = self._snapshot
+        if not snapshot is None:
+            return (True, snapshot.get(mac))
+            
         if config.USE_CACHE:
-            with self._cache_lock:
-                data = self._mac_cache.get(mac)
+            data = self._mac_cache.get(mac)
             if data:
-                (ip, hostname, subnet_id) = data
-                return (ip, hostname,) + self._subnet_cache[subnet_id] + subnet_id
+                return (True, data)
+        if not self._unknown_cache is None and self._unknown_cache.get(mac):
+            return (True, None)
+        return (False, None)
+        
+    def _lookupStaleMAC(self, mac):
+        """
+        Looks for the given MAC address in the stale cache, scheduling a
+        refresh of its details if found.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: tuple(11)|None
+        @return: The last known details of the MAC, as returned by
+            L{lookupMAC}, or None if there are none or stale details are not
+            served.
+        """
+        if self._stale_cache is None:
+            return None
+            
+        data = self._stale_cache.get(mac)
+        if data:
+            with self._inflight_lock:
+                if mac in self._revalidating:
+                    return data
+                self._revalidating.add(mac)
+            try:
+                self._revalidations.put_nowait(mac)
+            except Queue.Full: #Try again on the next lookup.
+                with self._inflight_lock:
+                    self._revalidating.discard(mac)
+        return data
+        
+    def _revalidate(self):
+        """
+        Refreshes the details of MACs served from the stale cache, forever.
+        """
+        while True:
+            mac = self._revalidations.get()
+            try:
+                if not self._lookupCachedMAC(mac)[0]:
+                    self._coalesceLookup(mac)
+            except Exception, e:
+                logging.writeLog("Unable to refresh details of %(mac)s: %(error)s" % {
+                 'mac': mac,
+                 'error': str(e),
+                })
+            finally:
+                with self._inflight_lock:
+                    self._revalidating.discard(mac)
+                    
+    def _coalesceLookup(self, mac):
+        """
+        Queries the database for the given MAC address, unless another thread
+        is already doing so, in which case its result is shared.
+        
+        Brokers that don't coalesce lookups query directly, without batching.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: tuple(11)|None
+        @return: The same value as L{lookupMAC}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        if not self._coalesce:
+            return self._queryMAC(mac)
+            
+        with self._inflight_lock:
+            lookup = self._inflight.get(mac)
+            if lookup is None:
+                lookup = self._inflight[mac] = [None, None, None]
+                leader = True
+            else:
+                if lookup[0] is None:
+                    lookup[0] = threading.Event()
+                leader = False
                 
-        with self._resource_lock:
-            data = self._lookupMAC(mac)
-            if data and config.USE_CACHE:
-                (ip, hostname,
-                    gateway, subnet_mask, broadcast_address,
-                    domain_name, domain_name_servers, ntp_servers,
-                    lease_time, subnet, serial) = data
-                subnet_id = (subnet, serial)
-                with self._cache_lock:
-                    self._mac_cache[mac] = (ip, hostname, subnet_id,)
-                    self._subnet_cache[subnet_id] = (
-                        gateway, subnet_mask, broadcast_address,
-                        domain_name, domain_name_servers, ntp_servers,
-                        lease_time,
-                    )
-            return data
-            
\ No newline at end of file
+        if not leader:
+            lookup[0].wait()
+            if lookup[2]:
+                raise lookup[2][0], lookup[2][1], lookup[2][2]
+            return lookup[1]
+            
+        try:
+            if self._batch_window:
+                lookup[1] = self._batchLookup(mac)
+            else:
+                lookup[1] = self._queryMAC(mac)
+            return lookup[1]
+        except Exception:
+            lookup[2] = sys.exc_info()
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[mac]
+                completion_event = lookup[0]
+            if completion_event: #Someone is waiting.
+                completion_event.set()
+            
+    def _batchLookup(self, mac):
+        """
+        Queries the database for the given MAC address together with any others
+        requested by other threads within LOOKUP_BATCH_WINDOW seconds.
+        
+        The first thread to make a request in each window waits for the
+        window to close, then performs the combined query on behalf of all.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: tuple(11)|None
+        @return: The same value as L{lookupMAC}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        request = [mac, threading.Event(), None, None]
+        with self._batch_lock:
+            self._batch.append(request)
+            leader = len(self._batch) == 1
+            
+        if leader:
+            time.sleep(self._batch_window)
+            with self._batch_lock:
+                batch = self._batch
+                self._batch = []
+            try:
+                results = self._queryMACs([r[0] for r in batch])
+                for r in batch:
+                    r[2] = results.get(r[0])
+            except Exception:
+                exc_info = sys.exc_info()
+                for r in batch:
+                    r[3] = exc_info
+            finally:
+                for r in batch:
+                    r[1].set()
+        else:
+            request[1].wait()
+            
+        if request[3]:
+            raise request[3][0], request[3][1], request[3][2]
+        return request[2]
+        
+    def _queryMAC(self, mac):
+        """
+        Queries the database for the given MAC address and updates the caches
+        with the result.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: tuple(11)|None
+        @return: The same value as L{lookupMAC}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        data = self._callBackend(self._lookupMAC, mac)
+        self._cacheResult(mac, data)
+        return data
+        
+    def _queryMACs(self, macs):
+        """
+        Queries the database for the given MAC addresses and updates the caches
+        with the results.
+        
+        @type macs: list
+        @param macs: The MAC addresses to lookup.
+        
+        @rtype: dict
+        @return: The same value as L{lookupMACs}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        results = self._callBackend(self._lookupMACs, macs)
+        for (mac, data) in results.iteritems():
+            self._cacheResult(mac, data)
+        return results
+        
+    def _callBackend(self, function, *args):
+        """
+        Invokes one of the backend's query methods, within the concurrency
+        limit, unless the circuit-breaker is open, giving up after
+        QUERY_TIMEOUT seconds, if set.
+        
+        Failures, including timeouts, count towards opening the breaker;
+        waiting for the concurrency limit does not.
+        
+        @type function: callable
+        @param function: The method to invoke.
+        @param args: The arguments to pass to the method.
+        
+        @return: Whatever the method returns.
+        
+        @raise DatabaseUnavailableError: If the breaker is open or the query
+            timed out or could not be started in time.
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        if not self._breaker.allow():
+            raise DatabaseUnavailableError("Database queries are suspended after repeated failures")
+            
+        try:
+            if not self._query_runner is None:
+                result = self._query_runner.call(function, args)
+            else:
+                with self._resource_lock:
+                    result = function(*args)
+        except DatabaseBusyError:
+            self._breaker.abandon()
+            raise
+        except Exception:
+            if self._breaker.fail():
+                logging.writeLog("Database queries suspended for %(interval)s seconds after %(threshold)i consecutive failures" % {
+                 'interval': self._getSetting('BREAKER_RETRY_INTERVAL'),
+                 'threshold': self._getSetting('BREAKER_THRESHOLD'),
+                })
+            raise
+        if self._breaker.succeed():
+            logging.writeLog("Database queries resumed")
+        return result
+        
+    def _cacheResult(self, mac, data):
+        """
+        Records the result of a lookup in the caches, if enabled.
+        
+        @type mac: basestring
+        @param mac: The MAC address that was looked up.
+        @type data: tuple(11)|None
+        @param data: The result of the lookup.
+        """
+        if not data:
+            if not self._unknown_cache is None:
+                self._unknown_cache.put(mac, True)
+            if not self._stale_cache is None:
+                self._stale_cache.discard(mac)
+        elif config.USE_CACHE:
+            self._mac_cache.put(mac, data) #Held whole, and shared with the stale cache, so that hits needn't assemble anything.
+            if not self._stale_cache is None:
+                self._stale_cache.put(mac, data)
+            
+    def _lookupMACs(self, macs):
+        """
+        Queries the database for the given MAC addresses.
+        
+        Backends that can do so more efficiently than one at a time override
+        this.
+        
+        @type macs: list
+        @param macs: The MAC addresses to lookup.
+        
+        @rtype: dict
+        @return: The same value as L{lookupMACs}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return dict((mac, self._lookupMAC(mac)) for mac in macs)
\ No newline at end of file
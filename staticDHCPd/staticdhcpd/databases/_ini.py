@@ -24,116 +24,460 @@ Legal
  
  (C) Neil Tallim, 2013 <flan@uguu.ca>
 """
-import ConfigParser
+import array
+import os
 import re
+import socket
+import threading
+import time
 
+try:
+    import pyinotify
+except ImportError: #Changes will be found by polling instead.
+    pyinotify = None
+    
 from .. import config
+from .. import logging
 
 from _generic import Database
 
-class _Config(ConfigParser.RawConfigParser):
+_OPTION_RE = re.compile(r"(?P<option>[^:=\s][^:=]*)\s*[:=]\s*(?P<value>.*)$") #: An option line, as understood by ConfigParser.
+_KEY_TYPECODE = array.array('l').itemsize >= 8 and 'l' or 'd' #: The array type that holds a 48-bit MAC exactly: a C long, where that has 64 bits, or a double.
+
+def _read_sections(input):
+    """
+    Reads an INI file one section at a time, so that it is never held in
+    memory as a whole.
+    
+    The syntax understood is that of ConfigParser.RawConfigParser, except
+    that a repeated section replaces, rather than extends, its predecessor and
+    options in a [DEFAULT] section apply only to the sections that follow it.
+    
+    @type input: file
+    @param input: The file to read.
+    
+    @rtype: generator
+    @return: (section:basestring, options:dict) pairs, where options are keyed
+        by lower-case name.
+    
+    @raise ValueError: If a line could not be understood.
+    """
+    defaults = {}
+    section = None
+    options = None
+    option = None
+    for (number, line) in enumerate(input):
+        first = line[0]
+        if first == '[':
+            end = line.find(']')
+            if end > 1:
+                if not section is None and not options is defaults:
+                    yield (section, options)
+                section = line[1:end]
+                if section == 'DEFAULT':
+                    options = defaults
+                else:
+                    options = defaults.copy()
+                option = None
+                continue
+        elif first in '#;':
+            continue
+        elif first.isspace():
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if not option is None: #A continuation of the last value.
+                options[option] += '\n' + stripped
+                continue
+        elif first in 'rR' and line.split(None, 1)[0].lower() == 'rem':
+            continue
+            
+        m = _OPTION_RE.match(line)
+        if not m or section is None:
+            raise ValueError("Unable to parse line %(line)i of '%(file)s': %(text)r" % {
+             'line': number + 1,
+             'file': input.name,
+             'text': line,
+            })
+            
+        (option, value) = m.groups()
+        option = option.rstrip().lower()
+        if ';' in value:
+            comment = value.find(';')
+            if value[comment - 1].isspace():
+                value = value[:comment]
+        value = value.strip()
+        if value == '""':
+            value = ''
+        options[option] = value
+        
+    if not section is None and not options is defaults:
+        yield (section, options)
+        
+def _formatMAC(key):
+    """
+    Renders a MAC, held as an integer, the way the server looks it up.
+    
+    @type key: int
+    @param key: The MAC, as a 48-bit integer.
+    
+    @rtype: str
+    @return: The MAC, like 'aa:bb:cc:dd:ee:ff'.
     """
-    A simple wrapper around RawConfigParser to extend it with support for default values.
+    mac = '%012x' % key
+    return ':'.join((mac[0:2], mac[2:4], mac[4:6], mac[6:8], mac[8:10], mac[10:12]))
+    
+class _BindingTable(object):
+    """
+    An immutable, compact collection of bindings.
+    
+    MACs are held as 48-bit integers in an open-addressing hash table, itself
+    an array, probed the same way as Python's own dictionaries; IPs,
+    hostnames, and subnets' details sit in parallel lists, at the same slots,
+    so that no binding costs more than its IP and hostname strings, and a
+    lookup needs no further indirection.
+    Subnets' details are held once, already in the form returned by lookups,
+    so results are assembled only when requested, with a single
+    concatenation.
     """
-    def get(self, section, option, default):
+    __slots__ = ('_layout', '_count',)
+    
+    def __init__(self, keys, ips, hostnames, subnet_indexes, subnets):
+        """
+        Sets up the table, indexing the bindings; where a MAC is repeated, the
+        last binding prevails.
+        
+        @type keys: array
+        @param keys: Every MAC, as a 48-bit integer.
+        @type ips: str
+        @param ips: The IP bound to each MAC, packed into four bytes.
+        @type hostnames: list
+        @param hostnames: The hostname of each MAC, or None.
+        @type subnet_indexes: array
+        @param subnet_indexes: The position of each MAC's subnet in
+            C{subnets}.
+        @type subnets: list
+        @param subnets: The (gateway, subnet_mask, broadcast_address,
+            domain_name, domain_name_servers, ntp_servers, lease_time,
+            subnet, serial) details of each subnet.
         """
-        Returns a custom value, if one is found. Otherwise, returns C{default}.
+        size = 8
+        while size < len(keys) * 2: #Keep the table at most half-full, so probes are short.
+            size *= 2
+        mask = size - 1
+        table_keys = array.array(_KEY_TYPECODE, (-1,)) * size
+        table_ips = [None] * size
+        table_hostnames = [None] * size
+        table_subnets = [None] * size
+        count = 0
+        for (i, key) in enumerate(keys):
+            key = int(key)
+            slot = perturbation = key
+            slot &= mask
+            while table_keys[slot] != -1 and table_keys[slot] != key:
+                perturbation >>= 5
+                slot = (slot * 5 + perturbation + 1) & mask
+            if table_keys[slot] == -1:
+                table_keys[slot] = key
+                count += 1
+            table_ips[slot] = socket.inet_ntoa(ips[i * 4:i * 4 + 4])
+            table_hostnames[slot] = hostnames[i]
+            table_subnets[slot] = subnets[subnet_indexes[i]]
+        #Lookups unpack these in one step, which costs less than reading five
+        #attributes.
+        self._layout = (table_keys, mask, table_ips, table_hostnames, table_subnets)
+        self._count = count
         
-        @type section: basestring
-        @param section: The section to be queried.
-        @type option: basestring
-        @param option: The option to be queried.
-        @type default: object
-        @param default: The value to be returned, if the requested option is undefined.
+    def lookup(self, mac):
+        """
+        Finds the binding of the given MAC.
+        
+        @type mac: basestring
+        @param mac: The MAC address to lookup, like 'aa:bb:cc:dd:ee:ff'.
         
-        @rtype: object
-        @return: Either the requested value or the given default.
+        @rtype: tuple(11)|None
+        @return: The binding's details, as returned by L{INI.lookupMAC}, or
+            None if the MAC is not bound.
         """
         try:
-            return ConfigParser.RawConfigParser.get(self, section, option)
-        except ConfigParser.Error:
-            return default
+            key = int(mac.replace(':', ''), 16)
+        except ValueError:
+            return None
+        (keys, mask, ips, hostnames, subnets) = self._layout
+        slot = perturbation = key
+        slot &= mask
+        while True:
+            k = keys[slot]
+            if k == key:
+                return (ips[slot], hostnames[slot]) + subnets[slot]
+            if k == -1:
+                return None
+            perturbation >>= 5
+            slot = (slot * 5 + perturbation + 1) & mask
             
-    def getint(self, section, option, default):
+    def __iter__(self):
         """
-        Returns a custom value, if one is found. Otherwise, returns C{default}.
+        @rtype: generator
+        @return: (mac:basestring, details:tuple(11)) pairs, where details are
+            as returned by L{INI.lookupMAC}.
+        """
+        for key in self._layout[0]:
+            if key != -1:
+                mac = _formatMAC(int(key))
+                yield (mac, self.lookup(mac))
+                
+    def __len__(self):
+        return self._count
         
-        @type section: basestring
-        @param section: The section to be queried.
-        @type option: basestring
-        @param option: The option to be queried.
-        @type default: int
-        @param default: The value to be returned, if the requested option is undefined.
+    def compare(self, previous):
+        """
+        Counts the differences between this table and an earlier one.
         
-        @rtype: int
-        @return: Either the requested value or the given default.
+        @type previous: L{_BindingTable}
+        @param previous: The table being replaced.
         
-        @raise ValueError: The value to be returned could not be converted to an C{int}.
+        @rtype: tuple(3)
+        @return: The number of MACs (added, removed, changed).
         """
-        return int(self.get(section, option, default))
+        added = changed = 0
+        lookup = previous.lookup
+        for (mac, details) in self:
+            old_details = lookup(mac)
+            if old_details is None:
+                added += 1
+            elif old_details != details:
+                changed += 1
+        return (added, len(previous) - (len(self) - added), changed)
         
-    def getfloat(self, section, option, default):
-        """
-        Returns a custom value, if one is found. Otherwise, returns C{default}.
+class _BindingTableBuilder(object):
+    """
+    Accumulates bindings to produce a L{_BindingTable}.
+    """
+    _keys = None #: Every MAC added, as a 48-bit integer.
+    _ips = None #: The IP bound to each MAC, packed into four bytes.
+    _hostnames = None #: The hostname of each MAC, or None.
+    _subnet_ids = None #: Every distinct (subnet, serial) added, keyed by itself, so that each is held once.
+    _subnet_references = None #: The (subnet, serial) of each MAC.
+    
+    def __init__(self):
+        self._keys = array.array(_KEY_TYPECODE)
+        self._ips = []
+        self._hostnames = []
+        self._subnet_ids = {}
+        self._subnet_references = []
         
-        @type section: basestring
-        @param section: The section to be queried.
-        @type option: basestring
-        @param option: The option to be queried.
-        @type default: float
-        @param default: The value to be returned, if the requested option is undefined.
+    def add(self, mac, ip, hostname, subnet_id):
+        """
+        Adds a binding, replacing any previously added for the same MAC.
         
-        @rtype: float
-        @return: Either the requested value or the given default.
+        @type mac: basestring
+        @param mac: The MAC address, like 'aa:bb:cc:dd:ee:ff'.
+        @type ip: basestring
+        @param ip: The IPv4 address bound to the MAC.
+        @type hostname: basestring|None
+        @param hostname: The hostname bound to the MAC.
+        @type subnet_id: tuple(2)
+        @param subnet_id: The (subnet, serial) whose details apply.
         
-        @raise ValueError: The value to be returned could not be converted to a C{float}.
+        @raise ValueError: If the IP is invalid.
         """
-        return float(self.get(section, option, default))
+        try:
+            ip = socket.inet_aton(ip)
+        except socket.error:
+            raise ValueError("Invalid IP: %(ip)s" % {
+             'ip': ip,
+            })
+        self._keys.append(int(mac.replace(':', ''), 16))
+        self._ips.append(ip)
+        self._hostnames.append(hostname)
+        self._subnet_references.append(self._subnet_ids.setdefault(subnet_id, subnet_id))
         
-    def getboolean(self, section, option, default):
+    def build(self, subnets):
         """
-        Returns a custom value, if one is found. Otherwise, returns C{default}.
+        Produces a table of the bindings added.
+        
+        @type subnets: dict
+        @param subnets: The details of every subnet, as held by
+            L{_BindingTable}, keyed by (subnet, serial).
         
-        @type section: basestring
-        @param section: The section to be queried.
-        @type option: basestring
-        @param option: The option to be queried.
-        @type default: bool
-        @param default: The value to be returned, if the requested option is undefined.
+        @rtype: L{_BindingTable}
+        @return: The bindings.
         
-        @rtype: bool
-        @return: Either the requested value or the given default.
+        @raise ValueError: If a binding references an unknown subnet.
         """
-        return bool(str(self.get(section, option, default)).lower().strip() in (
-         'y', 'yes',
-         't', 'true',
-         'ok', 'okay',
-         '1',
-        ))
-
+        subnet_positions = {}
+        subnet_records = []
+        for subnet_id in self._subnet_ids:
+            if subnet_id not in subnets:
+                raise ValueError("MAC '%(mac)s' references unknown subnet '%(subnet)s|%(serial)i'" % {
+                 'mac': _formatMAC(int(self._keys[self._subnet_references.index(subnet_id)])),
+                 'subnet': subnet_id[0],
+                 'serial': subnet_id[1],
+                })
+            subnet_positions[subnet_id] = len(subnet_records)
+            subnet_records.append(subnets[subnet_id])
+            
+        return _BindingTable(
+         self._keys, ''.join(self._ips), self._hostnames,
+         array.array('i', (subnet_positions[subnet_id] for subnet_id in self._subnet_references)),
+         subnet_records,
+        )
+        
 class INI(Database):
     """
     Implements an INI broker.
+    
+    The file is read again whenever the cache is flushed and, if INI_WATCH is
+    set, whenever it changes, as reported by inotify if pyinotify is
+    installed, or as found by checking it every INI_POLL_INTERVAL seconds
+    otherwise. This happens in the background and the new bindings replace
+    the old ones in a single assignment, once complete and valid, so lookups
+    never wait on a reload and a file that cannot be loaded leaves the
+    previous bindings in service.
     """
-    _maps = None
-    _subnets = None
+    _config_prefix = 'INI'
+    _coalesce = False
+    _bounded_queries = True
+    _maps = None #: The bindings, as a L{_BindingTable}, replaced whole when the file is reloaded.
+    _signature = None #: The (inode, size, mtime) of the file when last loaded, or None if it could not be examined.
+    _reload_requested = None #: An event set to make the file be checked for changes.
+    _reload_forced = None #: An event set if the file is to be reloaded when next checked, even if unchanged.
     
     def __init__(self):
         """
         Constructs the broker.
         """
-        self._maps = {}
-        self._subnets = {}
-        self._parse_ini()
+        self._signature = self._getSignature()
+        self._maps = self._parse_ini()
         
         self._setupBroker(65536) #Effectively no limit on the number of simultaneous readers
         
+        self._reload_requested = threading.Event()
+        self._reload_forced = threading.Event()
+        reload_thread = threading.Thread(target=self._watchFile)
+        reload_thread.daemon = True
+        reload_thread.start()
+        
+    def _getSignature(self):
+        """
+        Identifies the current version of the file.
+        
+        @rtype: tuple(3)|None
+        @return: The (inode, size, mtime) of the file, or None if it could not
+            be examined.
+        """
+        try:
+            stat = os.stat(config.INI_FILE)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+        
+    def _watchFile(self):
+        """
+        Reloads the file whenever it has changed or the cache is flushed.
+        
+        The file's directory is watched, rather than the file itself, so that
+        replacing it by renaming another over it is noticed.
+        """
+        interval = None
+        if config.INI_WATCH:
+            interval = config.INI_POLL_INTERVAL
+            if pyinotify:
+                try:
+                    manager = pyinotify.WatchManager()
+                    notifier = pyinotify.ThreadedNotifier(manager)
+                    notifier.daemon = True
+                    notifier.start()
+                    manager.add_watch(
+                     os.path.dirname(os.path.abspath(config.INI_FILE)),
+                     pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO,
+                     proc_fun=self._noticeChange, quiet=False
+                    )
+                except Exception, e:
+                    logging.writeLog("Unable to watch '%(file)s' with inotify; polling it instead: %(error)s" % {
+                     'file': config.INI_FILE,
+                     'error': str(e),
+                    })
+                else:
+                    interval = None
+                    
+        while True:
+            self._reload_requested.wait(interval)
+            self._reload_requested.clear()
+            #Each event is cleared before the reload it calls for begins, so a
+            #request made at any point after that is honoured by another.
+            forced = self._reload_forced.is_set()
+            if forced:
+                self._reload_forced.clear()
+            if forced or self._getSignature() != self._signature:
+                self._reload()
+                
+    def _noticeChange(self, event):
+        """
+        Requests a check of the file when inotify reports a change in its
+        directory that involves it.
+        
+        @type event: pyinotify.Event
+        @param event: The change.
+        """
+        if event.pathname == os.path.abspath(config.INI_FILE):
+            self._reload_requested.set()
+            
+    def _reload(self):
+        """
+        Loads the file and, if it is valid, replaces the current bindings with
+        its own, logging a summary of the differences.
+        
+        If the file changes while it is being read, the result is discarded
+        and it is read again when the change is noticed.
+        """
+        start_time = time.time()
+        signature = self._getSignature()
+        try:
+            maps = self._parse_ini()
+        except Exception, e:
+            self._signature = signature #Don't try again until it changes.
+            logging.writeLog("Unable to reload '%(file)s'; continuing with the previous bindings: %(error)s" % {
+             'file': config.INI_FILE,
+             'error': str(e),
+            })
+            return
+        if self._getSignature() != signature:
+            return
+            
+        (added, removed, changed) = maps.compare(self._maps)
+        self._maps = maps
+        self._signature = signature
+        Database.flushCache(self)
+        logging.writeLog("Reloaded '%(file)s': %(count)i MACs; %(added)i added, %(removed)i removed, %(changed)i changed; in %(time).3fs" % {
+         'file': config.INI_FILE,
+         'count': len(maps),
+         'added': added,
+         'removed': removed,
+         'changed': changed,
+         'time': time.time() - start_time,
+        })
+        
+    def flushCache(self):
+        """
+        Reloads the file in the background, then resets the cache.
+        """
+        self._reload_forced.set()
+        self._reload_requested.set()
+        Database.flushCache(self)
+        
     def _parse_ini(self):
         """
         Creates an optimal in-memory representation of the data in the INI file.
+        
+        @rtype: L{_BindingTable}
+        @return: The bindings.
+        
+        @raise ValueError: If the file cannot be read or is invalid.
         """
-        reader = _Config()
-        if not reader.read(config.INI_FILE):
+        try:
+            input = open(config.INI_FILE)
+        except IOError:
             raise ValueError("Unable to read '%(file)s'" % {
              'file': config.INI_FILE,
             })
@@ -141,71 +485,72 @@ class INI(Database):
         subnet_re = re.compile(r"^(?P<subnet>.+?)\|(?P<serial>\d+)$")
         mac_re = re.compile(r"^[0-9a-f]{12}$")
         
-        for section in reader.sections():
-            m = subnet_re.match(section)
-            if m:
-                self._process_subnet(reader, section, m.group('subnet'), int(m.group('serial')))
-            else:
-                mac = section.replace(':', '').lower()
-                if mac_re.match(mac):
-                    self._process_map(reader, section, mac)
+        maps = _BindingTableBuilder()
+        subnets = {}
+        try:
+            for (section, options) in _read_sections(input):
+                m = '|' in section and subnet_re.match(section)
+                if m:
+                    self._process_subnet(section, options, m.group('subnet'), int(m.group('serial')), subnets)
                 else:
-                    pass #Log as unknown entry
-                    
-        self._validate_references()
+                    mac = section.replace(':', '').lower()
+                    if mac_re.match(mac):
+                        self._process_map(section, options, mac, maps)
+                    else:
+                        pass #Log as unknown entry
+        finally:
+            input.close()
+            
+        return maps.build(subnets)
         
-    def _process_subnet(self, reader, section, subnet, serial):
-        lease_time = reader.getint(section, 'lease-time', None)
+    def _process_subnet(self, section, options, subnet, serial, subnets):
+        lease_time = options.get('lease-time')
+        if lease_time:
+            lease_time = int(lease_time)
         if not lease_time:
             raise ValueError("Field 'lease-time' unspecified for '%(section)s'" % {
              'section': section,
             })
-        gateway = reader.get(section, 'gateway', None)
-        subnet_mask = reader.get(section, 'subnet-mask', None)
-        broadcast_address = reader.get(section, 'broadcast-address', None)
-        ntp_servers = reader.get(section, 'ntp-servers', None)
-        domain_name_servers = reader.get(section, 'domain-name-servers', None)
-        domain_name = reader.get(section, 'domain-name', None)
-        
-        self._subnets[(subnet, serial)] = (
-         lease_time,
+        gateway = options.get('gateway')
+        subnet_mask = options.get('subnet-mask')
+        broadcast_address = options.get('broadcast-address')
+        ntp_servers = options.get('ntp-servers')
+        domain_name_servers = options.get('domain-name-servers')
+        domain_name = options.get('domain-name')
+        
+        subnets[(subnet, serial)] = (
          gateway, subnet_mask, broadcast_address,
-         ntp_servers, domain_name_servers, domain_name
+         domain_name, domain_name_servers, ntp_servers,
+         lease_time, subnet, serial,
         )
         
-    def _process_map(self, reader, section, mac):
-        ip = reader.get(section, 'ip', None)
+    def _process_map(self, section, options, mac, maps):
+        ip = options.get('ip')
         if not ip:
             raise ValueError("Field 'ip' unspecified for '%(section)s'" % {
              'section': section,
             })
-        hostname = reader.get(section, 'hostname', None)
-        subnet = reader.get(section, 'subnet', None)
+        hostname = options.get('hostname')
+        subnet = options.get('subnet')
         if not subnet:
             raise ValueError("Field 'subnet' unspecified for '%(section)s'" % {
              'section': section,
             })
-        serial = reader.getint(section, 'serial', None)
+        serial = options.get('serial')
         if serial is None:
             raise ValueError("Field 'serial' unspecified for '%(section)s'" % {
              'section': section,
             })
+        serial = int(serial)
         
         mac = ':'.join([mac[0:2], mac[2:4], mac[4:6], mac[6:8], mac[8:10], mac[10:12]])
-        self._maps[mac] = (ip, hostname, (subnet, serial))
-        
-    def _validate_references(self):
-        """
-        Effectively performs foreign-key checking, to avoid deferred errors.
-        """
-        for (mac, (_, _, subnet)) in self._maps.items():
-            if subnet not in self._subnets:
-                raise ValueError("MAC '%(mac)s' references unknown subnet '%(subnet)s|%(serial)i'" % {
-                 'mac': mac,
-                 'subnet': subnet[0],
-                 'serial': subnet[1],
-                })
-                
+        try:
+            maps.add(mac, ip, hostname, (subnet, serial))
+        except ValueError:
+            raise ValueError("Field 'ip' invalid for '%(section)s'" % {
+             'section': section,
+            })
+            
     def _lookupMAC(self, mac):
         """
         Queries the database for the given MAC address and returns the IP and
@@ -225,19 +570,14 @@ class INI(Database):
         
         @raise Exception: If a problem occurs while accessing the database.
         """
-        map = self._maps.get(mac)
-        if not map:
-            return None
-            
-        (ip, hostname, subnet) = map
-        (lease_time,
-         gateway, subnet_mask, broadcast_address,
-         ntp_servers, domain_name_servers, domain_name
-        ) = self._subnets.get(subnet)
+        return self._maps.lookup(mac)
         
-        return (
-         ip, hostname,
-         gateway, subnet_mask, broadcast_address,
-         domain_name, domain_name_servers, ntp_servers,
-         lease_time, subnet[0], subnet[1]
-        )
+    def _lookupAllMACs(self):
+        """
+        Enumerates every MAC address in the INI file.
+        
+        @rtype: list
+        @return: (mac:basestring, details:tuple(11)) pairs, where details are
+            as returned by L{lookupMAC}.
+        """
+        return list(self._maps)
@@ -25,10 +25,265 @@ Legal
  (C) Neil Tallim, 2013 <flan@uguu.ca>
  (C) Matthew Boedicker, 2011 <matthewm@boedicker.org>
 """
+import collections
+import threading
+import time
+
 from .. import config
+from .. import logging
 
 from _generic import Database
 
+class _PooledConnection(object):
+    """
+    Wraps a connection lent out by a L{_ConnectionPool}, returning it to the
+    pool, rather than closing it, when done.
+    """
+    _pool = None #: The pool to which the connection belongs.
+    _connection = None #: The underlying connection, or None once given back.
+    _created = None #: The time at which the underlying connection was opened.
+    reused = False #: True if the connection had been used before being lent out.
+    state = None #: A dictionary that persists for the life of the underlying connection, for brokers to keep per-connection resources in.
+    
+    def __init__(self, pool, connection, created, reused, state):
+        """
+        Wraps a connection.
+        
+        @type pool: L{_ConnectionPool}
+        @param pool: The pool to which the connection belongs.
+        @param connection: The underlying connection.
+        @type created: float
+        @param created: The time at which the underlying connection was opened.
+        @type reused: bool
+        @param reused: True if the connection had been used before.
+        @type state: dict
+        @param state: The per-connection resources kept by brokers.
+        """
+        self._pool = pool
+        self._connection = connection
+        self._created = created
+        self.reused = reused
+        self.state = state
+        
+    def cursor(self):
+        """
+        @return: A cursor on the underlying connection.
+        """
+        return self._connection.cursor()
+        
+    def close(self):
+        """
+        Returns the connection to the pool; it must not be used afterwards.
+        """
+        if not self._connection is None:
+            self._pool._release(self._connection, self._created, self.state)
+            self._connection = None
+            
+    def discard(self):
+        """
+        Closes the underlying connection instead of returning it to the pool,
+        because it is believed to be broken, dropping the resources kept for
+        it, like prepared statements, which cannot outlive it.
+        """
+        if not self._connection is None:
+            self.state.clear()
+            self._pool._discard(self._connection)
+            self._connection = None
+            
+class _ConnectionPool(object):
+    """
+    Keeps database connections open between uses, lending them to one thread
+    at a time.
+    """
+    _connect = None #: A callable that opens a new connection.
+    _query_ping = None #: The string used to check that a connection still works.
+    _minimum = None #: The number of connections kept open, even when idle.
+    _maximum = None #: The number of connections that may be open at once.
+    _max_idle = None #: The number of seconds a connection may go unused before being closed.
+    _max_age = None #: The number of seconds after which a connection is replaced.
+    _check_after = None #: The number of seconds a connection may go unused before being tested on checkout.
+    
+    _condition = None #: A condition used to ensure synchronous access to the pool and to wait for connections.
+    _idle = None #: A deque of (connection, created, last_used, state) values, most recently used last.
+    _size = 0 #: The number of connections currently open, whether idle or lent out.
+    _created = 0 #: The number of connections opened.
+    _reused = 0 #: The number of checkouts served by an idle connection.
+    _discarded = 0 #: The number of connections closed because they were broken, stale, or superfluous.
+    _waits = 0 #: The number of checkouts that had to wait for a connection to be returned.
+    
+    def __init__(self, connect, query_ping, minimum, maximum, max_idle, max_age, check_after):
+        """
+        Sets up the pool, opening the minimum number of connections.
+        
+        @type connect: callable
+        @param connect: A callable that opens a new connection.
+        @type query_ping: basestring
+        @param query_ping: The string used to check that a connection still
+            works.
+        @type minimum: int
+        @param minimum: The number of connections kept open, even when idle.
+        @type maximum: int
+        @param maximum: The number of connections that may be open at once.
+        @type max_idle: float
+        @param max_idle: The number of seconds a connection may go unused
+            before being closed.
+        @type max_age: float
+        @param max_age: The number of seconds after which a connection is
+            replaced.
+        @type check_after: float
+        @param check_after: The number of seconds a connection may go unused
+            before being tested on checkout.
+        
+        @raise Exception: If the minimum number of connections cannot be
+            opened, in which case any that were opened are closed.
+        """
+        self._connect = connect
+        self._query_ping = query_ping
+        self._maximum = max(1, maximum)
+        self._minimum = min(minimum, self._maximum)
+        self._max_idle = max_idle
+        self._max_age = max_age
+        self._check_after = check_after
+        
+        self._condition = threading.Condition()
+        self._idle = collections.deque()
+        
+        connections = []
+        try:
+            for i in range(self._minimum):
+                connections.append(self.get())
+        except Exception, e:
+            logging.writeLog("Unable to open initial database connections: %(error)s" % {
+             'error': str(e),
+            })
+            for connection in connections:
+                connection.discard()
+            raise
+        for connection in connections:
+            connection.close()
+            
+    def get(self):
+        """
+        Lends out a connection, opening a new one if none is idle and the pool
+        isn't full, or waiting for one to be returned otherwise.
+        
+        @rtype: L{_PooledConnection}
+        @return: A connection.
+        
+        @raise Exception: If a problem occurs while connecting to the database.
+        """
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self._maximum:
+                    self._waits += 1
+                    self._condition.wait()
+                    
+                if self._idle:
+                    (connection, created, last_used, state) = self._idle.pop()
+                else:
+                    self._size += 1
+                    connection = None
+                    
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._created += 1
+                return _PooledConnection(self, connection, time.time(), False, {})
+                
+            now = time.time()
+            if self._max_age and now - created > self._max_age:
+                self._discard(connection)
+                continue
+            if now - last_used > self._check_after and not self._ping(connection):
+                self._discard(connection)
+                continue
+            with self._condition:
+                self._reused += 1
+            return _PooledConnection(self, connection, created, True, state)
+            
+    def _ping(self, connection):
+        """
+        Checks that a connection still works.
+        
+        @param connection: The connection to check.
+        
+        @rtype: bool
+        @return: True if the connection works.
+        """
+        try:
+            cur = connection.cursor()
+            try:
+                cur.execute(self._query_ping)
+                cur.fetchall()
+            finally:
+                cur.close()
+        except Exception:
+            return False
+        return True
+        
+    def _release(self, connection, created, state):
+        """
+        Makes a connection available for reuse, closing any that have been idle
+        for too long while the pool is above its minimum size.
+        
+        @param connection: The connection being returned.
+        @type created: float
+        @param created: The time at which the connection was opened.
+        @type state: dict
+        @param state: The per-connection resources kept by brokers.
+        """
+        now = time.time()
+        stale = []
+        with self._condition:
+            self._idle.append((connection, created, now, state))
+            while self._size > self._minimum and self._idle and now - self._idle[0][2] > self._max_idle:
+                stale.append(self._idle.popleft()[0])
+                self._size -= 1
+                self._discarded += 1
+            self._condition.notify()
+        for connection in stale:
+            self._close(connection)
+            
+    def _discard(self, connection):
+        """
+        Closes a connection that will not be reused, making room for another.
+        
+        @param connection: The connection to close.
+        """
+        with self._condition:
+            self._size -= 1
+            self._discarded += 1
+            self._condition.notify()
+        self._close(connection)
+        
+    def _close(self, connection):
+        """
+        Closes a connection, ignoring any errors.
+        
+        @param connection: The connection to close.
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+            
+    def getStats(self):
+        """
+        Reports on the state of the pool.
+        
+        @rtype: tuple(6)
+        @return: (open:int, idle:int, created:int, reused:int, discarded:int,
+            waits:int).
+        """
+        with self._condition:
+            return (self._size, len(self._idle), self._created, self._reused, self._discarded, self._waits)
+            
 class _SQLDatabase(Database):
     """
     A stub documenting the features an _SQLDatabase object must provide.
@@ -50,6 +305,30 @@ class _DB20Broker(_SQLDatabase):
     _module = None #: The db2api-compliant module to use.
     _connection_details = None #: The module-specific details needed to connect to a database.
     _query_mac = None #: The string used to look up a MAC's binding.
+    _query_all_macs = """
+     SELECT
+      m.mac, m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps m, subnets s
+     WHERE
+      m.subnet = s.subnet AND m.serial = s.serial
+    """ #: The string used to read every binding.
+    _query_macs = """
+     SELECT
+      m.mac, m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps m, subnets s
+     WHERE
+      m.mac IN (%(placeholders)s) AND m.subnet = s.subnet AND m.serial = s.serial
+    """ #: The string used to look up several MACs' bindings at once, into which placeholders are substituted.
+    _query_macs_limit = 500 #: The most MACs looked up by a single query, within every engine's limit on parameters.
+    _placeholder = '%s' #: The engine's placeholder for query parameters.
+    _query_changelog_position = """
+     SELECT MAX(id) FROM maps_changelog
+    """ #: The string used to find the latest change recorded in the changelog.
+    _query_changes = None #: The string used to look up the current state of every MAC changed since a position in the changelog.
     
     def _lookupMAC(self, mac):
         """
@@ -70,36 +349,262 @@ class _DB20Broker(_SQLDatabase):
         
         @raise Exception: If a problem occurs while accessing the database.
         """
+        rows = self._withConnection(self._executeLookup, mac)
+        if rows:
+            return tuple(rows[0])
+        return None
+        
+    def _lookupMACs(self, macs):
+        """
+        Queries the database for the given MAC addresses, in as few queries as
+        possible.
+        
+        @type macs: list
+        @param macs: The MAC addresses to lookup.
+        
+        @rtype: dict
+        @return: The details of every given MAC, in the form returned by
+            L{lookupMAC}, or None if it is unknown, keyed by MAC.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        found = {}
+        for i in xrange(0, len(macs), self._query_macs_limit):
+            chunk = macs[i:i + self._query_macs_limit]
+            query = self._query_macs % {
+             'placeholders': self._getPlaceholders(len(chunk)),
+            }
+            for row in self._fetchAll(query, chunk):
+                found[row[0].lower()] = tuple(row[1:])
+        return dict((mac, found.get(mac.lower())) for mac in macs)
+        
+    def _getPlaceholders(self, count):
+        """
+        Provides a list of query placeholders.
+        
+        @type count: int
+        @param count: The number of placeholders needed.
+        
+        @rtype: basestring
+        @return: The comma-separated placeholders.
+        """
+        return ', '.join([self._placeholder] * count)
+        
+    def _executeLookup(self, db, mac):
+        """
+        Runs the query that looks up a MAC's binding.
+        
+        Engines that can reuse a parsed or planned query across lookups on the
+        same connection override this.
+        
+        @param db: The connection to use.
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return self._execute(db, self._query_mac, (mac,))
+        
+    def _execute(self, db, query, parameters=()):
+        """
+        Runs a query on the given connection and returns every row it produces.
+        
+        @param db: The connection to use.
+        @type query: basestring
+        @param query: The query to run.
+        @type parameters: sequence
+        @param parameters: The values to bind to the query's placeholders.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        cur = db.cursor()
         try:
-            db = self._getConnection()
-            cur = db.cursor()
-            
-            cur.execute(self._query_mac, (mac,))
-            result = cur.fetchone()
-            if result:
-                return result
-            return None
+            cur.execute(query, parameters)
+            return cur.fetchall()
         finally:
             try:
                 cur.close()
             except Exception:
                 pass
-            try:
-                db.close()
-            except Exception:
-                pass
                 
+    def _fetchAll(self, query, parameters=()):
+        """
+        Runs a query and returns every row it produces.
+        
+        @type query: basestring
+        @param query: The query to run.
+        @type parameters: sequence
+        @param parameters: The values to bind to the query's placeholders.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return self._withConnection(self._execute, query, parameters)
+        
+    def _fetchAllUnbounded(self, query, parameters=()):
+        """
+        Runs a query, free of any statement timeout imposed on lookups, and
+        returns every row it produces; used to maintain the snapshot, which
+        may legitimately take much longer than a lookup.
+        
+        @type query: basestring
+        @param query: The query to run.
+        @type parameters: sequence
+        @param parameters: The values to bind to the query's placeholders.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return self._withConnection(self._executeUnbounded, query, parameters)
+        
+    def _executeUnbounded(self, db, query, parameters=()):
+        """
+        Runs a query on the given connection, free of any statement timeout
+        imposed on lookups, and returns every row it produces.
+        
+        Engines that impose a timeout on every statement override this.
+        
+        @param db: The connection to use.
+        @type query: basestring
+        @param query: The query to run.
+        @type parameters: sequence
+        @param parameters: The values to bind to the query's placeholders.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return self._execute(db, query, parameters)
+        
+    def _isTimeout(self, error):
+        """
+        Indicates whether an error reports that a query outlasted the timeout
+        imposed on it by the engine, which leaves the connection usable.
+        
+        Engines that impose a timeout on lookups override this.
+        
+        @type error: Exception
+        @param error: The error raised by the database module.
+        
+        @rtype: bool
+        @return: True if the error is a timeout.
+        """
+        return False
+        
+    def _withConnection(self, function, *args):
+        """
+        Invokes a function with a connection to the database, as its first
+        argument, and returns its result.
+        
+        If a pooled connection fails because it was broken while idle, the
+        function is invoked again, once, with a fresh connection; a query that
+        timed out is neither retried nor taken as a sign of a broken
+        connection.
+        
+        @type function: callable
+        @param function: The function to invoke.
+        @param args: Any further arguments to pass to the function.
+        
+        @return: The function's result.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        retry = True
+        while True:
+            db = self._getConnection()
+            try:
+                return function(db, *args)
+            except (self._module.OperationalError, self._module.InterfaceError), e:
+                if not isinstance(db, _PooledConnection) or self._isTimeout(e):
+                    raise
+                db.discard()
+                if not (retry and db.reused):
+                    raise
+                retry = False
+            finally:
+                try:
+                    db.close()
+                except Exception:
+                    pass
+                    
+    def _connect(self):
+        """
+        Opens a new connection to the database.
+        
+        @return: The connection.
+        
+        @raise Exception: If a problem occurs while connecting to the database.
+        """
+        return self._module.connect(**self._connection_details)
+        
+    def _lookupAllMACs(self):
+        """
+        Queries the database for every known MAC address.
+        
+        @rtype: list
+        @return: (mac:basestring, details:tuple(11)) pairs, where details are
+            as returned by L{lookupMAC}.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return [(row[0], tuple(row[1:])) for row in self._fetchAllUnbounded(self._query_all_macs)]
+        
+    def _getChangelogPosition(self):
+        """
+        Identifies the most recent change recorded in the database's changelog.
+        
+        @rtype: int
+        @return: The position of the latest change, or 0 if there are none.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        return int(self._fetchAllUnbounded(self._query_changelog_position)[0][0] or 0)
+        
+    def _lookupChangedMACs(self, position):
+        """
+        Queries the database for the current state of every MAC address changed
+        after the given position in its changelog.
+        
+        @type position: int
+        @param position: The position after which changes are wanted.
+        
+        @rtype: list
+        @return: (position:int, mac:basestring, details:tuple(11)|None)
+            triples, in order of position, details being as returned by
+            L{lookupMAC} or None if the MAC was removed.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        changes = []
+        for row in self._fetchAllUnbounded(self._query_changes, (position,)):
+            if row[11] is None: #No longer mapped to a subnet, so removed.
+                changes.append((int(row[0]), row[1], None))
+            else:
+                changes.append((int(row[0]), row[1], tuple(row[2:])))
+        return changes
+        
 class _PoolingBroker(_DB20Broker):
     """
     Defines bevahiour for a connection-pooling-capable DB API 2.0-compatible
     broker.
     """
-    _pool = None #: The database connection pool.
-    _eventlet__db_pool = None #: A reference to the eventlet.db_pool module.
+    _pool = None #: The database connection pool, or None if pooling is disabled.
+    _query_ping = "SELECT 1" #: The string used to check that a pooled connection still works.
     
     def _setupBroker(self, concurrency_limit):
         """
-        Sets up connection-pooling, if it's supported by the environment.
+        Sets up connection-pooling, if enabled.
         
         Also completes the broker-setup process.
         
@@ -109,21 +614,16 @@ class _PoolingBroker(_DB20Broker):
         @param concurrent_limit: The number of concurrent database hits to
             permit.
         """
-        _DB20Broker._setupBroker(self, concurrency_limit)
-
         if config.USE_POOL:
-            try:
-                import eventlet.db_pool
-                self._eventlet__db_pool = eventlet.db_pool
-            except ImportError:
-                return
-            else:
-                self._pool = self._eventlet__db_pool.ConnectionPool(
-                 self._module,
-                 max_size=concurrency_limit, max_idle=30, max_age=600, connect_timeout=5,
-                 **self._connection_details
-                )
-                
+            self._pool = _ConnectionPool(
+             self._connect, self._query_ping,
+             minimum=self._getSetting('POOL_MINIMUM_CONNECTIONS'), maximum=concurrency_limit,
+             max_idle=self._getSetting('POOL_MAX_IDLE'), max_age=self._getSetting('POOL_MAX_AGE'),
+             check_after=self._getSetting('POOL_CHECK_AFTER'),
+            )
+            
+        _DB20Broker._setupBroker(self, concurrency_limit)
+        
     def _getConnection(self):
         """
         Provides a connection to the database.
@@ -133,30 +633,32 @@ class _PoolingBroker(_DB20Broker):
         @raise Exception: If a problem occurs while accessing the database.
         """
         if not self._pool is None:
-            return self._eventlet__db_pool.PooledConnectionWrapper(self._pool.get(), self._pool)
+            return self._pool.get()
         else:
-            return self._module.connect(**self._connection_details)
+            return self._connect()
             
-class _NonPoolingBroker(_DB20Broker):
-    """
-    Defines bevahiour for a non-connection-pooling-capable DB API 2.0-compatible
-    broker.
-    """
-    
-    def _getConnection(self):
+    def getPoolStats(self):
         """
-        Provides a connection to the database.
-
-        @return: The connection object to be used.
+        Reports on the state of the connection pool.
         
-        @raise Exception: If a problem occurs while accessing the database.
+        @rtype: tuple(6)|None
+        @return: (open:int, idle:int, created:int, reused:int, discarded:int,
+            waits:int), or None if pooling is disabled.
         """
-        return self._module.connect(**self._connection_details)
+        if not self._pool is None:
+            return self._pool.getStats()
+        return None
         
 class MySQL(_PoolingBroker):
     """
     Implements a MySQL broker.
+    
+    QUERY_TIMEOUT is enforced by the server, through a MAX_EXECUTION_TIME hint
+    on lookups.
     """
+    _config_prefix = 'MYSQL'
+    _bounded_queries = True
+    _timeout_errno = 3024 #: ER_QUERY_TIMEOUT: the query outlasted its MAX_EXECUTION_TIME.
     _query_mac = """
      SELECT
       m.ip, m.hostname,
@@ -167,6 +669,18 @@ class MySQL(_PoolingBroker):
       m.mac = %s AND m.subnet = s.subnet AND m.serial = s.serial
      LIMIT 1
     """
+    _query_changes = """
+     SELECT
+      c.id, c.mac, m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps_changelog c
+      LEFT JOIN maps m ON m.mac = c.mac
+      LEFT JOIN subnets s ON m.subnet = s.subnet AND m.serial = s.serial
+     WHERE
+      c.id > %s
+     ORDER BY c.id
+    """
     
     def __init__(self):
         """
@@ -186,12 +700,51 @@ class MySQL(_PoolingBroker):
             self._connection_details['host'] = config.MYSQL_HOST
             self._connection_details['port'] = config.MYSQL_PORT
             
+        timeout = int(self._getSetting('QUERY_TIMEOUT') * 1000)
+        if timeout > 0: #The hint is ignored by servers that don't understand it, like MariaDB.
+            hint = 'SELECT /*+ MAX_EXECUTION_TIME(%(timeout)i) */' % {
+             'timeout': timeout,
+            }
+            self._query_mac = self._query_mac.replace('SELECT', hint, 1)
+            self._query_macs = self._query_macs.replace('SELECT', hint, 1)
+            
         self._setupBroker(config.MYSQL_MAXIMUM_CONNECTIONS)
         
+    def _connect(self):
+        """
+        Opens a new connection to the database, in autocommit mode, so that
+        pooled connections don't keep transactions, and their snapshots, open.
+        
+        @return: The connection.
+        
+        @raise Exception: If a problem occurs while connecting to the database.
+        """
+        connection = _PoolingBroker._connect(self)
+        connection.autocommit(True)
+        return connection
+        
+    def _isTimeout(self, error):
+        """
+        Indicates whether an error reports that a lookup outlasted its
+        MAX_EXECUTION_TIME.
+        
+        @type error: Exception
+        @param error: The error raised by the database module.
+        
+        @rtype: bool
+        @return: True if the error is a timeout.
+        """
+        return bool(error.args) and error.args[0] == self._timeout_errno
+        
 class PostgreSQL(_PoolingBroker):
     """
     Implements a PostgreSQL broker.
+    
+    QUERY_TIMEOUT is enforced by the server, as every connection's
+    statement_timeout.
     """
+    _config_prefix = 'POSTGRESQL'
+    _bounded_queries = True
     _query_mac = """
      SELECT
       m.ip, m.hostname,
@@ -202,6 +755,40 @@ class PostgreSQL(_PoolingBroker):
       m.mac = %s AND m.subnet = s.subnet AND m.serial = s.serial
      LIMIT 1
     """
+    _query_changes = """
+     SELECT
+      c.id, c.mac, m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps_changelog c
+      LEFT JOIN maps m ON m.mac = c.mac
+      LEFT JOIN subnets s ON m.subnet = s.subnet AND m.serial = s.serial
+     WHERE
+      c.id > %s
+     ORDER BY c.id
+    """
+    
+    _query_prepare_mac = """
+     PREPARE staticdhcpd_lookup_mac AS
+     SELECT
+      m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps m, subnets s
+     WHERE
+      m.mac = $1 AND m.subnet = s.subnet AND m.serial = s.serial
+     LIMIT 1
+    """ #: The string used to prepare the lookup of a MAC's binding on a connection.
+    _query_execute_mac = """
+     EXECUTE staticdhcpd_lookup_mac (%s)
+    """ #: The string used to look up a MAC's binding with the prepared statement.
+    _prepare = True #: False if prepared statements have proven unusable, as they are behind some proxies.
+    _statement_timeout = 0 #: The number of milliseconds after which the server cancels a statement, or 0 if unbounded.
+    _prepare_unsupported = (
+     '26000', #invalid_sql_statement_name: the statement vanished, as when a proxy switches server sessions.
+     '0A000', #feature_not_supported
+    ) #: The SQLSTATEs that show that prepared statements are unusable.
+    _timeout_pgcode = '57014' #: query_canceled: the statement outlasted its statement_timeout.
     
     def __init__(self):
         """
@@ -219,13 +806,117 @@ class PostgreSQL(_PoolingBroker):
             self._connection_details['host'] = config.POSTGRESQL_HOST
             self._connection_details['port'] = config.POSTGRESQL_PORT
             self._connection_details['sslmode'] = config.POSTGRESQL_SSLMODE
+        self._statement_timeout = int(self._getSetting('QUERY_TIMEOUT') * 1000)
+        if self._statement_timeout > 0:
+            self._connection_details['options'] = '-c statement_timeout=%(timeout)i' % {
+             'timeout': self._statement_timeout,
+            }
             
         self._setupBroker(config.POSTGRESQL_MAXIMUM_CONNECTIONS)
         
+    def _connect(self):
+        """
+        Opens a new connection to the database, in autocommit mode, so that
+        pooled connections don't sit idle in a transaction.
+        
+        @return: The connection.
+        
+        @raise Exception: If a problem occurs while connecting to the database.
+        """
+        connection = _PoolingBroker._connect(self)
+        connection.autocommit = True
+        return connection
+        
+    def _isTimeout(self, error):
+        """
+        Indicates whether an error reports that a statement outlasted its
+        statement_timeout.
+        
+        @type error: Exception
+        @param error: The error raised by the database module.
+        
+        @rtype: bool
+        @return: True if the error is a timeout.
+        """
+        return getattr(error, 'pgcode', None) == self._timeout_pgcode
+        
+    def _executeUnbounded(self, db, query, parameters=()):
+        """
+        Runs a query on the given connection with its statement_timeout lifted,
+        and returns every row it produces.
+        
+        @param db: The connection to use.
+        @type query: basestring
+        @param query: The query to run.
+        @type parameters: sequence
+        @param parameters: The values to bind to the query's placeholders.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        if not self._statement_timeout:
+            return self._execute(db, query, parameters)
+            
+        self._execute(db, "SET statement_timeout = 0")
+        try:
+            return self._execute(db, query, parameters)
+        finally:
+            self._execute(db, "RESET statement_timeout") #Back to the connection's default.
+            
+    def _executeLookup(self, db, mac):
+        """
+        Looks up a MAC's binding through a statement prepared once per pooled
+        connection, so the server parses and plans it only once, falling back
+        to the plain query for good if the server reports that prepared
+        statements are unsupported or that the statement has vanished.
+        
+        @param db: The connection to use.
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        state = getattr(db, 'state', None)
+        if state is None or not self._prepare:
+            return _PoolingBroker._executeLookup(self, db, mac)
+            
+        try:
+            if not state.get('prepared'):
+                cur = db.cursor()
+                try:
+                    cur.execute(self._query_prepare_mac)
+                finally:
+                    cur.close()
+                state['prepared'] = True
+            return self._execute(db, self._query_execute_mac, (mac,))
+        except self._module.ProgrammingError, e:
+            #Whatever happened, the statement may no longer exist on this
+            #connection, so it is prepared again on the next use.
+            state.pop('prepared', None)
+            if getattr(e, 'pgcode', None) not in self._prepare_unsupported:
+                raise
+            self._prepare = False
+            logging.writeLog("Prepared statements unavailable; using plain queries: %(error)s" % {
+             'error': str(e).strip(),
+            })
+            return _PoolingBroker._executeLookup(self, db, mac)
+        
 class Oracle(_PoolingBroker):
     """
     Implements an Oracle broker.
+    
+    QUERY_TIMEOUT is enforced by the client library, as every connection's
+    callTimeout.
     """
+    _config_prefix = 'ORACLE'
+    _bounded_queries = True
+    _call_timeout = 0 #: The number of milliseconds after which a round-trip to the server is abandoned, or 0 if unbounded.
+    _timeout_error = 'DPI-1067' #: The prefix of the error raised when a round-trip outlasts the callTimeout.
     _query_mac = """
      SELECT
       m.ip, m.hostname,
@@ -236,6 +927,19 @@ class Oracle(_PoolingBroker):
       m.mac = :1 AND m.subnet = s.subnet AND m.serial = s.serial
      LIMIT 1
     """
+    _query_ping = "SELECT 1 FROM DUAL"
+    _query_changes = """
+     SELECT
+      c.id, c.mac, m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps_changelog c
+      LEFT JOIN maps m ON m.mac = c.mac
+      LEFT JOIN subnets s ON m.subnet = s.subnet AND m.serial = s.serial
+     WHERE
+      c.id > :1
+     ORDER BY c.id
+    """
 
     def __init__(self):
         """
@@ -249,13 +953,121 @@ class Oracle(_PoolingBroker):
          'password': config.ORACLE_PASSWORD,
          'dsn': config.ORACLE_DATABASE,
         }
-
+        self._call_timeout = int(self._getSetting('QUERY_TIMEOUT') * 1000)
+        
         self._setupBroker(config.ORACLE_MAXIMUM_CONNECTIONS)
+        
+    def _getPlaceholders(self, count):
+        """
+        Provides a list of query placeholders.
+        
+        @type count: int
+        @param count: The number of placeholders needed.
+        
+        @rtype: basestring
+        @return: The comma-separated placeholders.
+        """
+        return ', '.join([':%(index)i' % {'index': i} for i in xrange(1, count + 1)])
+        
+    def _connect(self):
+        """
+        Opens a new connection to the database, in autocommit mode, so that
+        pooled connections don't keep transactions open, and with its
+        callTimeout set.
+        
+        @return: The connection.
+        
+        @raise Exception: If a problem occurs while connecting to the database.
+        """
+        connection = _PoolingBroker._connect(self)
+        connection.autocommit = True
+        if self._call_timeout > 0:
+            connection.callTimeout = self._call_timeout
+        return connection
+        
+    def _isTimeout(self, error):
+        """
+        Indicates whether an error reports that a round-trip outlasted the
+        connection's callTimeout.
+        
+        @type error: Exception
+        @param error: The error raised by the database module.
+        
+        @rtype: bool
+        @return: True if the error is a timeout.
+        """
+        if not error.args:
+            return False
+        message = getattr(error.args[0], 'message', error.args[0])
+        return isinstance(message, basestring) and message.startswith(self._timeout_error)
+        
+        
+    def _executeUnbounded(self, db, query, parameters=()):
+        """
+        Runs a query on the given connection with its callTimeout lifted, and
+        returns every row it produces.
+        
+        @param db: The connection to use.
+        @type query: basestring
+        @param query: The query to run.
+        @type parameters: sequence
+        @param parameters: The values to bind to the query's placeholders.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        if not self._call_timeout:
+            return self._execute(db, query, parameters)
+            
+        cur = db.cursor()
+        try:
+            connection = cur.connection #The underlying connection, even if db is pooled.
+            connection.callTimeout = 0
+            try:
+                cur.execute(query, parameters)
+                return cur.fetchall()
+            finally:
+                connection.callTimeout = self._call_timeout
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+        
+    def _executeLookup(self, db, mac):
+        """
+        Looks up a MAC's binding through a cursor prepared once per pooled
+        connection, so the statement is parsed only once.
+        
+        @param db: The connection to use.
+        @type mac: basestring
+        @param mac: The MAC address to lookup.
+        
+        @rtype: list
+        @return: The rows produced.
+        
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        state = getattr(db, 'state', None)
+        if state is None:
+            return _PoolingBroker._executeLookup(self, db, mac)
+            
+        cur = state.get('lookup_cursor')
+        if cur is None:
+            cur = db.cursor()
+            cur.prepare(self._query_mac)
+            state['lookup_cursor'] = cur
+        cur.execute(None, (mac,))
+        return cur.fetchall()
 
-class SQLite(_NonPoolingBroker):
+class SQLite(_PoolingBroker):
     """
     Implements a SQLite broker.
     """
+    _config_prefix = 'SQLITE'
+    _placeholder = '?'
     _query_mac = """
      SELECT
       m.ip, m.hostname,
@@ -266,6 +1078,18 @@ class SQLite(_NonPoolingBroker):
       m.mac = ? AND m.subnet = s.subnet AND m.serial = s.serial
      LIMIT 1
     """
+    _query_changes = """
+     SELECT
+      c.id, c.mac, m.ip, m.hostname,
+      s.gateway, s.subnet_mask, s.broadcast_address, s.domain_name, s.domain_name_servers,
+      s.ntp_servers, s.lease_time, s.subnet, s.serial
+     FROM maps_changelog c
+      LEFT JOIN maps m ON m.mac = c.mac
+      LEFT JOIN subnets s ON m.subnet = s.subnet AND m.serial = s.serial
+     WHERE
+      c.id > ?
+     ORDER BY c.id
+    """
     
     def __init__(self):
         """
@@ -276,6 +1100,7 @@ class SQLite(_NonPoolingBroker):
         
         self._connection_details = {
          'database': config.SQLITE_FILE,
+         'check_same_thread': False, #Pooled connections move between threads, though only one uses each at a time.
         }
         
         self._setupBroker(1)
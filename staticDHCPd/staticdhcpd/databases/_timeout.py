@@ -0,0 +1,160 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd module: databases._timeout
+
+Purpose
+=======
+ Runs queries in a bounded set of helper threads, so that brokers can stop
+ waiting on slow ones without leaving threads to pile up behind them.
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import Queue
+import sys
+import threading
+import time
+
+from _breaker import (DatabaseBusyError, DatabaseUnavailableError)
+
+class _Call(object):
+    """
+    A query handed to a helper thread.
+    """
+    function = None #: The method to invoke.
+    args = None #: The arguments to pass to the method.
+    result = None #: Whatever the method returned.
+    exc_info = None #: The exception the method raised, if any, as returned by sys.exc_info().
+    started = None #: An event set once a helper thread has begun the query.
+    finished = None #: An event set once the query has finished.
+    cancelled = False #: True if the caller stopped waiting before the query began, so it must not be run.
+    
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        
+class QueryRunner(object):
+    """
+    Runs queries in helper threads, started as needed, up to a fixed number,
+    waiting a limited time for each.
+    
+    A query that is abandoned keeps its helper until it finishes on its own,
+    so no more queries than there are helpers are ever in flight; once every
+    helper is taken, further queries fail instead of queueing without bound.
+    """
+    _condition = None #: A condition used to ensure synchronous access to the counters and to wait for a free helper.
+    _resource_lock = None #: The broker's lock, held by helpers while querying, to keep the database from being overwhelmed.
+    _limit = None #: The number of helper threads that may exist.
+    _timeout = None #: The number of seconds to wait for a free helper, and then for a query.
+    _queue = None #: The queue from which helpers take calls.
+    _threads = 0 #: The number of helper threads started.
+    _busy = 0 #: The number of calls handed to helpers and not yet finished, including abandoned ones.
+    
+    def __init__(self, resource_lock, limit, timeout):
+        """
+        Sets up the runner; helper threads are started as queries arrive.
+        
+        @type resource_lock: threading.Semaphore
+        @param resource_lock: The broker's lock, held by helpers while
+            querying.
+        @type limit: int
+        @param limit: The number of helper threads that may exist.
+        @type timeout: float
+        @param timeout: The number of seconds to wait for a free helper, and
+            then for a query.
+        """
+        self._condition = threading.Condition()
+        self._resource_lock = resource_lock
+        self._limit = limit
+        self._timeout = timeout
+        self._queue = Queue.Queue()
+        
+    def call(self, function, args):
+        """
+        Invokes one of the backend's query methods in a helper thread.
+        
+        The time spent waiting for a helper, or for the broker's lock, is not
+        part of the query's timeout; if it runs out, the query is never made.
+        
+        @type function: callable
+        @param function: The method to invoke.
+        @type args: sequence
+        @param args: The arguments to pass to the method.
+        
+        @return: Whatever the method returns.
+        
+        @raise DatabaseBusyError: If the query could not be started in time.
+        @raise DatabaseUnavailableError: If the query timed out.
+        @raise Exception: If a problem occurs while accessing the database.
+        """
+        deadline = time.time() + self._timeout
+        with self._condition:
+            while self._busy >= self._limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise DatabaseBusyError("Every database helper is busy with a slow query")
+                self._condition.wait(remaining)
+            self._busy += 1
+            if self._threads < self._busy:
+                self._threads += 1
+                helper = threading.Thread(target=self._help)
+                helper.daemon = True
+                helper.start()
+                
+        call = _Call(function, args)
+        self._queue.put(call)
+        if not call.started.wait(max(0, deadline - time.time())):
+            with self._condition:
+                if not call.started.is_set():
+                    call.cancelled = True
+                    raise DatabaseBusyError("Database query could not be started within %(timeout)s seconds" % {
+                     'timeout': self._timeout,
+                    })
+                    
+        if not call.finished.wait(self._timeout):
+            raise DatabaseUnavailableError("Database query did not complete within %(timeout)s seconds" % {
+             'timeout': self._timeout,
+            })
+        if call.exc_info:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
+        
+    def _help(self):
+        """
+        Runs calls as they are queued, forever.
+        """
+        while True:
+            call = self._queue.get()
+            try:
+                with self._resource_lock:
+                    with self._condition:
+                        if call.cancelled:
+                            continue
+                        call.started.set()
+                    try:
+                        call.result = call.function(*call.args)
+                    except Exception:
+                        call.exc_info = sys.exc_info()
+                    call.finished.set()
+            finally:
+                with self._condition:
+                    self._busy -= 1
+                    self._condition.notify()
+                    
@@ -24,15 +24,19 @@ Legal
  
  (C) Neil Tallim, 2009 <red.hamsterx@gmail.com>
 """
+import heapq
 import select
 import threading
 import time
+import zlib
 
 import config
 import logging
 import databases
+import ratelimit
 
 import libpydhcpserver.dhcp_network
+import libpydhcpserver.dhcp_packet
 from libpydhcpserver.type_rfc import (
  ipToList, ipsToList,
  intToList, intsToList,
@@ -40,6 +44,17 @@ from libpydhcpserver.type_rfc import (
  strToList, strToPaddedList,
 )
 
+_MESSAGE_TYPES = {
+ 'DISCOVER': 1,
+ 'REQUEST': 3,
+ 'DECLINE': 4,
+ 'RELEASE': 7,
+ 'INFORM': 8,
+ 'LEASEQUERY': 10,
+} #: The DHCP message-types that may be given their own rate-limits.
+
+_SUBNET_OPTIONS_CAPACITY = 1024 #: The number of distinct sets of subnet options to keep before starting over.
+
 _dhcp_servers = [] #: A collection of all instantiated DHCP servers; this should only ever be one element long.
 def flushCache():
     """
@@ -48,6 +63,72 @@ def flushCache():
     for dhcp_server in _dhcp_servers:
         dhcp_server.flushCache()
         
+def getCacheStats():
+    """
+    Reports on the effectiveness of the database caches.
+    
+    @rtype: tuple(5)|None
+    @return: (entries:int, hits:int, misses:int, evictions:int,
+        expirations:int), summed across all servers, or None if no server
+        reports any.
+    """
+    totals = None
+    for dhcp_server in _dhcp_servers:
+        stats = dhcp_server.getCacheStats()
+        if stats:
+            if totals:
+                totals = tuple(map(sum, zip(totals, stats)))
+            else:
+                totals = stats
+    return totals
+    
+def getPoolStats():
+    """
+    Reports on the state of the database connection pools.
+    
+    @rtype: tuple(6)|None
+    @return: (open:int, idle:int, created:int, reused:int, discarded:int,
+        waits:int), summed across all servers, or None if no server reports
+        any.
+    """
+    totals = None
+    for dhcp_server in _dhcp_servers:
+        stats = dhcp_server.getPoolStats()
+        if stats:
+            if totals:
+                totals = tuple(map(sum, zip(totals, stats)))
+            else:
+                totals = stats
+    return totals
+    
+def getIgnoredMACs():
+    """
+    Lists all MACs currently being ignored.
+    
+    @rtype: tuple
+    @return: A collection of (mac:basestring, seconds_remaining:float) values,
+        soonest-expiring first.
+    """
+    ignored_macs = []
+    for dhcp_server in _dhcp_servers:
+        ignored_macs.extend(dhcp_server.getIgnoredMACs())
+    return tuple(sorted(ignored_macs, key=lambda (mac, seconds_remaining): seconds_remaining))
+    
+def unignoreMAC(mac):
+    """
+    Allows requests from an ignored MAC to be processed again immediately.
+    
+    @type mac: basestring
+    @param mac: The MAC to stop ignoring.
+    
+    @rtype: bool
+    @return: True if the MAC was being ignored.
+    """
+    unignored = False
+    for dhcp_server in _dhcp_servers:
+        unignored = dhcp_server.unignoreMAC(mac) or unignored
+    return unignored
+    
 def _logInvalidValue(name, value, subnet, serial):
     logging.writeLog("Invalid value for %(subnet)s:%(serial)i:%(name)s: %(value)s" % {
      'subnet': subnet,
@@ -56,6 +137,101 @@ def _logInvalidValue(name, value, subnet, serial):
      'value': value,
     })
     
+class _IgnoreTable(object):
+    """
+    The MACs whose requests are being ignored, each with its own deadline.
+    
+    Lookups are dictionary-based; expiry is driven by a heap of deadlines, so
+    neither depends on the number of MACs ignored.
+    """
+    _deadlines = None #: The time at which each ignored MAC will be honoured again, keyed by MAC.
+    _heap = None #: (deadline, mac) entries; stale entries are skipped when they surface.
+    _lock = None #: A lock used to synchronize changes to the table.
+    
+    def __init__(self):
+        self._deadlines = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        
+    def __len__(self):
+        self.expire()
+        return len(self._deadlines)
+        
+    def ignore(self, mac, duration):
+        """
+        Ignores a MAC for the given number of seconds; if it is already being
+        ignored, the later deadline applies.
+        
+        @type mac: basestring
+        @param mac: The MAC to be ignored.
+        @type duration: float
+        @param duration: The number of seconds for which to ignore it.
+        """
+        deadline = time.time() + duration
+        with self._lock:
+            if deadline > self._deadlines.get(mac, 0):
+                self._deadlines[mac] = deadline
+                heapq.heappush(self._heap, (deadline, mac))
+                
+    def isIgnored(self, mac):
+        """
+        Indicates whether a MAC is being ignored.
+        
+        @type mac: basestring
+        @param mac: The MAC to be evaluated.
+        
+        @rtype: bool
+        @return: True if the MAC's requests should be ignored.
+        """
+        deadline = self._deadlines.get(mac)
+        if deadline is None:
+            return False
+        if deadline > time.time():
+            return True
+        self.expire()
+        return False
+        
+    def unignore(self, mac):
+        """
+        Stops ignoring a MAC; its heap entry is discarded when it surfaces.
+        
+        @type mac: basestring
+        @param mac: The MAC to stop ignoring.
+        
+        @rtype: bool
+        @return: True if the MAC was being ignored.
+        """
+        with self._lock:
+            return self._deadlines.pop(mac, None) is not None
+            
+    def expire(self):
+        """
+        Removes every MAC whose deadline has passed.
+        """
+        now = time.time()
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                (deadline, mac) = heapq.heappop(heap)
+                if self._deadlines.get(mac) == deadline:
+                    del self._deadlines[mac]
+                    
+    def list(self):
+        """
+        Lists all MACs currently being ignored.
+        
+        @rtype: tuple
+        @return: A collection of (mac:basestring, seconds_remaining:float)
+            values, soonest-expiring first.
+        """
+        self.expire()
+        now = time.time()
+        with self._lock:
+            return tuple(sorted(
+             ((mac, deadline - now) for (mac, deadline) in self._deadlines.iteritems()),
+             key=lambda (mac, seconds_remaining): seconds_remaining
+            ))
+            
 class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
     """
     The handler that responds to all received DHCP requests.
@@ -63,13 +239,17 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
     _database = None #: The database to be used when handling MAC lookups.
     
     _stats_lock = None #: A lock used to ensure synchronous access to performance statistics.
-    _dhcp_assignments = None #: The MACs and the number of DHCP "leases" granted to each since the last polling interval.
-    _ignored_addresses = None #: A list of all MACs currently ignored, plus the time remaining until requests will be honoured again.
+    _mac_limiter = None #: The L{ratelimit.RateLimiter} that tracks requests from each MAC.
+    _mac_rates = None #: The (rate, burst) applied to each DHCP message-type with its own limit; others share the default.
+    _relay_limiter = None #: The L{ratelimit.RateLimiter} that tracks requests forwarded by each relay.
+    _ignored_addresses = None #: The L{_IgnoreTable} of all MACs currently ignored.
     _packets_discarded = 0 #: The number of packets discarded since the last polling interval.
     _packets_processed = 0 #: The number of packets processed since the last polling interval.
     _time_taken = 0.0 #: The amount of time taken since the last polling interval.
+    _shard = None #: (index, count) if this server shares its port with other processes.
+    _subnet_options = None #: Validated options shared by every client with the same subnet details, keyed by those details.
     
-    def __init__(self, server_address, server_port, client_port, pxe_port):
+    def __init__(self, server_address, server_port, client_port, pxe_port, shard=None):
         """
         Constructs the DHCP handler.
         
@@ -85,32 +265,134 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe_port: int|NoneType
         @param pxe_port: The port on which to listen for PXE requests, or a
             NoneType if PXE support is disabled.
+        @type shard: tuple|NoneType
+        @param shard: (index:int, count:int) if this server is one of several
+            worker processes bound to the same ports; broadcasts from clients
+            without an address are only answered by the worker to which their
+            MAC belongs.
         
         @raise Exception: If a problem occurs while initializing the sockets
             required to process DHCP messages.
         """
         self._stats_lock = threading.Lock()
-        self._dhcp_assignments = {}
-        self._ignored_addresses = []
+        self._shard = shard
+        self._subnet_options = {}
+        self._ignored_addresses = _IgnoreTable()
+        self._mac_limiter = ratelimit.RateLimiter(int(config.RATE_LIMIT_CAPACITY))
+        self._mac_rates = dict(
+         (_MESSAGE_TYPES[message_type.upper()], (float(rate), float(burst)))
+         for (message_type, (rate, burst)) in config.SUSPEND_RATES.items()
+        )
+        self._relay_limiter = ratelimit.RateLimiter(int(config.RATE_LIMIT_CAPACITY))
         
         libpydhcpserver.dhcp_network.DHCPNetwork.__init__(
-         self, server_address, server_port, client_port, pxe_port
+         self, server_address, server_port, client_port, pxe_port,
+         worker_threads=int(config.WORKER_THREADS),
+         worker_queue_size=int(config.WORKER_QUEUE_SIZE),
+         worker_queue_overflow=config.WORKER_QUEUE_OVERFLOW,
+         receive_budget=int(config.RECEIVE_BUDGET),
+         io_backend=config.NETWORK_IO_BACKEND,
+         reuse_port=bool(shard)
         )
         
         self._database = databases.get_database()
         
-    def _evaluateRelay(self, packet, pxe):
+    def _filterDHCPPacket(self, data, source_address, pxe):
+        """
+        Discards packets that would not be answered before any processing is
+        done, reading only the fields needed to decide from the datagram.
+        
+        Broadcasts from clients without an address that belong to another
+        worker process are dropped first. The kernel delivers unicast packets
+        to only one of the sockets sharing a port, but broadcasts reach all of
+        them, so those are divided among workers by MAC. Broadcasts from
+        clients that do have an address (REBIND, INFORM) can't be told apart
+        from unicast, so every worker answers them, with identical responses.
+        
+        Then relay policy, the ignore list, and the suspension threshold are
+        applied, so that a flood from a misbehaving client costs little more
+        than the reads needed to identify it.
+        
+        Packets without an Ethernet address, whose hlen isn't 6, have no MAC
+        to shard, ignore, or rate-limit by, so only relay policy is applied to
+        them here, by every worker; they reach the handlers as they did before
+        any filtering.
+        
+        @type data: str
+        @param data: The received datagram.
+        @type source_address: tuple
+        @param source_address: The address (host, port) from which the request
+            was received.
+        @type pxe: bool
+        @param pxe: True if the packet was received on the PXE port.
+        
+        @rtype: bool
+        @return: True if the packet should be processed.
+        """
+        peek = libpydhcpserver.dhcp_packet.peekPacket(data)
+        if not peek:
+            return True #Let the packet's own parser decide.
+        (op, mac, ciaddr, giaddr, dhcp_message_type) = peek
+        
+        if self._shard and not mac is None and not pxe and giaddr == '\x00\x00\x00\x00' and ciaddr == '\x00\x00\x00\x00':
+            (index, count) = self._shard
+            if zlib.crc32(mac) % count != index:
+                return False
+                
+        if dhcp_message_type is None: #Not something that will be handled.
+            return True
+            
+        if op != 1 or not self._evaluateRelay(giaddr, pxe): #Not a BOOTREQUEST or not allowed.
+            self._logRejectedPacket()
+            return False
+        if config.RELAY_RATE_LIMIT and not giaddr == '\x00\x00\x00\x00':
+            (rate, burst) = config.RELAY_RATE_LIMIT
+            if not self._relay_limiter.consume(giaddr, rate, burst): #The relay is forwarding too much; shed it.
+                self._logRejectedPacket()
+                return False
+        if mac is None:
+            return True
+        if self._ignored_addresses.isIgnored(mac):
+            self._logRejectedPacket()
+            return False
+        if not self._logDHCPAccess(mac, dhcp_message_type):
+            self._logRejectedPacket()
+            return False
+        return True
+        
+    def _handleDatagramError(self, data, source_address, pxe, exception):
+        """
+        Logs a received datagram that could not be parsed or dispatched.
+        
+        @type data: str
+        @param data: The received datagram.
+        @type source_address: tuple
+        @param source_address: The address (host, port) from which the request
+            was received.
+        @type pxe: bool
+        @param pxe: True if the packet was received on the PXE port.
+        @type exception: Exception
+        @param exception: The error that occurred.
+        """
+        logging.writeLog('Discarded unprocessable %(bytes)i-byte datagram from %(ip)s:%(port)i: %(error)s' % {
+         'bytes': len(data),
+         'ip': source_address[0],
+         'port': source_address[1],
+         'error': str(exception),
+        })
+        
+    def _evaluateRelay(self, giaddr, pxe):
         """
         Determines whether the received packet belongs to a relayed request or
         not and decides whether it should be allowed based on policy.
         
-        @type packet: L{libpydhcpserver.dhcp_packet.DHCPPacket}
-        @param packet: The packet to be evaluated.
+        @type giaddr: str
+        @param giaddr: The packet's giaddr field, as four raw bytes.
         @type pxe: bool
         @param pxe: Whether the request is PXE
         """
-        giaddr = packet.getOption("giaddr")
-        if not giaddr == [0,0,0,0]: #Relayed request.
+        if not giaddr == '\x00\x00\x00\x00': #Relayed request.
+            giaddr = map(ord, giaddr)
             if not config.ALLOW_DHCP_RELAYS: #Ignore it.
                 return False
             elif config.ALLOWED_DHCP_RELAYS and not '.'.join(map(str, giaddr)) in config.ALLOWED_DHCP_RELAYS:
@@ -140,34 +422,24 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe: bool
         @param pxe: True if the packet was received on the PXE port.
         """
-        if not self._evaluateRelay(packet, pxe):
-            return
-            
         start_time = time.time()
         mac = packet.getHardwareAddress()
-        if not [None for (ignored_mac, timeout) in self._ignored_addresses if mac == ignored_mac]:
-            if not self._logDHCPAccess(mac):
-                self._logDiscardedPacket()
-                return
-                
-            if '.'.join(map(str, packet.getOption("server_identifier"))) == self._server_address: #Rejected!
-                ip = '.'.join(map(str, packet.getOption("requested_ip_address")))
-                result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                if result and result[0] == ip: #Known client.
-                    logging.writeLog('DHCPDECLINE from %(mac)s for %(ip)s on (%(subnet)s, %(serial)i)' % {
-                     'ip': ip,
-                     'mac': mac,
-                     'subnet': result[9],
-                     'serial': result[10],
-                    })
-                    logging.sendDeclineReport(mac, ip, result[9], result[10])
-                else:
-                    logging.writeLog('Misconfigured client %(mac)s sent DHCPDECLINE for %(ip)s' % {
-                     'ip': ip,
-                     'mac': mac,
-                    })
+        if '.'.join(map(str, packet.getOption("server_identifier"))) == self._server_address: #Rejected!
+            ip = '.'.join(map(str, packet.getOption("requested_ip_address")))
+            result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+            if result and result[0] == ip: #Known client.
+                logging.writeLog('DHCPDECLINE from %(mac)s for %(ip)s on (%(subnet)s, %(serial)i)' % {
+                 'ip': ip,
+                 'mac': mac,
+                 'subnet': result[9],
+                 'serial': result[10],
+                })
+                logging.sendDeclineReport(mac, ip, result[9], result[10])
             else:
-                self._logDiscardedPacket()
+                logging.writeLog('Misconfigured client %(mac)s sent DHCPDECLINE for %(ip)s' % {
+                 'ip': ip,
+                 'mac': mac,
+                })
         else:
             self._logDiscardedPacket()
         self._logTimeTaken(time.time() - start_time)
@@ -190,68 +462,57 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe: bool
         @param pxe: True if the packet was received on the PXE port.
         """
-        if not self._evaluateRelay(packet, pxe):
-            return
-            
         start_time = time.time()
         mac = packet.getHardwareAddress()
-        if not [None for (ignored_mac, timeout) in self._ignored_addresses if mac == ignored_mac]:
-            if not self._logDHCPAccess(mac):
-                self._logDiscardedPacket()
-                return
+        logging.writeLog('DHCPDISCOVER from %(mac)s' % {
+         'mac': mac,
+        })
+        
+        try:
+            result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+            if result:
+                rapid_commit = not packet.getOption('rapid_commit') is None
+                if rapid_commit:
+                    packet.transformToDHCPAckPacket()
+                    packet.forceOption('rapid_commit', [])
+                else:
+                    packet.transformToDHCPOfferPacket()
+                pxe_options = packet.extractPXEOptions()
+                vendor_options = packet.extractVendorOptions()
                 
-            logging.writeLog('DHCPDISCOVER from %(mac)s' % {
-             'mac': mac,
-            })
-            
-            try:
-                result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                if result:
-                    rapid_commit = not packet.getOption('rapid_commit') is None
+                self._loadDHCPPacket(packet, result)
+                giaddr = packet.getOption("giaddr")
+                if not giaddr or giaddr == [0,0,0,0]:
+                    giaddr = None
+                else:
+                    giaddr = tuple(giaddr)
+                if config.loadDHCPPacket(
+                 packet,
+                 mac, tuple(ipToList(result[0])), giaddr,
+                 result[9], result[10],
+                 pxe and pxe_options, vendor_options
+                ):
                     if rapid_commit:
-                        packet.transformToDHCPAckPacket()
-                        packet.forceOption('rapid_commit', [])
+                        self._sendDHCPPacket(packet, source_address, 'ACK-rapid', mac, result[0], pxe)
                     else:
-                        packet.transformToDHCPOfferPacket()
-                    pxe_options = packet.extractPXEOptions()
-                    vendor_options = packet.extractVendorOptions()
-                        
-                    self._loadDHCPPacket(packet, result)
-                    giaddr = packet.getOption("giaddr")
-                    if not giaddr or giaddr == [0,0,0,0]:
-                        giaddr = None
-                    else:
-                        giaddr = tuple(giaddr)
-                    if config.loadDHCPPacket(
-                     packet,
-                     mac, tuple(ipToList(result[0])), giaddr,
-                     result[9], result[10],
-                     pxe and pxe_options, vendor_options
-                    ):
-                        if rapid_commit:
-                            self._sendDHCPPacket(packet, source_address, 'ACK-rapid', mac, result[0], pxe)
-                        else:
-                            self._sendDHCPPacket(packet, source_address, 'OFFER', mac, result[0], pxe)
-                    else:
-                        logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
-                         'mac': mac,
-                        })
-                        self._logDiscardedPacket()
+                        self._sendDHCPPacket(packet, source_address, 'OFFER', mac, result[0], pxe)
                 else:
-                    if config.AUTHORITATIVE:
-                        packet.transformToDHCPNackPacket()
-                        self._sendDHCPPacket(packet, source_address, 'NAK', mac, '?.?.?.?', pxe)
-                    else:
-                        logging.writeLog('%(mac)s unknown; ignoring for %(time)i seconds' % {
-                         'mac': mac,
-                         'time': config.UNAUTHORIZED_CLIENT_TIMEOUT,
-                        })
-                        with self._stats_lock:
-                            self._ignored_addresses.append([mac, config.UNAUTHORIZED_CLIENT_TIMEOUT])
-            except Exception, e:
-                logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
-        else:
-            self._logDiscardedPacket()
+                    logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
+                     'mac': mac,
+                    })
+                    self._logDiscardedPacket()
+            else:
+                if config.AUTHORITATIVE:
+                    packet.transformToDHCPNackPacket()
+                    self._sendDHCPPacket(packet, source_address, 'NAK', mac, '?.?.?.?', pxe)
+                else:
+                    logging.writeLog('%(mac)s unknown; ignoring for %(time)i seconds' % {
+                     'mac': mac,
+                     'time': config.UNAUTHORIZED_CLIENT_TIMEOUT,
+                    })
+                    self._ignored_addresses.ignore(mac, config.UNAUTHORIZED_CLIENT_TIMEOUT)
+        except Exception, e:
+            logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
         self._logTimeTaken(time.time() - start_time)
         
     def _handleDHCPLeaseQuery(self, packet, source_address, pxe):
@@ -272,9 +533,6 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe: bool
         @param pxe: True if the packet was received on the PXE port.
         """
-        if not self._evaluateRelay(packet, pxe):
-            return
-            
         start_time = time.time()
         mac = None
         try:
@@ -285,30 +543,23 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
             self._logDiscardedPacket()
             return
             
-        if not [None for (ignored_mac, timeout) in self._ignored_addresses if mac == ignored_mac]:
-            if not self._logDHCPAccess(mac):
-                self._logDiscardedPacket()
-                return
-                
-            logging.writeLog('DHCPLEASEQUERY for %(mac)s' % {
-             'mac': mac,
-            })
-            
-            try:
-                result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                if result:
-                    packet.transformToDHCPLeaseActivePacket()
-                    if packet.setOption('yiaddr', ipToList(result[0])):
-                        self._sendDHCPPacket(packet, source_address, 'LEASEACTIVE', mac, result[0], pxe)
-                    else:
-                        _logInvalidValue('ip', result[0], result[-2], result[-1])
+        logging.writeLog('DHCPLEASEQUERY for %(mac)s' % {
+         'mac': mac,
+        })
+        
+        try:
+            result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+            if result:
+                packet.transformToDHCPLeaseActivePacket()
+                if packet.setOption('yiaddr', ipToList(result[0])):
+                    self._sendDHCPPacket(packet, source_address, 'LEASEACTIVE', mac, result[0], pxe)
                 else:
-                    packet.transformToDHCPLeaseUnknownPacket()
-                    self._sendDHCPPacket(packet, source_address, 'LEASEUNKNOWN', mac, '?.?.?.?', pxe)
-            except Exception, e:
-                logging.sendErrorReport('Unable to respond for %(mac)s' % {'mac': mac,}, e)
-        else:
-            self._logDiscardedPacket()
+                    _logInvalidValue('ip', result[0], result[-2], result[-1])
+            else:
+                packet.transformToDHCPLeaseUnknownPacket()
+                self._sendDHCPPacket(packet, source_address, 'LEASEUNKNOWN', mac, '?.?.?.?', pxe)
+        except Exception, e:
+            logging.sendErrorReport('Unable to respond for %(mac)s' % {'mac': mac,}, e)
         self._logTimeTaken(time.time() - start_time)
         
     def _handleDHCPRequest(self, packet, source_address, pxe):
@@ -334,80 +585,42 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe: bool
         @param pxe: True if the packet was received on the PXE port.
         """
-        if not self._evaluateRelay(packet, pxe):
-            return
-            
         start_time = time.time()
         mac = packet.getHardwareAddress()
-        if not [None for (ignored_mac, timeout) in self._ignored_addresses if mac == ignored_mac]:
-            if not self._logDHCPAccess(mac):
-                self._logDiscardedPacket()
-                return
-                
-            ip = packet.getOption("requested_ip_address")
-            sid = packet.getOption("server_identifier")
-            ciaddr = packet.getOption("ciaddr")
-            giaddr = packet.getOption("giaddr")
-            s_ip = ip and '.'.join(map(str, ip))
-            s_sid = sid and '.'.join(map(str, sid))
-            s_ciaddr = ciaddr and '.'.join(map(str, ciaddr))
+        ip = packet.getOption("requested_ip_address")
+        sid = packet.getOption("server_identifier")
+        ciaddr = packet.getOption("ciaddr")
+        giaddr = packet.getOption("giaddr")
+        s_ip = ip and '.'.join(map(str, ip))
+        s_sid = sid and '.'.join(map(str, sid))
+        s_ciaddr = ciaddr and '.'.join(map(str, ciaddr))
+        
+        if not ip or ip == [0,0,0,0]:
+            ip = None
+        if not sid or sid == [0,0,0,0]:
+            sid = None
+        if not ciaddr or ciaddr == [0,0,0,0]:
+            ciaddr = None
+        if not giaddr or giaddr == [0,0,0,0]:
+            giaddr = None
+        else:
+            giaddr = tuple(giaddr)
             
-            if not ip or ip == [0,0,0,0]:
-                ip = None
-            if not sid or sid == [0,0,0,0]:
-                sid = None
-            if not ciaddr or ciaddr == [0,0,0,0]:
-                ciaddr = None
-            if not giaddr or giaddr == [0,0,0,0]:
-                giaddr = None
-            else:
-                giaddr = tuple(giaddr)
-                
-            if sid and not ciaddr: #SELECTING
-                if s_sid == self._server_address: #Chosen!
-                    logging.writeLog('DHCPREQUEST:SELECTING from %(mac)s' % {
-                     'mac': mac,
-                    })
-                    try:
-                        result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                        if result and (not ip or result[0] == s_ip):
-                            packet.transformToDHCPAckPacket()
-                            pxe_options = packet.extractPXEOptions()
-                            vendor_options = packet.extractVendorOptions()
-                            self._loadDHCPPacket(packet, result)
-                            if config.loadDHCPPacket(
-                             packet,
-                             mac, tuple(ipToList(result[0])), giaddr,
-                             result[9], result[10],
-                             pxe and pxe_options, vendor_options
-                            ):
-                                self._sendDHCPPacket(packet, source_address, 'ACK', mac, s_ip, pxe)
-                            else:
-                                logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
-                                 'mac': mac,
-                                })
-                                self._logDiscardedPacket()
-                        else:
-                            packet.transformToDHCPNackPacket()
-                            self._sendDHCPPacket(packet, source_address, 'NAK', mac, 'NO-MATCH', pxe)
-                    except Exception, e:
-                        logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
-                else:
-                    self._logDiscardedPacket()
-            elif not sid and not ciaddr and ip: #INIT-REBOOT
-                logging.writeLog('DHCPREQUEST:INIT-REBOOT from %(mac)s' % {
+        if sid and not ciaddr: #SELECTING
+            if s_sid == self._server_address: #Chosen!
+                logging.writeLog('DHCPREQUEST:SELECTING from %(mac)s' % {
                  'mac': mac,
                 })
                 try:
                     result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                    if result and result[0] == s_ip:
+                    if result and (not ip or result[0] == s_ip):
                         packet.transformToDHCPAckPacket()
                         pxe_options = packet.extractPXEOptions()
                         vendor_options = packet.extractVendorOptions()
                         self._loadDHCPPacket(packet, result)
                         if config.loadDHCPPacket(
                          packet,
-                         mac, tuple(ip), giaddr,
+                         mac, tuple(ipToList(result[0])), giaddr,
                          result[9], result[10],
                          pxe and pxe_options, vendor_options
                         ):
@@ -419,61 +632,89 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
                             self._logDiscardedPacket()
                     else:
                         packet.transformToDHCPNackPacket()
-                        self._sendDHCPPacket(packet, source_address, 'NAK', mac, s_ip, pxe)
+                        self._sendDHCPPacket(packet, source_address, 'NAK', mac, 'NO-MATCH', pxe)
                 except Exception, e:
                     logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
-            elif not sid and ciaddr and not ip: #RENEWING or REBINDING
-                if config.NAK_RENEWALS and not pxe:
-                    packet.transformToDHCPNackPacket()
-                    self._sendDHCPPacket(packet, source_address, 'NAK', mac, 'NAK_RENEWALS', pxe)
-                else:
-                    renew = source_address[0] not in ('255.255.255.255', '0.0.0.0', '')
-                    if renew:
-                        logging.writeLog('DHCPREQUEST:RENEW from %(mac)s' % {
-                         'mac': mac,
-                        })
+            else:
+                self._logDiscardedPacket()
+        elif not sid and not ciaddr and ip: #INIT-REBOOT
+            logging.writeLog('DHCPREQUEST:INIT-REBOOT from %(mac)s' % {
+             'mac': mac,
+            })
+            try:
+                result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+                if result and result[0] == s_ip:
+                    packet.transformToDHCPAckPacket()
+                    pxe_options = packet.extractPXEOptions()
+                    vendor_options = packet.extractVendorOptions()
+                    self._loadDHCPPacket(packet, result)
+                    if config.loadDHCPPacket(
+                     packet,
+                     mac, tuple(ip), giaddr,
+                     result[9], result[10],
+                     pxe and pxe_options, vendor_options
+                    ):
+                        self._sendDHCPPacket(packet, source_address, 'ACK', mac, s_ip, pxe)
                     else:
-                        logging.writeLog('DHCPREQUEST:REBIND from %(mac)s' % {
+                        logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
                          'mac': mac,
                         })
-                        
-                    try:
-                        result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                        if result and result[0] == s_ciaddr:
-                            packet.transformToDHCPAckPacket()
-                            pxe_options = packet.extractPXEOptions()
-                            vendor_options = packet.extractVendorOptions()
-                            packet.setOption('yiaddr', ciaddr)
-                            self._loadDHCPPacket(packet, result)
-                            if config.loadDHCPPacket(
-                             packet,
-                             mac, tuple(ciaddr), giaddr,
-                             result[9], result[10],
-                             pxe and pxe_options, vendor_options
-                            ):
-                                self._sendDHCPPacket(packet, (s_ciaddr, 0), 'ACK', mac, s_ciaddr, pxe)
-                            else:
-                                logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
-                                 'mac': mac,
-                                })
-                                self._logDiscardedPacket()
-                        else:
-                            if renew:
-                                packet.transformToDHCPNackPacket()
-                                self._sendDHCPPacket(packet, (s_ciaddr, 0), 'NAK', mac, s_ciaddr, pxe)
-                            else:
-                                self._logDiscardedPacket()
-                    except Exception, e:
-                        logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
+                        self._logDiscardedPacket()
+                else:
+                    packet.transformToDHCPNackPacket()
+                    self._sendDHCPPacket(packet, source_address, 'NAK', mac, s_ip, pxe)
+            except Exception, e:
+                logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
+        elif not sid and ciaddr and not ip: #RENEWING or REBINDING
+            if config.NAK_RENEWALS and not pxe:
+                packet.transformToDHCPNackPacket()
+                self._sendDHCPPacket(packet, source_address, 'NAK', mac, 'NAK_RENEWALS', pxe)
             else:
-                logging.writeLog('DHCPREQUEST:UNKNOWN (%(sid)s %(ciaddr)s %(ip)s) from %(mac)s' % {
-                 'sid': str(sid),
-                 'ciaddr': str(ciaddr),
-                 'ip': str(ip),
-                 'mac': mac,
-                })
-                self._logDiscardedPacket()
+                renew = source_address[0] not in ('255.255.255.255', '0.0.0.0', '')
+                if renew:
+                    logging.writeLog('DHCPREQUEST:RENEW from %(mac)s' % {
+                     'mac': mac,
+                    })
+                else:
+                    logging.writeLog('DHCPREQUEST:REBIND from %(mac)s' % {
+                     'mac': mac,
+                    })
+                    
+                try:
+                    result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+                    if result and result[0] == s_ciaddr:
+                        packet.transformToDHCPAckPacket()
+                        pxe_options = packet.extractPXEOptions()
+                        vendor_options = packet.extractVendorOptions()
+                        packet.setOption('yiaddr', ciaddr)
+                        self._loadDHCPPacket(packet, result)
+                        if config.loadDHCPPacket(
+                         packet,
+                         mac, tuple(ciaddr), giaddr,
+                         result[9], result[10],
+                         pxe and pxe_options, vendor_options
+                        ):
+                            self._sendDHCPPacket(packet, (s_ciaddr, 0), 'ACK', mac, s_ciaddr, pxe)
+                        else:
+                            logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
+                             'mac': mac,
+                            })
+                            self._logDiscardedPacket()
+                    else:
+                        if renew:
+                            packet.transformToDHCPNackPacket()
+                            self._sendDHCPPacket(packet, (s_ciaddr, 0), 'NAK', mac, s_ciaddr, pxe)
+                        else:
+                            self._logDiscardedPacket()
+                except Exception, e:
+                    logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
         else:
+            logging.writeLog('DHCPREQUEST:UNKNOWN (%(sid)s %(ciaddr)s %(ip)s) from %(mac)s' % {
+             'sid': str(sid),
+             'ciaddr': str(ciaddr),
+             'ip': str(ip),
+             'mac': mac,
+            })
             self._logDiscardedPacket()
         self._logTimeTaken(time.time() - start_time)
         
@@ -496,71 +737,59 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe: bool
         @param pxe: True if the packet was received on the PXE port.
         """
-        if not self._evaluateRelay(packet, pxe):
-            return
-            
         start_time = time.time()
         mac = packet.getHardwareAddress()
-        if not [None for (ignored_mac, timeout) in self._ignored_addresses if mac == ignored_mac]:
-            if not self._logDHCPAccess(mac):
-                self._logDiscardedPacket()
-                return
-                
-            ciaddr = packet.getOption("ciaddr")
-            giaddr = packet.getOption("giaddr")
-            s_ciaddr = '.'.join(map(str, ciaddr))
-            if not ciaddr or ciaddr == [0,0,0,0]:
-                ciaddr = None
-            if not giaddr or giaddr == [0,0,0,0]:
-                giaddr = None
-            else:
-                giaddr = tuple(giaddr)
-                
-            logging.writeLog('DHCPINFORM from %(mac)s' % {
+        ciaddr = packet.getOption("ciaddr")
+        giaddr = packet.getOption("giaddr")
+        s_ciaddr = '.'.join(map(str, ciaddr))
+        if not ciaddr or ciaddr == [0,0,0,0]:
+            ciaddr = None
+        if not giaddr or giaddr == [0,0,0,0]:
+            giaddr = None
+        else:
+            giaddr = tuple(giaddr)
+            
+        logging.writeLog('DHCPINFORM from %(mac)s' % {
+         'mac': mac,
+        })
+        
+        if not ciaddr:
+            logging.writeLog('%(mac)s sent malformed packet; ignoring for %(time)i seconds' % {
              'mac': mac,
+             'time': config.UNAUTHORIZED_CLIENT_TIMEOUT,
             })
+            self._ignored_addresses.ignore(mac, config.UNAUTHORIZED_CLIENT_TIMEOUT)
+            self._logDiscardedPacket()
+            return
             
-            if not ciaddr:
-                logging.writeLog('%(mac)s sent malformed packet; ignoring for %(time)i seconds' % {
-                 'mac': mac,
-                 'time': config.UNAUTHORIZED_CLIENT_TIMEOUT,
-                })
-                with self._stats_lock:
-                    self._ignored_addresses.append([mac, config.UNAUTHORIZED_CLIENT_TIMEOUT])
-                self._logDiscardedPacket()
-                return
-                
-            try:
-                result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                if result:
-                    packet.transformToDHCPAckPacket()
-                    pxe_options = packet.extractPXEOptions()
-                    vendor_options = packet.extractVendorOptions()
-                    self._loadDHCPPacket(packet, result, True)
-                    if config.loadDHCPPacket(
-                     packet,
-                     mac, tuple(ipToList(result[0])), giaddr,
-                     result[9], result[10],
-                     pxe and pxe_options, vendor_options
-                    ):
-                        self._sendDHCPPacket(packet, source_address, 'ACK', mac, s_ciaddr, pxe)
-                    else:
-                        logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
-                         'mac': mac,
-                        })
-                        self._logDiscardedPacket()
+        try:
+            result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+            if result:
+                packet.transformToDHCPAckPacket()
+                pxe_options = packet.extractPXEOptions()
+                vendor_options = packet.extractVendorOptions()
+                self._loadDHCPPacket(packet, result, True)
+                if config.loadDHCPPacket(
+                 packet,
+                 mac, tuple(ipToList(result[0])), giaddr,
+                 result[9], result[10],
+                 pxe and pxe_options, vendor_options
+                ):
+                    self._sendDHCPPacket(packet, source_address, 'ACK', mac, s_ciaddr, pxe)
                 else:
-                    logging.writeLog('%(mac)s unknown; ignoring for %(time)i seconds' % {
+                    logging.writeLog('Ignoring %(mac)s per loadDHCPPacket()' % {
                      'mac': mac,
-                     'time': config.UNAUTHORIZED_CLIENT_TIMEOUT,
                     })
-                    with self._stats_lock:
-                        self._ignored_addresses.append([mac, config.UNAUTHORIZED_CLIENT_TIMEOUT])
                     self._logDiscardedPacket()
-            except Exception, e:
-                logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
-        else:
-            self._logDiscardedPacket()
+            else:
+                logging.writeLog('%(mac)s unknown; ignoring for %(time)i seconds' % {
+                 'mac': mac,
+                 'time': config.UNAUTHORIZED_CLIENT_TIMEOUT,
+                })
+                self._ignored_addresses.ignore(mac, config.UNAUTHORIZED_CLIENT_TIMEOUT)
+                self._logDiscardedPacket()
+        except Exception, e:
+            logging.sendErrorReport('Unable to respond to %(mac)s' % {'mac': mac,}, e)
         self._logTimeTaken(time.time() - start_time)
         
     def _handleDHCPRelease(self, packet, source_address, pxe):
@@ -581,31 +810,21 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         @type pxe: bool
         @param pxe: True if the packet was received on the PXE port.
         """
-        if not self._evaluateRelay(packet, pxe):
-            return
-            
         start_time = time.time()
         mac = packet.getHardwareAddress()
-        if not [None for (ignored_mac, timeout) in self._ignored_addresses if mac == ignored_mac]:
-            if not self._logDHCPAccess(mac):
-                self._logDiscardedPacket()
-                return
-                
-            if '.'.join(map(str, packet.getOption("server_identifier"))) == self._server_address: #Released!
-                ip = '.'.join(map(str, packet.getOption("ciaddr")))
-                result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
-                if result and result[0] == ip: #Known client.
-                    logging.writeLog('DHCPRELEASE from %(mac)s for %(ip)s' % {
-                     'ip': ip,
-                     'mac': mac,
-                    })
-                else:
-                    logging.writeLog('Misconfigured client %(mac)s sent DHCPRELEASE for %(ip)s' % {
-                     'ip': ip,
-                     'mac': mac,
-                    })
+        if '.'.join(map(str, packet.getOption("server_identifier"))) == self._server_address: #Released!
+            ip = '.'.join(map(str, packet.getOption("ciaddr")))
+            result = self._database.lookupMAC(mac) or config.handleUnknownMAC(mac)
+            if result and result[0] == ip: #Known client.
+                logging.writeLog('DHCPRELEASE from %(mac)s for %(ip)s' % {
+                 'ip': ip,
+                 'mac': mac,
+                })
             else:
-                self._logDiscardedPacket()
+                logging.writeLog('Misconfigured client %(mac)s sent DHCPRELEASE for %(ip)s' % {
+                 'ip': ip,
+                 'mac': mac,
+                })
         else:
             self._logDiscardedPacket()
         self._logTimeTaken(time.time() - start_time)
@@ -633,6 +852,44 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
             if not packet.setOption('ip_address_lease_time', longToList(int(lease_time))):
                 _logInvalidValue('lease_time', lease_time, subnet, serial)
                 
+        #Domain details.
+        if hostname:
+            if not packet.setOption('hostname', strToList(hostname)):
+                _logInvalidValue('hostname', hostname, subnet, serial)
+                
+        #Everything else is common to the subnet, so it's validated only once.
+        subnet_key = (
+         gateway, subnet_mask, broadcast_address,
+         domain_name, domain_name_servers, ntp_servers,
+         subnet, serial,
+        )
+        subnet_options = self._subnet_options.get(subnet_key)
+        if subnet_options is None:
+            subnet_options = self._buildSubnetOptions(subnet_key)
+            if len(self._subnet_options) >= _SUBNET_OPTIONS_CAPACITY:
+                self._subnet_options.clear()
+            self._subnet_options[subnet_key] = subnet_options
+        packet.loadOptions(subnet_options)
+        
+    def _buildSubnetOptions(self, subnet_key):
+        """
+        Validates the options shared by every client with the same subnet
+        details, logging any that are invalid.
+        
+        @type subnet_key: tuple(8)
+        @param subnet_key: (gateway, subnet_mask, broadcast_address,
+            domain_name, domain_name_servers, ntp_servers, subnet, serial), as
+            returned from the database.
+        
+        @rtype: tuple
+        @return: A collection of (name:str, value:list) pairs, suitable for
+            L{libpydhcpserver.dhcp_packet.DHCPPacket.loadOptions}.
+        """
+        (gateway, subnet_mask, broadcast_address,
+         domain_name, domain_name_servers, ntp_servers,
+         subnet, serial) = subnet_key
+        packet = libpydhcpserver.dhcp_packet.DHCPPacket()
+        
         #Default gateway, subnet mask, and broadcast address.
         if gateway:
             if not packet.setOption('router', ipToList(gateway)):
@@ -645,9 +902,6 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
                 _logInvalidValue('broadcast_address', broadcast_address, subnet, serial)
                 
         #Domain details.
-        if hostname:
-            if not packet.setOption('hostname', strToList(hostname)):
-                _logInvalidValue('hostname', hostname, subnet, serial)
         if domain_name:
             if not packet.setOption('domain_name', strToList(domain_name)):
                 _logInvalidValue('domain_name', domain_name, subnet, serial)
@@ -660,34 +914,59 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
             if not packet.setOption('ntp_servers', ipsToList(ntp_servers)):
                 _logInvalidValue('ntp_servers', ntp_servers, subnet, serial)
                 
-    def _logDHCPAccess(self, mac):
+        return tuple(
+         (name, tuple(packet.getOption(name))) for name in (
+          'router', 'subnet_mask', 'broadcast_address',
+          'domain_name', 'domain_name_servers', 'ntp_servers',
+         ) if packet.isOption(name)
+        )
+        
+    def _logDHCPAccess(self, mac, dhcp_message_type):
         """
-        Increments the number of times the given MAC address has accessed this
-        server. If the value exceeds the policy threshold, the MAC is ignored as
+        Takes a token from the given MAC address's bucket. If none is left, the
+        client has exceeded the policy threshold and the MAC is ignored as
         potentially belonging to a malicious user.
         
+        By default, a MAC may make SUSPEND_THRESHOLD requests at once and
+        SUSPEND_THRESHOLD requests per POLLING_INTERVAL thereafter; message
+        types listed in SUSPEND_RATES are tracked separately, at their own
+        rates.
+        
         @type mac: basestring
         @param mac: The MAC being evaluated.
+        @type dhcp_message_type: int
+        @param dhcp_message_type: The type of request being made.
         
         @rtype: bool
         @return: True if the MAC's request should be processed.
         """
         if config.ENABLE_SUSPEND:
-            with self._stats_lock:
-                assignments = self._dhcp_assignments.get(mac)
-                if not assignments:
-                    self._dhcp_assignments[mac] = 1
-                else:
-                    self._dhcp_assignments[mac] = assignments + 1
-                    if assignments + 1 > config.SUSPEND_THRESHOLD:
-                        logging.writeLog('%(mac)s issuing too many requests; ignoring for %(time)i seconds' % {
-                         'mac': mac,
-                         'time': config.MISBEHAVING_CLIENT_TIMEOUT,
-                        })
-                        self._ignored_addresses.append([mac, config.MISBEHAVING_CLIENT_TIMEOUT])
-                        return False
+            limit = self._mac_rates.get(dhcp_message_type)
+            if limit:
+                (rate, burst) = limit
+                key = (mac, dhcp_message_type)
+            else:
+                burst = float(config.SUSPEND_THRESHOLD)
+                rate = burst / config.POLLING_INTERVAL
+                key = mac
+            if not self._mac_limiter.consume(key, rate, burst):
+                logging.writeLog('%(mac)s issuing too many requests; ignoring for %(time)i seconds' % {
+                 'mac': mac,
+                 'time': config.MISBEHAVING_CLIENT_TIMEOUT,
+                })
+                self._ignored_addresses.ignore(mac, config.MISBEHAVING_CLIENT_TIMEOUT)
+                return False
         return True
         
+    def _logRejectedPacket(self):
+        """
+        Increments the number of packets processed and discarded, for packets
+        rejected before being handed off for processing.
+        """
+        with self._stats_lock:
+            self._packets_processed += 1
+            self._packets_discarded += 1
+            
     def _logDiscardedPacket(self):
         """
         Increments the number of packets discarded.
@@ -768,35 +1047,82 @@ class _DHCPServer(libpydhcpserver.dhcp_network.DHCPNetwork):
         Flushes the DHCP cache.
         """
         self._database.flushCache()
+        self._subnet_options = {}
         logging.writeLog("Flushed DHCP cache")
         
+    def getCacheStats(self):
+        """
+        Reports on the effectiveness of the database cache.
+        
+        @rtype: tuple(5)|None
+        @return: (entries:int, hits:int, misses:int, evictions:int,
+            expirations:int), or None if caching is disabled.
+        """
+        return self._database.getCacheStats()
+        
+    def getPoolStats(self):
+        """
+        Reports on the state of the database connection pool.
+        
+        @rtype: tuple(6)|None
+        @return: (open:int, idle:int, created:int, reused:int, discarded:int,
+            waits:int), or None if connections aren't pooled.
+        """
+        return self._database.getPoolStats()
+        
+    def getIgnoredMACs(self):
+        """
+        Lists all MACs currently being ignored.
+        
+        @rtype: tuple
+        @return: A collection of (mac:basestring, seconds_remaining:float)
+            values, soonest-expiring first.
+        """
+        return self._ignored_addresses.list()
+        
+    def unignoreMAC(self, mac):
+        """
+        Allows requests from an ignored MAC to be processed again immediately.
+        
+        @type mac: basestring
+        @param mac: The MAC to stop ignoring.
+        
+        @rtype: bool
+        @return: True if the MAC was being ignored.
+        """
+        return self._ignored_addresses.unignore(mac)
+        
     def getNextDHCPPacket(self):
         """
-        Listens for a DHCP packet and initiates processing upon receipt.
+        Listens for DHCP packets and initiates processing upon receipt.
         """
-        if self._getNextDHCPPacket():
+        received = self._getNextDHCPPacket()
+        if received:
             with self._stats_lock:
-                self._packets_processed += 1
+                self._packets_processed += received
                 
     def getStats(self):
         """
         Returns the performance statistics of all operations performed since the
-        last polling event, resets all counters, and updates the time left before
-        ignored MACs' requests will be processed again.
+        last polling event, resets all counters, and discards expired entries
+        from the list of ignored MACs.
+        
+        @rtype: tuple(6)
+        @return: (processed:int, discarded:int, time_taken:float,
+            ignored_macs:int, queue_depth:int, queue_overflowed:int)
         """
+        (queue_depth, queue_overflowed) = self._getWorkerStats()
+        ignored_macs = len(self._ignored_addresses)
         with self._stats_lock:
-            for i in range(len(self._ignored_addresses)):
-                self._ignored_addresses[i][1] -= config.POLLING_INTERVAL
-            self._ignored_addresses = [address for address in self._ignored_addresses if address[1] > 0]
-            
-            stats = (self._packets_processed, self._packets_discarded, self._time_taken, len(self._ignored_addresses))
+            stats = (
+             self._packets_processed, self._packets_discarded, self._time_taken, ignored_macs,
+             queue_depth, queue_overflowed,
+            )
             
             self._packets_processed = 0
             self._packets_discarded = 0
             self._time_taken = 0.0
-            if config.ENABLE_SUSPEND:
-                self._dhcp_assignments = {}
-                
+            
             return stats
             
             
@@ -806,10 +1132,14 @@ class DHCPService(threading.Thread):
     """
     _dhcp_server = None #: The handler that responds to DHCP requests.
     
-    def __init__(self):
+    def __init__(self, shard=None):
         """
         Sets up the DHCP server.
         
+        @type shard: tuple|NoneType
+        @param shard: (index:int, count:int) if this service is one of several
+            worker processes bound to the same ports.
+        
         @raise Exception: If a problem occurs while binding the sockets needed
             to handle DHCP traffic.
         """
@@ -820,7 +1150,8 @@ class DHCPService(threading.Thread):
          '.'.join([str(int(o)) for o in config.DHCP_SERVER_IP.split('.')]),
          int(config.DHCP_SERVER_PORT),
          int(config.DHCP_CLIENT_PORT),
-         config.PXE_PORT and int(config.PXE_PORT)
+         config.PXE_PORT and int(config.PXE_PORT),
+         shard=shard
         )
         _dhcp_servers.append(self._dhcp_server) #Add this server to the global list.
         
@@ -847,6 +1178,6 @@ class DHCPService(threading.Thread):
         Updates the performance statistics in the in-memory stats-log and
         implicitly updates the ignored MACs values.
         """
-        (processed, discarded, time_taken, ignored_macs) = self._dhcp_server.getStats()
-        logging.writePollRecord(processed, discarded, time_taken, ignored_macs)
+        (processed, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed) = self._dhcp_server.getStats()
+        logging.writePollRecord(processed, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed)
         
@@ -41,21 +41,45 @@ _POLL_RECORDS = [] #: The stats-log.
 _EMAIL_LOCK = threading.Lock() #: A lock used to synchronize access to the e-mail routines.
 _EMAIL_TIMEOUT = 0 #: The number of seconds left before another e-mail can be sent.
 
+_FORWARDER = None #: A callable that receives log and stats records in place of the in-memory logs, in worker processes.
+
 #Status-recording functions
-def writeLog(data):
+def setForwarder(forwarder):
+    """
+    Redirects all records that would be added to the memory-log or the
+    stats-log to the given callable, so that a worker process's events can be
+    collected by its parent.
+    
+    @type forwarder: callable|NoneType
+    @param forwarder: Invoked with (kind:basestring, record:tuple), where kind
+        is 'log' or 'poll' and record is what would have been stored;
+        NoneType restores normal behaviour.
+    """
+    global _FORWARDER
+    _FORWARDER = forwarder
+    
+def writeLog(data, timestamp=None):
     """
     Adds an entry to the memory-log.
     
     @type data: basestring
     @param data: The event to be logged.
+    @type timestamp: float|NoneType
+    @param timestamp: The time at which the event occurred, if not now.
     """
     global _LOG
     
+    timestamp = timestamp or time.time()
+    forwarder = _FORWARDER
+    if forwarder:
+        forwarder('log', (timestamp, data))
+        return
+        
     with _LOG_LOCK:
-        _LOG = [(time.time(), data)] + _LOG[:config.LOG_CAPACITY - 1]
+        _LOG = [(timestamp, data)] + _LOG[:config.LOG_CAPACITY - 1]
         if config.DEBUG:
             print '%(time)s : %(event)s' % {
-             'time': time.asctime(),
+             'time': time.asctime(time.localtime(timestamp)),
              'event': data,
             }
             
@@ -71,7 +95,7 @@ def readLog():
     with _LOG_LOCK:
         return tuple(_LOG)
         
-def writePollRecord(packets, discarded, time_taken, ignored_macs):
+def writePollRecord(packets, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed):
     """
     Adds statistics to the stats-log.
     
@@ -85,11 +109,23 @@ def writePollRecord(packets, discarded, time_taken, ignored_macs):
         non-ignored requests.
     @type ignored_macs: int
     @param ignored_macs: The number of MAC addresses being actively ignored.
+    @type queue_depth: int
+    @param queue_depth: The greatest number of packets waiting for a worker
+        thread at any one time.
+    @type queue_overflowed: int
+    @param queue_overflowed: The number of packets discarded because the
+        worker queue was full.
     """
     global _POLL_RECORDS
     
+    record = (time.time(), packets, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed)
+    forwarder = _FORWARDER
+    if forwarder:
+        forwarder('poll', record)
+        return
+        
     with _POLL_RECORDS_LOCK:
-        _POLL_RECORDS = [(time.time(), packets, discarded, time_taken, ignored_macs)] + _POLL_RECORDS[:config.POLL_INTERVALS_TO_TRACK - 1]
+        _POLL_RECORDS = [record] + _POLL_RECORDS[:config.POLL_INTERVALS_TO_TRACK - 1]
         
 def readPollRecords():
     """
@@ -98,8 +134,8 @@ def readPollRecords():
     @rtype: tuple
     @return: A collection of
         (timestamp:float, processed:int, discarded:int,
-        processing_time:float, ignored_macs:int) values, in reverse-chronological
-        order.
+        processing_time:float, ignored_macs:int, queue_depth:int,
+        queue_overflowed:int) values, in reverse-chronological order.
     """
     with _POLL_RECORDS_LOCK:
         return tuple(_POLL_RECORDS)
@@ -125,17 +161,19 @@ def logToDisk():
         log_file.write("Summary generated %(time)s\n" % {'time': time.asctime(),})
         
         log_file.write("\nStatistics:\n")
-        for (timestamp, packets, discarded, time_taken, ignored_macs) in readPollRecords():
+        for (timestamp, packets, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed) in readPollRecords():
             if packets:
                 turnaround = time_taken / packets
             else:
                 turnaround = 0.0
-            log_file.write("%(time)s : received: %(received)i; discarded: %(discarded)i; turnaround: %(turnaround)fs/pkt; ignored MACs: %(ignored)i\n" % {
+            log_file.write("%(time)s : received: %(received)i; discarded: %(discarded)i; turnaround: %(turnaround)fs/pkt; ignored MACs: %(ignored)i; queue peak: %(queue_depth)i; overflowed: %(queue_overflowed)i\n" % {
              'time': time.ctime(timestamp),
              'received': packets,
              'discarded': discarded,
              'turnaround': turnaround,
              'ignored': ignored_macs,
+             'queue_depth': queue_depth,
+             'queue_overflowed': queue_overflowed,
             })
             
         log_file.write("\nEvents:\n")
@@ -0,0 +1,98 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd module: ratelimit
+
+Purpose
+=======
+ Provides token-bucket rate-limiting for clients and relays.
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import collections
+import threading
+import time
+
+class RateLimiter(object):
+    """
+    A collection of token-buckets, one per key, each refilling continuously at
+    its own rate up to its own burst size.
+    
+    Buckets are spread across independently locked stripes, so that checks for
+    different keys rarely contend, and each stripe discards its least recently
+    used buckets when full; a discarded bucket starts over full, which only
+    ever errs in the client's favour.
+    """
+    _stripes = None #: (lock, buckets) pairs, where buckets is an OrderedDict of [tokens, timestamp] values, oldest first.
+    _stripe_capacity = None #: The number of buckets each stripe may hold.
+    
+    def __init__(self, capacity, stripes=16):
+        """
+        Sets up the rate-limiter.
+        
+        @type capacity: int
+        @param capacity: The number of buckets to track, across all stripes.
+        @type stripes: int
+        @param stripes: The number of independently locked partitions.
+        """
+        self._stripes = tuple((threading.Lock(), collections.OrderedDict()) for i in xrange(stripes))
+        self._stripe_capacity = max(1, capacity // stripes)
+        
+    def consume(self, key, rate, burst):
+        """
+        Takes a token from the given key's bucket, if one is available.
+        
+        @type key: hashable
+        @param key: The identity of the bucket.
+        @type rate: float
+        @param rate: The number of tokens added to the bucket per second.
+        @type burst: float
+        @param burst: The number of tokens the bucket can hold.
+        
+        @rtype: bool
+        @return: True if a token was available and the action may proceed.
+        """
+        now = time.time()
+        (lock, buckets) = self._stripes[hash(key) % len(self._stripes)]
+        with lock:
+            bucket = buckets.pop(key, None)
+            if bucket is None:
+                bucket = [burst, now]
+                if len(buckets) >= self._stripe_capacity:
+                    buckets.popitem(last=False)
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            buckets[key] = bucket
+            
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True
+            return False
+            
+    def clear(self):
+        """
+        Discards all buckets.
+        """
+        for (lock, buckets) in self._stripes:
+            with lock:
+                buckets.clear()
+                
+    def __len__(self):
+        return sum(len(buckets) for (lock, buckets) in self._stripes)
+        
@@ -116,17 +116,40 @@ class _WebServer(BaseHTTPServer.BaseHTTPRequestHandler):
             self.wfile.write('<div style="width: 950px; margin-left: auto; margin-right: auto; border: 1px solid black;">')
             
             self.wfile.write('<div>Statistics:<div style="text-size: 0.9em; margin-left: 20px;">')
-            for (timestamp, packets, discarded, time_taken, ignored_macs) in logging.readPollRecords():
+            for (timestamp, packets, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed) in logging.readPollRecords():
                 if packets:
                     turnaround = time_taken / packets
                 else:
                     turnaround = 0.0
-                self.wfile.write("%(time)s : received: %(received)i; discarded: %(discarded)i; turnaround: %(turnaround)fs/pkt; ignored MACs: %(ignored)i<br/>" % {
+                self.wfile.write("%(time)s : received: %(received)i; discarded: %(discarded)i; turnaround: %(turnaround)fs/pkt; ignored MACs: %(ignored)i; queue peak: %(queue_depth)i; overflowed: %(queue_overflowed)i<br/>" % {
                  'time': time.ctime(timestamp),
                  'received': packets,
                  'discarded': discarded,
                  'turnaround': turnaround,
                  'ignored': ignored_macs,
+                 'queue_depth': queue_depth,
+                 'queue_overflowed': queue_overflowed,
+                })
+            cache_stats = dhcp.getCacheStats()
+            if cache_stats:
+                (entries, hits, misses, evictions, expirations) = cache_stats
+                self.wfile.write("cache : entries: %(entries)i; hits: %(hits)i; misses: %(misses)i; evictions: %(evictions)i; expirations: %(expirations)i<br/>" % {
+                 'entries': entries,
+                 'hits': hits,
+                 'misses': misses,
+                 'evictions': evictions,
+                 'expirations': expirations,
+                })
+            pool_stats = dhcp.getPoolStats()
+            if pool_stats:
+                (size, idle, created, reused, discarded, waits) = pool_stats
+                self.wfile.write("pool : open: %(size)i; idle: %(idle)i; opened: %(created)i; reused: %(reused)i; discarded: %(discarded)i; waits: %(waits)i<br/>" % {
+                 'size': size,
+                 'idle': idle,
+                 'created': created,
+                 'reused': reused,
+                 'discarded': discarded,
+                 'waits': waits,
                 })
             self.wfile.write("</div></div><br/>")
             
@@ -150,7 +173,7 @@ class _WebServer(BaseHTTPServer.BaseHTTPRequestHandler):
             })
             self.wfile.write('<form action="/" method="post"><div style="display: inline;">')
             self.wfile.write('<label for="key">Key: </label><input type="password" name="key" id="key"/>')
-            if config.USE_CACHE:
+            if config.USE_CACHE or config.NEGATIVE_CACHE_TTL:
                 self.wfile.write('<input type="submit" value="Flush cache and write log to disk"/>')
             else:
                 self.wfile.write('<input type="submit" value="Write log to disk"/>')
@@ -0,0 +1,244 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd module: workers
+
+Purpose
+=======
+ Runs the DHCP server in several processes that share the same ports, so that
+ request-handling isn't confined to a single CPU core.
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import cPickle
+import os
+import signal
+import threading
+import time
+import traceback
+
+import config
+import dhcp
+import logging
+
+_workers = [] #: The (pid, pipe) of every worker process started.
+
+_stats_lock = threading.Lock() #: A lock used to ensure synchronous access to aggregated statistics.
+_totals = [0, 0, 0.0, 0, 0] #: (processed, discarded, time_taken, queue_depth, queue_overflowed) reported since the last polling interval.
+_ignored_macs = {} #: The number of MACs most recently reported as ignored by each worker.
+
+class _WorkerProxy(object):
+    """
+    Stands in for the DHCP servers running in worker processes, so that
+    L{dhcp.flushCache} reaches all of them.
+    """
+    def flushCache(self):
+        """
+        Instructs every worker to flush its DHCP cache.
+        """
+        signalWorkers(signal.SIGHUP)
+        
+    def getCacheStats(self):
+        """
+        Caches are private to each worker, so none are reported here.
+        
+        @rtype: None
+        @return: Nothing.
+        """
+        return None
+        
+    def getPoolStats(self):
+        """
+        Connection pools are private to each worker, so none are reported here.
+        
+        @rtype: None
+        @return: Nothing.
+        """
+        return None
+        
+    def getIgnoredMACs(self):
+        """
+        Ignore-lists are private to each worker, so none are reported here.
+        
+        @rtype: tuple
+        @return: An empty collection.
+        """
+        return ()
+        
+    def unignoreMAC(self, mac):
+        """
+        Ignore-lists are private to each worker, so none can be changed here.
+        
+        @type mac: basestring
+        @param mac: The MAC to stop ignoring.
+        
+        @rtype: bool
+        @return: False.
+        """
+        return False
+        
+def start(count):
+    """
+    Forks the given number of worker processes, each running its own
+    L{dhcp.DHCPService}, and begins collecting their logs and statistics.
+    
+    This must be called before any threads are started.
+    
+    @type count: int
+    @param count: The number of worker processes to run.
+    """
+    for index in range(count):
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if not pid: #This is the worker.
+            os.close(read_fd)
+            for (_, pipe) in _workers:
+                pipe.close()
+            try:
+                _runWorker(index, count, os.fdopen(write_fd, 'wb'))
+            except Exception, e:
+                traceback.print_exc()
+                logging.writeLog("DHCP worker %(index)i failed: %(error)s" % {
+                 'index': index,
+                 'error': str(e),
+                })
+            os._exit(1)
+        os.close(write_fd)
+        _workers.append((pid, os.fdopen(read_fd, 'rb')))
+        
+    for (index, (pid, pipe)) in enumerate(_workers):
+        relay_thread = threading.Thread(target=_relay, args=(index, pid, pipe))
+        relay_thread.daemon = True
+        relay_thread.start()
+    dhcp._dhcp_servers.append(_WorkerProxy())
+    
+def signalWorkers(signum):
+    """
+    Sends a signal to every worker process.
+    
+    @type signum: int
+    @param signum: The signal to send.
+    """
+    for (pid, _) in _workers:
+        try:
+            os.kill(pid, signum)
+        except OSError: #Already gone.
+            pass
+            
+def terminate():
+    """
+    Stops all worker processes.
+    """
+    signalWorkers(signal.SIGTERM)
+    
+def pollStats():
+    """
+    Writes the statistics reported by all workers since the last polling
+    interval to the stats-log as a single record.
+    """
+    global _totals
+    
+    with _stats_lock:
+        (processed, discarded, time_taken, queue_depth, queue_overflowed) = _totals
+        _totals = [0, 0, 0.0, 0, 0]
+        ignored_macs = sum(_ignored_macs.values())
+    logging.writePollRecord(processed, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed)
+    
+def _relay(index, pid, pipe):
+    """
+    Copies the log entries and statistics sent by a worker into this process's
+    logs until the worker exits.
+    
+    @type index: int
+    @param index: The worker's position in the pool.
+    @type pid: int
+    @param pid: The worker's process ID.
+    @type pipe: file
+    @param pipe: The end of the pipe from which the worker's records are read.
+    """
+    while True:
+        try:
+            (kind, record) = cPickle.load(pipe)
+        except (EOFError, IOError):
+            break
+            
+        if kind == 'log':
+            (timestamp, data) = record
+            logging.writeLog(data, timestamp=timestamp)
+        elif kind == 'poll':
+            (_, processed, discarded, time_taken, ignored_macs, queue_depth, queue_overflowed) = record
+            with _stats_lock:
+                _totals[0] += processed
+                _totals[1] += discarded
+                _totals[2] += time_taken
+                _totals[3] = max(_totals[3], queue_depth)
+                _totals[4] += queue_overflowed
+                _ignored_macs[index] = ignored_macs
+                
+    pipe.close()
+    try:
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+    with _stats_lock:
+        _ignored_macs.pop(index, None)
+    logging.writeLog("DHCP worker %(index)i (pid %(pid)i) exited" % {
+     'index': index,
+     'pid': pid,
+    })
+    
+def _runWorker(index, count, pipe):
+    """
+    Serves DHCP requests indefinitely, forwarding all log entries and
+    statistics to the parent process.
+    
+    @type index: int
+    @param index: The worker's position in the pool.
+    @type count: int
+    @param count: The number of workers in the pool.
+    @type pipe: file
+    @param pipe: The end of the pipe to which records are written.
+    """
+    pipe_lock = threading.Lock()
+    def forward(kind, record):
+        with pipe_lock:
+            cPickle.dump((kind, record), pipe, cPickle.HIGHEST_PROTOCOL)
+            pipe.flush()
+    logging.setForwarder(forward)
+    
+    signal.signal(signal.SIGHUP, lambda signum, frame: dhcp.flushCache())
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    
+    dhcp_thread = dhcp.DHCPService(shard=(index, count))
+    dhcp_thread.start()
+    
+    os.setregid(config.GID, config.GID)
+    os.setreuid(config.UID, config.UID)
+    
+    parent = os.getppid()
+    tick = 0
+    while os.getppid() == parent: #Stop if the parent dies.
+        time.sleep(1)
+        
+        tick += 1
+        if tick >= config.POLLING_INTERVAL:
+            dhcp_thread.pollStats()
+            logging.emailTimeoutCooldown() #Workers send their own error reports.
+            tick = 0
+    os._exit(0)
+    
@@ -0,0 +1,37 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: _environment
+
+Purpose
+=======
+ Prepares the interpreter for staticDHCPd's tests: the package is imported
+ from this source tree and configured from tests/conf/conf.py. Every test
+ module imports this first.
+
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import os
+import sys
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__)) #: The directory holding the tests and their conf/.
+
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+os.chdir(TESTS_PATH) #staticdhcpd.config reads conf/conf.py from the working directory.
@@ -0,0 +1,24 @@
+#The configuration used by staticDHCPd's tests; anything omitted takes the
+#defaults in staticdhcpd/config.py. Tests change settings on the config module
+#itself, as needed.
+
+#General settings
+#######################################
+DEBUG = False
+DAEMON = False
+SYSTEM_NAME = 'staticDHCPd-tests'
+LOG_FILE = '/dev/null'
+LOG_FILE_TIMESTAMP = False
+PID_FILE = '/dev/null'
+
+#Server settings
+#######################################
+DHCP_SERVER_IP = '127.0.0.1'
+DHCP_SERVER_PORT = 16767
+DHCP_CLIENT_PORT = 16768
+WEB_ENABLED = False
+
+#Database settings
+#######################################
+DATABASE_ENGINE = 'SQLite'
+SQLITE_FILE = ':memory:'
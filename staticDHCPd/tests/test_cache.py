@@ -0,0 +1,155 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: databases._cache
+
+Purpose
+=======
+ Exercises the caches' eviction, expiry, and counters.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import unittest
+
+from staticdhcpd.databases import _cache
+
+class _Clock(object):
+    """
+    Stands in for the time module, so that entries expire on demand.
+    """
+    now = 1000.0 #: The current time.
+    
+    def time(self):
+        return self.now
+        
+class _CacheTests(object):
+    """
+    Tests shared by every eviction policy.
+    """
+    policy = None #: The policy under test.
+    
+    def setUp(self):
+        self.clock = _Clock()
+        self._time = _cache.time
+        _cache.time = self.clock
+        
+    def tearDown(self):
+        _cache.time = self._time
+        
+    def test_hitsAndMisses(self):
+        cache = _cache.get_cache(self.policy, 4, None)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.getStats(), (1, 2, 1, 0, 0))
+        
+    def test_expiryCountedOnce(self):
+        cache = _cache.get_cache(self.policy, 4, 10)
+        cache.put('a', 1)
+        self.clock.now += 11
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.getStats(), (0, 0, 2, 0, 1))
+        
+        cache.put('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(cache.getStats(), (1, 1, 2, 0, 1))
+        
+    def test_evictions(self):
+        cache = _cache.get_cache(self.policy, 2, None)
+        for (i, key) in enumerate('abc'):
+            cache.put(key, i)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c'), 2)
+        self.assertEqual(cache.getStats()[3], 1)
+        
+    def test_expiredVictim(self):
+        #An entry that had expired when it was displaced is an expiration.
+        cache = _cache.get_cache(self.policy, 1, 10)
+        cache.put('a', 1)
+        self.clock.now += 11
+        cache.put('b', 2)
+        self.assertEqual(cache.getStats(), (1, 0, 0, 0, 1))
+        
+    def test_removedEntriesFreeCapacity(self):
+        #Entries that expired or were discarded don't crowd out live ones,
+        #wherever they were.
+        cache = _cache.get_cache(self.policy, 4, 10)
+        for (i, key) in enumerate('abcd'):
+            cache.put(key, i)
+        self.clock.now += 6
+        cache.put('a', 0) #Renewed.
+        cache.put('b', 1)
+        self.clock.now += 5
+        self.assertEqual(cache.get('c'), None)
+        self.assertEqual(cache.get('d'), None)
+        cache.put('e', 4)
+        cache.put('f', 5)
+        cache.discard('e')
+        cache.put('g', 6)
+        self.assertEqual(len(cache), 4)
+        for (key, value) in (('a', 0), ('b', 1), ('f', 5), ('g', 6)):
+            self.assertEqual(cache.get(key), value)
+        self.assertEqual(cache.getStats()[3:], (0, 2))
+        
+    def test_recencyRespected(self):
+        cache = _cache.get_cache(self.policy, 2, None)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        
+    def test_discardAndClear(self):
+        cache = _cache.get_cache(self.policy, 4, None)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.discard('a')
+        self.assertEqual(cache.get('a'), None)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('c'), 3)
+        
+    def test_unbounded(self):
+        cache = _cache.get_cache(self.policy, None, None)
+        for i in xrange(100):
+            cache.put(i, i)
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.getStats()[3], 0)
+        
+class LRUCacheTests(_CacheTests, unittest.TestCase):
+    policy = 'LRU'
+    
+class ClockCacheTests(_CacheTests, unittest.TestCase):
+    policy = 'CLOCK'
+    
+class GetCacheTests(unittest.TestCase):
+    def test_unknownPolicy(self):
+        self.assertRaises(ValueError, _cache.get_cache, 'MRU', 4, None)
+        
+if __name__ == '__main__':
+    unittest.main()
+    
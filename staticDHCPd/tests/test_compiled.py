@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: databases._compiled
+
+Purpose
+=======
+ Exercises the loading of compiled binding tables, intact and damaged.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from staticdhcpd import config
+from staticdhcpd.databases import _compiled
+
+_BINDINGS = (
+ ('00:00:00:00:00:01', ('192.168.1.101', 'one', '192.168.1.1', '255.255.255.0', None, 'example.org', None, None, 3600, '192.168.1.0/24', 0)),
+ ('00:00:00:00:00:02', ('192.168.1.102', None, '192.168.1.1', '255.255.255.0', None, 'example.org', None, None, 3600, '192.168.1.0/24', 0)),
+ ('00:00:00:00:00:03', ('10.0.0.3', 'three', None, None, None, None, None, None, 7200, '10.0.0.0/8', 1)),
+) #: The bindings compiled, sorted by MAC.
+
+class CompiledTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._file = config.COMPILED_FILE
+        config.COMPILED_FILE = os.path.join(self.directory, 'dhcp.compiled')
+        _compiled.write_compiled(config.COMPILED_FILE, _BINDINGS)
+        with open(config.COMPILED_FILE, 'rb') as input:
+            self.data = input.read()
+        (magic, bindings, subnets, self.strings_offset) = _compiled._HEADER.unpack_from(self.data)
+        
+    def tearDown(self):
+        config.COMPILED_FILE = self._file
+        shutil.rmtree(self.directory)
+        
+    def _write(self, data):
+        #Replaced, rather than overwritten, as by write_compiled(), so that
+        #a mapped predecessor is unaffected.
+        with open(config.COMPILED_FILE + '.tmp', 'wb') as output:
+            output.write(data)
+        os.rename(config.COMPILED_FILE + '.tmp', config.COMPILED_FILE)
+        
+    def _patchBinding(self, index, hostname=None, subnet=None):
+        """
+        Replaces a binding's string or subnet reference in the compiled data.
+        """
+        offset = _compiled._HEADER.size + index * _compiled._BINDING.size
+        (mac, ip, old_hostname, old_subnet) = _compiled._BINDING.unpack_from(self.data, offset)
+        if hostname is None:
+            hostname = old_hostname
+        if subnet is None:
+            subnet = old_subnet
+        record = _compiled._BINDING.pack(mac, ip, hostname, subnet)
+        return self.data[:offset] + record + self.data[offset + len(record):]
+        
+    def test_load(self):
+        broker = _compiled.Compiled()
+        for (mac, details) in _BINDINGS:
+            self.assertEqual(broker._lookupMAC(mac), details)
+        self.assertEqual(broker._lookupMAC('00:00:00:00:00:04'), None)
+        self.assertEqual(list(broker._lookupAllMACs()), list(_BINDINGS))
+        
+    def test_damaged(self):
+        for data in (
+         self.data[:-3], #Truncated within the last string.
+         self.data[:self.strings_offset], #Without its strings.
+         self._patchBinding(2, subnet=2), #Only two subnets are defined.
+         self._patchBinding(0, hostname=len(self.data)), #Beyond the end of the file.
+        ):
+            self._write(data)
+            self.assertRaises(ValueError, _compiled.Compiled)
+            
+    def test_damagedReplacement(self):
+        #A damaged replacement leaves the previous file in service.
+        broker = _compiled.Compiled()
+        self._write(self._patchBinding(1, subnet=7))
+        broker.flushCache()
+        for (mac, details) in _BINDINGS:
+            self.assertEqual(broker._lookupMAC(mac), details)
+            
+if __name__ == '__main__':
+    unittest.main()
+    
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: DHCP pre-filtering
+
+Purpose
+=======
+ Exercises the checks applied to received datagrams before they are parsed.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import struct
+import threading
+import unittest
+
+from staticdhcpd import config
+from staticdhcpd import ratelimit
+from staticdhcpd.dhcp import _DHCPServer, _IgnoreTable
+
+_MAC = '00:16:3e:0a:0b:0c' #: The MAC of the client with an Ethernet address.
+_LEASEQUERY = '\x35\x01\x0a\xff' #: The options of a DHCPLEASEQUERY.
+
+def _datagram(hlen=6, options=_LEASEQUERY):
+    """
+    Assembles a raw BOOTREQUEST from an unaddressed client.
+    """
+    header = struct.pack('!BBBBIHH4s4s4s4s16s64s128s',
+     1, 1, hlen, 0, 0x12345678, 0, 0,
+     '\x00' * 4, '\x00' * 4, '\x00' * 4, '\x00' * 4,
+     hlen and '\x00\x16\x3e\x0a\x0b\x0c' or '', '', '',
+    )
+    return header + '\x63\x82\x53\x63' + options
+    
+class FilterTests(unittest.TestCase):
+    def setUp(self):
+        self.server = _DHCPServer.__new__(_DHCPServer) #Without sockets or a database.
+        self.server._stats_lock = threading.Lock()
+        self.server._ignored_addresses = _IgnoreTable()
+        self.server._mac_limiter = ratelimit.RateLimiter(16)
+        self.server._mac_rates = {}
+        self.server._relay_limiter = ratelimit.RateLimiter(16)
+        
+    def _filter(self, data):
+        return self.server._filterDHCPPacket(data, ('0.0.0.0', 68), False)
+        
+    def test_ethernet(self):
+        self.assertTrue(self._filter(_datagram()))
+        self.server._ignored_addresses.ignore(_MAC, 60)
+        self.assertFalse(self._filter(_datagram()))
+        self.assertEqual(self.server._packets_discarded, 1)
+        
+    def test_noHardwareAddress(self):
+        #A packet without an Ethernet address, like an IP-based LEASEQUERY,
+        #isn't sharded, ignored, or rate-limited by MAC, but still reaches the
+        #handlers.
+        self.server._shard = (1, 2)
+        self.server._ignored_addresses.ignore('00:00:00:00:00:00', 60)
+        for i in xrange(int(config.SUSPEND_THRESHOLD) * 2):
+            self.assertTrue(self._filter(_datagram(hlen=0)))
+        self.assertEqual(len(self.server._mac_limiter), 0)
+        self.assertEqual(self.server._packets_discarded, 0)
+        
+if __name__ == '__main__':
+    unittest.main()
+    
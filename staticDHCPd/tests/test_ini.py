@@ -0,0 +1,252 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: databases._ini
+
+Purpose
+=======
+ Exercises the INI broker's binding table, its reader, which is checked
+ against ConfigParser.RawConfigParser, and its reloading.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import ConfigParser
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from staticdhcpd import config
+from staticdhcpd.databases._ini import INI, _BindingTableBuilder, _read_sections
+
+_SAMPLE = os.path.join(os.path.dirname(_environment.TESTS_PATH), 'samples', 'dhcp.ini') #: The sample INI file.
+
+_SUBNETS = {
+ ('192.168.1.0/24', 0): ('192.168.1.1', '255.255.255.0', None, 'example.org', None, None, 3600, '192.168.1.0/24', 0),
+ ('10.0.0.0/8', 1): (None, None, None, None, None, None, 7200, '10.0.0.0/8', 1),
+} #: The details of every subnet, as held by the table.
+
+def _build(*bindings):
+    builder = _BindingTableBuilder()
+    for binding in bindings:
+        builder.add(*binding)
+    return builder.build(_SUBNETS)
+    
+class BindingTableTests(unittest.TestCase):
+    def test_lookup(self):
+        table = _build(
+         ('00:00:00:00:00:01', '192.168.1.101', 'one', ('192.168.1.0/24', 0)),
+         ('ff:ff:ff:ff:ff:ff', '10.0.0.2', None, ('10.0.0.0/8', 1)),
+        )
+        self.assertEqual(table.lookup('00:00:00:00:00:01'), ('192.168.1.101', 'one') + _SUBNETS[('192.168.1.0/24', 0)])
+        self.assertEqual(table.lookup('ff:ff:ff:ff:ff:ff'), ('10.0.0.2', None) + _SUBNETS[('10.0.0.0/8', 1)])
+        self.assertEqual(table.lookup('FF:FF:FF:FF:FF:FF'), table.lookup('ff:ff:ff:ff:ff:ff'))
+        self.assertEqual(table.lookup('00:00:00:00:00:02'), None)
+        self.assertEqual(table.lookup('not a MAC'), None)
+        
+    def test_repeatedMAC(self):
+        #The last binding of a MAC prevails.
+        table = _build(
+         ('00:00:00:00:00:01', '192.168.1.101', 'one', ('192.168.1.0/24', 0)),
+         ('00:00:00:00:00:01', '10.0.0.1', 'two', ('10.0.0.0/8', 1)),
+        )
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.lookup('00:00:00:00:00:01')[:2], ('10.0.0.1', 'two'))
+        
+    def test_collisions(self):
+        #MACs that share their low bits probe past one another.
+        macs = ['%02x:00:00:00:00:01' % i for i in xrange(64)]
+        table = _build(*[(mac, '10.0.0.%i' % i, None, ('10.0.0.0/8', 1)) for (i, mac) in enumerate(macs)])
+        self.assertEqual(len(table), 64)
+        for (i, mac) in enumerate(macs):
+            self.assertEqual(table.lookup(mac)[0], '10.0.0.%i' % i)
+        self.assertEqual(table.lookup('40:00:00:00:00:01'), None)
+        self.assertEqual(sorted(mac for (mac, details) in table), macs)
+        
+    def test_compare(self):
+        previous = _build(
+         ('00:00:00:00:00:01', '192.168.1.101', None, ('192.168.1.0/24', 0)),
+         ('00:00:00:00:00:02', '192.168.1.102', None, ('192.168.1.0/24', 0)),
+         ('00:00:00:00:00:03', '192.168.1.103', None, ('192.168.1.0/24', 0)),
+        )
+        table = _build(
+         ('00:00:00:00:00:01', '192.168.1.101', None, ('192.168.1.0/24', 0)),
+         ('00:00:00:00:00:02', '192.168.1.202', None, ('192.168.1.0/24', 0)),
+         ('00:00:00:00:00:04', '192.168.1.104', None, ('192.168.1.0/24', 0)),
+        )
+        self.assertEqual(table.compare(previous), (1, 1, 1))
+        
+    def test_unknownSubnet(self):
+        builder = _BindingTableBuilder()
+        builder.add('00:00:00:00:00:01', '192.168.1.101', None, ('172.16.0.0/12', 0))
+        self.assertRaises(ValueError, builder.build, _SUBNETS)
+        
+    def test_invalidIP(self):
+        self.assertRaises(ValueError, _BindingTableBuilder().add, '00:00:00:00:00:01', '192.168.1.x', None, ('192.168.1.0/24', 0))
+        
+class ReadSectionsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def _write(self, text):
+        path = os.path.join(self.directory, 'dhcp.ini')
+        with open(path, 'w') as output:
+            output.write(text)
+        return path
+        
+    def _read(self, path):
+        with open(path) as input:
+            return list(_read_sections(input))
+            
+    def _readRaw(self, path):
+        reader = ConfigParser.RawConfigParser()
+        reader.read(path)
+        return [(section, dict(reader.items(section))) for section in reader.sections()]
+        
+    def _assertAgreement(self, path):
+        sections = self._read(path)
+        self.assertTrue(sections)
+        self.assertEqual(sections, self._readRaw(path))
+        
+    def test_sample(self):
+        self._assertAgreement(_SAMPLE)
+        
+    def test_syntax(self):
+        self._assertAgreement(self._write(
+         "# comment\n"
+         "; comment\n"
+         "rem remark\n"
+         "REM remark\n"
+         "[DEFAULT]\n"
+         "lease-time = 100\n"
+         "\n"
+         "[net|3]\n"
+         "Lease-Time : 7200\n"
+         "gateway=10.0.0.1 ; inline comment\n"
+         "subnet-mask: 255.0.0.0;not a comment\n"
+         "domain-name: \"\"\n"
+         "ntp-servers: 10.0.0.5,\n"
+         "  10.0.0.6\n"
+         "\t10.0.0.7\n"
+         "   \n"
+         "domain-name-servers:\n"
+         "# comment between options\n"
+         "; comment between options\n"
+         "broadcast-address: 10.255.255.255\n"
+         "[0800272C494B]   trailing text\n"
+         "ip: 10.0.0.9\n"
+         "hostname = host=name: x\n"
+         "remark: not a comment\n"
+        ))
+        
+    def test_repeatedSection(self):
+        #RawConfigParser merges a repeated section into its predecessor; the
+        #reader replaces it.
+        path = self._write(
+         "[08:00:27:2c:49:4b]\n"
+         "ip: 10.0.0.1\n"
+         "hostname: one\n"
+         "[08:00:27:2c:49:4c]\n"
+         "ip: 10.0.0.2\n"
+         "[08:00:27:2c:49:4b]\n"
+         "ip: 10.0.0.3\n"
+        )
+        self.assertEqual(self._readRaw(path), [
+         ('08:00:27:2c:49:4b', {'ip': '10.0.0.3', 'hostname': 'one'}),
+         ('08:00:27:2c:49:4c', {'ip': '10.0.0.2'}),
+        ])
+        self.assertEqual(self._read(path), [
+         ('08:00:27:2c:49:4b', {'ip': '10.0.0.1', 'hostname': 'one'}),
+         ('08:00:27:2c:49:4c', {'ip': '10.0.0.2'}),
+         ('08:00:27:2c:49:4b', {'ip': '10.0.0.3'}),
+        ])
+        
+    def test_lateDefaults(self):
+        #RawConfigParser applies [DEFAULT] to every section; the reader, only
+        #to those that follow it.
+        path = self._write(
+         "[net|0]\n"
+         "gateway: 10.0.0.1\n"
+         "[DEFAULT]\n"
+         "lease-time: 3600\n"
+         "[net|1]\n"
+         "gateway: 10.0.0.2\n"
+        )
+        self.assertEqual(self._readRaw(path), [
+         ('net|0', {'gateway': '10.0.0.1', 'lease-time': '3600'}),
+         ('net|1', {'gateway': '10.0.0.2', 'lease-time': '3600'}),
+        ])
+        self.assertEqual(self._read(path), [
+         ('net|0', {'gateway': '10.0.0.1'}),
+         ('net|1', {'gateway': '10.0.0.2', 'lease-time': '3600'}),
+        ])
+        
+    def test_malformed(self):
+        for text in ("ip: 10.0.0.1\n", "[net|0]\nnot an option\n", "[net|0]\n  continuation\n"):
+            path = self._write(text)
+            self.assertRaises(ConfigParser.Error, self._readRaw, path)
+            self.assertRaises(ValueError, self._read, path)
+            
+class _BlockingINI(INI):
+    """
+    A broker whose first reload blocks until released.
+    """
+    def __init__(self):
+        self.reloads = 0
+        self.reloading = threading.Event()
+        self.reloaded = threading.Event()
+        self.release = threading.Event()
+        INI.__init__(self)
+        
+    def _reload(self):
+        self.reloads += 1
+        self.reloading.set()
+        self.release.wait()
+        if self.reloads > 1:
+            self.reloaded.set()
+            
+class ReloadTests(unittest.TestCase):
+    def setUp(self):
+        self._settings = (config.INI_FILE, config.INI_WATCH)
+        config.INI_FILE = _SAMPLE
+        config.INI_WATCH = False
+        
+    def tearDown(self):
+        (config.INI_FILE, config.INI_WATCH) = self._settings
+        
+    def test_flushDuringReload(self):
+        #A flush requested while a reload is under way causes another.
+        broker = _BlockingINI()
+        broker.flushCache()
+        self.assertTrue(broker.reloading.wait(5))
+        broker.flushCache()
+        broker.release.set()
+        self.assertTrue(broker.reloaded.wait(5))
+        self.assertEqual(broker.reloads, 2)
+        
+if __name__ == '__main__':
+    unittest.main()
+    
@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: database lookups
+
+Purpose
+=======
+ Exercises the sharing of concurrent lookups between threads.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import threading
+import time
+import unittest
+
+from staticdhcpd.databases._generic import Database
+
+_DETAILS = ('192.168.1.101', 'one', None, None, None, None, None, None, 3600, '192.168.1.0/24', 0) #: The details of every MAC.
+
+class _Broker(Database):
+    """
+    A broker whose lookups block until released.
+    """
+    def __init__(self):
+        self.queries = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._setupBroker(4)
+        
+    def _lookupMAC(self, mac):
+        self.queries.append(mac)
+        self.started.set()
+        self.release.wait()
+        return _DETAILS
+        
+class _UncoalescedBroker(_Broker):
+    _coalesce = False
+    
+class CoalescingTests(unittest.TestCase):
+    def _lookUp(self, broker, count):
+        """
+        Starts count threads looking up the same MAC, returning them and the
+        list into which they place their results.
+        """
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(broker.lookupMAC('00:00:00:00:00:01'))) for i in xrange(count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return (threads, results)
+        
+    def _finish(self, broker, threads):
+        broker.release.set()
+        for thread in threads:
+            thread.join(5)
+            
+    def test_shared(self):
+        broker = _Broker()
+        (threads, leader_results) = self._lookUp(broker, 1)
+        self.assertTrue(broker.started.wait(5))
+        #Nobody is waiting yet, so there's no event to signal.
+        self.assertEqual(broker._inflight['00:00:00:00:00:01'][0], None)
+        
+        (followers, follower_results) = self._lookUp(broker, 1)
+        threads.extend(followers)
+        while broker._inflight['00:00:00:00:00:01'][0] is None: #Created by the follower, which then waits.
+            time.sleep(0.001)
+        self._finish(broker, threads)
+        
+        self.assertEqual(broker.queries, ['00:00:00:00:00:01'])
+        self.assertEqual(leader_results + follower_results, [_DETAILS] * 2)
+        self.assertEqual(broker._inflight, {})
+        
+    def test_uncoalesced(self):
+        broker = _UncoalescedBroker()
+        (threads, results) = self._lookUp(broker, 3)
+        while len(broker.queries) < 3:
+            time.sleep(0.001)
+        self.assertEqual(broker._inflight, {})
+        self._finish(broker, threads)
+        self.assertEqual(results, [_DETAILS] * 3)
+        
+    def test_inMemoryBrokers(self):
+        from staticdhcpd.databases._ini import INI
+        from staticdhcpd.databases._compiled import Compiled
+        self.assertFalse(INI._coalesce)
+        self.assertFalse(Compiled._coalesce)
+        
+if __name__ == '__main__':
+    unittest.main()
+    
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: databases._sql connection pooling
+
+Purpose
+=======
+ Exercises the lending and setup of pooled connections.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import unittest
+
+from staticdhcpd.databases._sql import _ConnectionPool
+
+class _Connection(object):
+    """
+    A connection that records whether it was closed.
+    """
+    closed = False #: Whether the connection was closed.
+    
+    def close(self):
+        self.closed = True
+        
+class _Connector(object):
+    """
+    Opens connections, failing after a set number.
+    """
+    def __init__(self, limit=None):
+        self.connections = []
+        self.limit = limit
+        
+    def __call__(self):
+        if self.limit is not None and len(self.connections) >= self.limit:
+            raise IOError("database unavailable")
+        connection = _Connection()
+        self.connections.append(connection)
+        return connection
+        
+class ConnectionPoolTests(unittest.TestCase):
+    def _pool(self, connect, minimum=3, maximum=4):
+        return _ConnectionPool(connect, "SELECT 1", minimum, maximum, 60, 0, 60)
+        
+    def test_setup(self):
+        connect = _Connector()
+        pool = self._pool(connect)
+        self.assertEqual(len(connect.connections), 3)
+        self.assertFalse([connection for connection in connect.connections if connection.closed])
+        self.assertEqual(pool.getStats()[:3], (3, 3, 3))
+        
+    def test_failedSetup(self):
+        #The connections opened before the failure are closed, not leaked.
+        connect = _Connector(limit=2)
+        self.assertRaises(IOError, self._pool, connect)
+        self.assertEqual(len(connect.connections), 2)
+        self.assertTrue(all(connection.closed for connection in connect.connections))
+        
+    def test_reuse(self):
+        connect = _Connector()
+        pool = self._pool(connect, minimum=1)
+        connection = pool.get()
+        connection.close()
+        connection = pool.get()
+        connection.close()
+        self.assertEqual(len(connect.connections), 1)
+        self.assertEqual(pool.getStats()[2:4], (1, 2))
+        
+if __name__ == '__main__':
+    unittest.main()
+    
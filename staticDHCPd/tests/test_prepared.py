@@ -0,0 +1,113 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: PostgreSQL prepared statements
+
+Purpose
+=======
+ Exercises the fallback from prepared statements to plain queries.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import unittest
+
+from staticdhcpd.databases._sql import PostgreSQL
+
+class _ProgrammingError(Exception):
+    """
+    Stands in for psycopg2's ProgrammingError, carrying a SQLSTATE.
+    """
+    def __init__(self, pgcode):
+        Exception.__init__(self, pgcode)
+        self.pgcode = pgcode
+        
+class _Module(object):
+    """
+    Stands in for psycopg2.
+    """
+    ProgrammingError = _ProgrammingError
+    
+class _Cursor(object):
+    def __init__(self, connection):
+        self._connection = connection
+        
+    def execute(self, query, parameters=()):
+        self._connection.queries.append(query.split()[0])
+        if self._connection.errors:
+            error = self._connection.errors.pop(0)
+            if error:
+                raise _ProgrammingError(error)
+                
+    def fetchall(self):
+        return []
+        
+    def close(self):
+        pass
+        
+class _Connection(object):
+    """
+    A pooled connection whose statements fail with the given SQLSTATEs, in
+    turn; None lets a statement succeed.
+    """
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.queries = []
+        self.state = {}
+        
+    def cursor(self):
+        return _Cursor(self)
+        
+class PreparedStatementTests(unittest.TestCase):
+    def setUp(self):
+        self.broker = PostgreSQL.__new__(PostgreSQL) #psycopg2 need not be installed.
+        self.broker._module = _Module
+        
+    def test_prepared(self):
+        db = _Connection()
+        self.broker._executeLookup(db, '00:00:00:00:00:01')
+        self.broker._executeLookup(db, '00:00:00:00:00:01')
+        self.assertEqual(db.queries, ['PREPARE', 'EXECUTE', 'EXECUTE'])
+        self.assertTrue(self.broker._prepare)
+        
+    def test_otherErrorsRaised(self):
+        #A syntax error doesn't disable prepared statements, but the
+        #statement is prepared again on the next use.
+        db = _Connection(None, '42601')
+        self.assertRaises(_ProgrammingError, self.broker._executeLookup, db, '00:00:00:00:00:01')
+        self.assertTrue(self.broker._prepare)
+        self.assertFalse('prepared' in db.state)
+        
+        self.broker._executeLookup(db, '00:00:00:00:00:01')
+        self.assertEqual(db.queries, ['PREPARE', 'EXECUTE', 'PREPARE', 'EXECUTE'])
+        
+    def test_unsupported(self):
+        for pgcode in ('26000', '0A000'):
+            self.broker._prepare = True
+            db = _Connection(None, pgcode)
+            self.broker._executeLookup(db, '00:00:00:00:00:01')
+            self.assertFalse(self.broker._prepare)
+            self.assertFalse('prepared' in db.state)
+            self.assertEqual(db.queries, ['PREPARE', 'EXECUTE', 'SELECT'])
+            
+if __name__ == '__main__':
+    unittest.main()
+    
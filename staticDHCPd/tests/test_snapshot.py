@@ -0,0 +1,172 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: database snapshots
+
+Purpose
+=======
+ Exercises incremental snapshot refreshes against a SQLite database built from
+ samples/sqlite.sql, including changes committed out of order.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from staticdhcpd import config
+from staticdhcpd.databases import _generic
+from staticdhcpd.databases._sql import SQLite
+
+_SCHEMA = os.path.join(os.path.dirname(_environment.TESTS_PATH), 'samples', 'sqlite.sql') #: The sample schema, with its changelog triggers.
+
+_SETTINGS = {
+ 'USE_CACHE': False,
+ 'USE_SNAPSHOT': False, #The tests load and patch the snapshot themselves, without a refresh thread.
+ 'SNAPSHOT_INCREMENTAL': True,
+ 'SNAPSHOT_CHANGELOG_WINDOW': 60,
+} #: The configuration under which the broker is built.
+
+class _Clock(object):
+    """
+    Stands in for the time module, so that the changelog window can pass on
+    demand.
+    """
+    now = 1000.0 #: The current time.
+    
+    def time(self):
+        return self.now
+        
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'dhcp.sqlite3')
+        self.connection = sqlite3.connect(path)
+        with open(_SCHEMA) as schema:
+            self.connection.executescript(schema.read())
+        self.connection.execute("INSERT INTO subnets VALUES ('192.168.1.0/24', 0, 3600, '192.168.1.1', '255.255.255.0', '192.168.1.255', NULL, '192.168.1.2', 'example.org')")
+        self.connection.execute("INSERT INTO maps VALUES ('00:00:00:00:00:01', '192.168.1.101', 'one', '192.168.1.0/24', 0)")
+        self.connection.execute("INSERT INTO maps VALUES ('00:00:00:00:00:02', '192.168.1.102', 'two', '192.168.1.0/24', 0)")
+        self.connection.commit()
+        
+        self.clock = _Clock()
+        self._time = _generic.time
+        _generic.time = self.clock
+        
+        self._settings = dict((name, getattr(config, name)) for name in _SETTINGS)
+        self._file = config.SQLITE_FILE
+        for (name, value) in _SETTINGS.iteritems():
+            setattr(config, name, value)
+        config.SQLITE_FILE = path
+        self.broker = SQLite()
+        self.broker._loadSnapshot()
+        
+    def tearDown(self):
+        _generic.time = self._time
+        for (name, value) in self._settings.iteritems():
+            setattr(config, name, value)
+        config.SQLITE_FILE = self._file
+        self.connection.close()
+        shutil.rmtree(self.directory)
+        
+    def _execute(self, *statements):
+        for statement in statements:
+            self.connection.execute(statement)
+        self.connection.commit()
+        
+    def test_load(self):
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:01'), (
+         '192.168.1.101', 'one', '192.168.1.1', '255.255.255.0', '192.168.1.255',
+         'example.org', '192.168.1.2', None, 3600, '192.168.1.0/24', 0,
+        ))
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:03'), None)
+        
+    def test_insertUpdateDelete(self):
+        self._execute(
+         "INSERT INTO maps VALUES ('00:00:00:00:00:03', '192.168.1.103', 'three', '192.168.1.0/24', 0)",
+         "UPDATE maps SET ip = '192.168.1.201' WHERE mac = '00:00:00:00:00:01'",
+         "DELETE FROM maps WHERE mac = '00:00:00:00:00:02'",
+        )
+        self.assertEqual(self.broker._patchSnapshot(), 4) #The update logs the MAC twice.
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:03')[:2], ('192.168.1.103', 'three'))
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:01')[0], '192.168.1.201')
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:02'), None)
+        
+        #Re-reading the window changes nothing and counts nothing new.
+        self.assertEqual(self.broker._patchSnapshot(), 0)
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:01')[0], '192.168.1.201')
+        
+    def test_renamedMAC(self):
+        self._execute("UPDATE maps SET mac = '00:00:00:00:00:09' WHERE mac = '00:00:00:00:00:01'")
+        self.broker._patchSnapshot()
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:01'), None)
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:09')[0], '192.168.1.101')
+        
+    def test_subnetEdit(self):
+        self._execute("UPDATE subnets SET lease_time = 7200, gateway = '192.168.1.254' WHERE subnet = '192.168.1.0/24'")
+        self.assertEqual(self.broker._patchSnapshot(), 2)
+        for mac in ('00:00:00:00:00:01', '00:00:00:00:00:02'):
+            details = self.broker.lookupMAC(mac)
+            self.assertEqual((details[2], details[8]), ('192.168.1.254', 7200))
+        #Both bindings still share one copy of the subnet's details.
+        self.assertTrue(self.broker.lookupMAC('00:00:00:00:00:01')[2] is self.broker.lookupMAC('00:00:00:00:00:02')[2])
+        
+    def test_outOfOrderCommit(self):
+        #Two transactions take consecutive positions, but the later one
+        #commits first; the triggers are replaced with explicit positions to
+        #reproduce that.
+        self._execute("DROP TRIGGER maps_changelog_update")
+        position = self.broker._getChangelogPosition()
+        
+        self._execute(
+         "UPDATE maps SET ip = '192.168.1.202' WHERE mac = '00:00:00:00:00:02'",
+         "INSERT INTO maps_changelog (id, mac) VALUES (%i, '00:00:00:00:00:02')" % (position + 2),
+        )
+        self.clock.now += 5
+        self.assertEqual(self.broker._patchSnapshot(), 1)
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:02')[0], '192.168.1.202')
+        
+        self._execute(
+         "UPDATE maps SET ip = '192.168.1.201' WHERE mac = '00:00:00:00:00:01'",
+         "INSERT INTO maps_changelog (id, mac) VALUES (%i, '00:00:00:00:00:01')" % (position + 1),
+        )
+        self.clock.now += 5
+        self.broker._patchSnapshot()
+        self.assertEqual(self.broker.lookupMAC('00:00:00:00:00:01')[0], '192.168.1.201')
+        
+    def test_windowAdvances(self):
+        position = self.broker._getChangelogPosition()
+        self._execute("UPDATE maps SET ip = '192.168.1.201' WHERE mac = '00:00:00:00:00:01'")
+        self.clock.now += 5
+        self.broker._patchSnapshot()
+        self.assertEqual(self.broker._snapshot_marks[0][1], position)
+        
+        #Once the window has passed, patches no longer re-read that change.
+        self.clock.now += 61
+        self.broker._patchSnapshot()
+        self.assertEqual(self.broker._snapshot_marks[0][1], position + 2)
+        
+if __name__ == '__main__':
+    unittest.main()
+    
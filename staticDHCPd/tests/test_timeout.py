@@ -0,0 +1,225 @@
+# -*- encoding: utf-8 -*-
+"""
+staticDHCPd tests: query timeouts
+
+Purpose
+=======
+ Exercises the helper threads that let lookups be given up on.
+ 
+ Run from staticDHCPd/ with: python -m unittest discover -s tests
+ 
+Legal
+=====
+ This file is part of staticDHCPd.
+ staticDHCPd is free software; you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation; either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+ 
+ (C) Neil Tallim, 2013 <flan@uguu.ca>
+"""
+import _environment
+
+import threading
+import unittest
+
+from staticdhcpd import config
+from staticdhcpd.databases._breaker import (CircuitBreaker, DatabaseBusyError, DatabaseUnavailableError)
+from staticdhcpd.databases._generic import Database
+from staticdhcpd.databases._sql import MySQL, Oracle, PostgreSQL, _PooledConnection
+from staticdhcpd.databases._timeout import QueryRunner
+
+_TIMEOUT = 0.05 #: The number of seconds after which queries are given up on.
+
+class _Query(object):
+    """
+    A query that blocks until released.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        
+    def __call__(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        return value
+        
+class QueryRunnerTests(unittest.TestCase):
+    def setUp(self):
+        self.resource_lock = threading.BoundedSemaphore(1)
+        self.runner = QueryRunner(self.resource_lock, 1, _TIMEOUT)
+        
+    def test_call(self):
+        query = _Query()
+        query.release.set()
+        self.assertEqual(self.runner.call(query, (1,)), 1)
+        self.assertEqual(self.runner.call(query, (2,)), 2)
+        self.assertEqual(self.runner._threads, 1)
+        
+    def test_errors(self):
+        def fail():
+            raise KeyError('x')
+        self.assertRaises(KeyError, self.runner.call, fail, ())
+        
+    def test_abandonedCallsCapped(self):
+        query = _Query()
+        self.assertRaises(DatabaseUnavailableError, self.runner.call, query, (1,))
+        #The abandoned query still holds the only helper, so nothing more is
+        #started, and the failure isn't the database's.
+        self.assertRaises(DatabaseBusyError, self.runner.call, query, (2,))
+        self.assertEqual((query.calls, self.runner._threads), (1, 1))
+        
+        query.release.set()
+        self.assertEqual(self.runner.call(query, (3,)), 3)
+        self.assertEqual(self.runner._threads, 1)
+        
+    def test_lockQueueTime(self):
+        #A query that can't get the broker's lock in time is never made.
+        query = _Query()
+        query.release.set()
+        with self.resource_lock:
+            self.assertRaises(DatabaseBusyError, self.runner.call, query, (1,))
+        self.assertEqual(self.runner.call(query, (2,)), 2)
+        self.assertEqual(query.calls, 1)
+        
+class _Broker(Database):
+    """
+    A broker whose lookups run a given query.
+    """
+    def __init__(self, query):
+        self.query = query
+        self._setupBroker(1)
+        
+    def _lookupMAC(self, mac):
+        return self.query(None)
+        
+class BrokerTests(unittest.TestCase):
+    def setUp(self):
+        self._settings = (config.QUERY_TIMEOUT, config.BREAKER_THRESHOLD)
+        config.QUERY_TIMEOUT = _TIMEOUT
+        config.BREAKER_THRESHOLD = 2
+        
+    def tearDown(self):
+        (config.QUERY_TIMEOUT, config.BREAKER_THRESHOLD) = self._settings
+        
+    def test_busyNotAFailure(self):
+        query = _Query()
+        broker = _Broker(query)
+        self.assertRaises(DatabaseUnavailableError, broker.lookupMAC, '00:00:00:00:00:01')
+        for i in xrange(3):
+            self.assertRaises(DatabaseBusyError, broker.lookupMAC, '00:00:00:00:00:02')
+        self.assertEqual(broker._breaker._failures, 1)
+        self.assertTrue(broker._breaker.allow())
+        query.release.set()
+        
+    def test_probeAbandoned(self):
+        #A probe that never reached the database lets another through.
+        breaker = CircuitBreaker(1, 0)
+        breaker.fail()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.abandon()
+        self.assertTrue(breaker.allow())
+        
+    def test_boundedQueries(self):
+        #Brokers whose queries can't outlast the timeout need no helpers.
+        class _BoundedBroker(_Broker):
+            _bounded_queries = True
+        self.assertEqual(_BoundedBroker(_Query())._query_runner, None)
+        self.assertNotEqual(_Broker(_Query())._query_runner, None)
+        
+class _OperationalError(Exception):
+    """
+    Stands in for a database module's OperationalError.
+    """
+    
+class _Module(object):
+    """
+    Stands in for a database module.
+    """
+    OperationalError = _OperationalError
+    InterfaceError = _OperationalError
+    
+class _Pool(object):
+    """
+    Lends out reused connections, recording what becomes of them.
+    """
+    def __init__(self):
+        self.lent = 0
+        self.released = 0
+        self.discarded = 0
+        
+    def get(self):
+        self.lent += 1
+        return _PooledConnection(self, object(), 0, True, {})
+        
+    def _release(self, connection, created, state):
+        self.released += 1
+        
+    def _discard(self, connection):
+        self.discarded += 1
+        
+class _CXOracleError(object):
+    """
+    Stands in for the error object cx_Oracle passes as an exception's argument.
+    """
+    def __init__(self, message):
+        self.message = message
+        
+class EngineTimeoutTests(unittest.TestCase):
+    def _attempt(self, engine, error):
+        """
+        Runs a query, through engine, that fails with error, returning the
+        number of attempts and the pool's record.
+        """
+        broker = engine.__new__(engine) #The database module need not be installed.
+        broker._module = _Module
+        pool = _Pool()
+        broker._getConnection = pool.get
+        attempts = []
+        def query(db):
+            attempts.append(db)
+            raise error
+        self.assertRaises(_OperationalError, broker._withConnection, query)
+        return (len(attempts), pool)
+        
+    def _timeout(self, engine, error):
+        #A timeout on a reused connection is made once, and the connection
+        #is kept.
+        (attempts, pool) = self._attempt(engine, error)
+        self.assertEqual(attempts, 1)
+        self.assertEqual((pool.lent, pool.released, pool.discarded), (1, 1, 0))
+        
+    def test_postgresql(self):
+        error = _OperationalError('canceling statement due to statement timeout')
+        error.pgcode = '57014'
+        self._timeout(PostgreSQL, error)
+        
+    def test_mysql(self):
+        self._timeout(MySQL, _OperationalError(3024, 'Query execution was interrupted, maximum statement execution time exceeded'))
+        
+    def test_oracle(self):
+        self._timeout(Oracle, _OperationalError(_CXOracleError('DPI-1067: call timeout of 50 ms exceeded')))
+        
+    def test_brokenConnection(self):
+        #Anything else on a reused connection discards it and tries again.
+        for (engine, error) in (
+         (PostgreSQL, _OperationalError('server closed the connection unexpectedly')),
+         (MySQL, _OperationalError(2006, 'MySQL server has gone away')),
+         (Oracle, _OperationalError(_CXOracleError('DPI-1080: connection was closed by ORA-3113'))),
+        ):
+            (attempts, pool) = self._attempt(engine, error)
+            self.assertEqual(attempts, 2)
+            self.assertEqual((pool.lent, pool.released, pool.discarded), (2, 0, 2))
+            
+if __name__ == '__main__':
+    unittest.main()
+    